@@ -0,0 +1,135 @@
+"""
+Audit log details as structural diffs
+
+An UPDATE log entry used to store the whole update payload, so every edit of
+a project copied its complete lists into db.logs. The details now hold only
+what changed between the stored document and the written values:
+
+    {"op": "change", "path": "status", "old": "Создан", "new": "Согласован"}
+    {"op": "add",    "path": "full_details.venue", "value": "..."}
+    {"op": "remove", "path": "full_details.notes", "old": "..."}
+    {"op": "add",    "path": "final_list.items[<line_id>]", "value": {...}}
+    {"op": "change", "path": "final_list.items[<line_id>].quantity", "old": 2, "new": 5}
+    {"op": "move",   "path": "final_list.items", "order": ["<line_id>", ...]}
+
+Objects are compared key by key, line items are matched by line_id (so an
+insertion in the middle of a list is one "add", not a shifted copy of the
+rest), other arrays by index.
+
+Diffs larger than AUDIT_COMPRESS_MIN_BYTES (default 0: never) are stored
+zlib-compressed as {"encoding": "zlib", "data": <binary>}; GET /api/logs
+expands them again.
+"""
+
+import os
+import zlib
+from typing import Any, Dict, List
+
+import orjson
+from bson import Binary
+
+from json_patch import values_equal
+
+COMPRESSED_ENCODING = "zlib"
+
+_MISSING = object()
+
+
+def _keyed(items: Any) -> bool:
+    """A list of line items that can be matched by line_id"""
+    return (
+        isinstance(items, list)
+        and all(isinstance(item, dict) and item.get("line_id") for item in items)
+        and len({item["line_id"] for item in items}) == len(items)
+    )
+
+
+def _diff(path: str, old: Any, new: Any, changes: List[Dict[str, Any]]):
+    if values_equal(old, new):
+        return
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key, old_value in old.items():
+            if key not in new:
+                changes.append({"op": "remove", "path": f"{path}.{key}", "old": old_value})
+        for key, value in new.items():
+            old_value = old.get(key, _MISSING)
+            if old_value is _MISSING:
+                changes.append({"op": "add", "path": f"{path}.{key}", "value": value})
+            else:
+                _diff(f"{path}.{key}", old_value, value, changes)
+        return
+
+    if isinstance(old, list) and isinstance(new, list):
+        if _keyed(old) and _keyed(new):
+            old_items = {item["line_id"]: item for item in old}
+            new_items = {item["line_id"]: item for item in new}
+            for line_id, item in old_items.items():
+                if line_id not in new_items:
+                    changes.append({"op": "remove", "path": f"{path}[{line_id}]", "old": item})
+            for line_id, item in new_items.items():
+                if line_id not in old_items:
+                    changes.append({"op": "add", "path": f"{path}[{line_id}]", "value": item})
+                else:
+                    _diff(f"{path}[{line_id}]", old_items[line_id], item, changes)
+            kept = [line_id for line_id in new_items if line_id in old_items]
+            if kept != [line_id for line_id in old_items if line_id in new_items]:
+                changes.append({"op": "move", "path": path, "order": list(new_items)})
+            return
+
+        for index in range(max(len(old), len(new))):
+            if index >= len(new):
+                changes.append({"op": "remove", "path": f"{path}[{index}]", "old": old[index]})
+            elif index >= len(old):
+                changes.append({"op": "add", "path": f"{path}[{index}]", "value": new[index]})
+            else:
+                _diff(f"{path}[{index}]", old[index], new[index], changes)
+        return
+
+    changes.append({"op": "change", "path": path, "old": old, "new": new})
+
+
+def structural_diff(old: Dict[str, Any], new: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Changes made by writing the fields of new over the stored document old
+
+    Fields missing from new are left alone (a $set payload); a None in new
+    replaces the stored value.
+    """
+    changes: List[Dict[str, Any]] = []
+    for field, value in new.items():
+        if field in ("updated_at", "version"):
+            continue
+        old_value = old.get(field, _MISSING)
+        if old_value is _MISSING:
+            changes.append({"op": "add", "path": field, "value": value})
+        else:
+            _diff(field, old_value, value, changes)
+    return changes
+
+
+class AuditDetails:
+    """Builds (and optionally compresses) the details of UPDATE log entries"""
+
+    def __init__(self):
+        self.compress_min_bytes = int(os.environ.get('AUDIT_COMPRESS_MIN_BYTES', 0))
+
+    def diff(self, old: Dict[str, Any], new: Dict[str, Any], **context) -> Dict[str, Any]:
+        """Details of an update: context (e.g. the entity name) plus the changes"""
+        return self.pack({**context, "changes": structural_diff(old, new)})
+
+    def pack(self, details: Dict[str, Any]) -> Dict[str, Any]:
+        if not self.compress_min_bytes:
+            return details
+        encoded = orjson.dumps(details, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+        if len(encoded) < self.compress_min_bytes:
+            return details
+        return {"encoding": COMPRESSED_ENCODING, "data": Binary(zlib.compress(encoded, 6))}
+
+
+def expand_details(log: Dict[str, Any]) -> Dict[str, Any]:
+    """Log entry with compressed details decoded (a no-op for plain ones)"""
+    details = log.get("details")
+    if isinstance(details, dict) and details.get("encoding") == COMPRESSED_ENCODING:
+        log["details"] = orjson.loads(zlib.decompress(details["data"]))
+    return log
@@ -2,7 +2,7 @@ from datetime import datetime, timedelta, timezone
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from models import TokenData, UserRole
 import os
@@ -14,8 +14,12 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
+# Tokens for the SSE change feed, passed in the URL (EventSource cannot set headers)
+STREAM_TOKEN_EXPIRE_SECONDS = int(os.getenv("STREAM_TOKEN_EXPIRE_SECONDS", 60))
+STREAM_SCOPE = "stream"
 
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -42,15 +46,23 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
-def decode_access_token(token: str) -> TokenData:
-    """Decode and verify a JWT access token"""
+def create_stream_token(token_data: TokenData) -> str:
+    """Create a short-lived token that only opens the change feed stream"""
+    return create_access_token(
+        {"sub": token_data.user_id, "email": token_data.email, "role": token_data.role.value, "scope": STREAM_SCOPE},
+        expires_delta=timedelta(seconds=STREAM_TOKEN_EXPIRE_SECONDS)
+    )
+
+
+def decode_access_token(token: str, scope: Optional[str] = None) -> TokenData:
+    """Decode and verify a JWT access token (or, with scope, a token issued for that scope only)"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
         email: str = payload.get("email")
         role: str = payload.get("role")
         
-        if user_id is None or email is None or role is None:
+        if user_id is None or email is None or role is None or payload.get("scope") != scope:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Could not validate credentials",
@@ -64,10 +76,35 @@ def decode_access_token(token: str) -> TokenData:
         )
 
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> TokenData:
+async def get_current_user(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> TokenData:
     """Get the current authenticated user from the JWT token"""
     token = credentials.credentials
-    return decode_access_token(token)
+    token_data = decode_access_token(token)
+    # Exposed to middleware (metrics are labelled by role)
+    request.state.user_role = token_data.role.value
+    return token_data
+
+
+async def get_stream_user(
+    request: Request,
+    token: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+) -> TokenData:
+    """The user of a change feed stream: a Bearer header, or a stream token in ?token="""
+    if credentials is not None:
+        token_data = decode_access_token(credentials.credentials)
+    elif token:
+        token_data = decode_access_token(token, scope=STREAM_SCOPE)
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+        )
+    request.state.user_role = token_data.role.value
+    return token_data
 
 
 async def get_current_admin_user(current_user: TokenData = Depends(get_current_user)) -> TokenData:
@@ -0,0 +1,92 @@
+"""
+Batched lookups by id
+
+BatchLoader is a DataLoader: load(id) calls issued while handling a request
+(for example from several coroutines gathered together) are collected until
+the event loop gets to run again and answered with one {"id": {"$in": [...]}}
+query. Results are cached for the loader's lifetime, so the same id is read
+once.
+
+Loaders are request-scoped - use the get_loaders dependency in server.py and
+read through loaders["inventory"] / loaders["equipment"] - so a cached
+document never outlives the request that read it.
+"""
+
+import asyncio
+from typing import Any, Dict, Iterable, List, Optional
+
+# Keys per $in query
+MAX_BATCH = 5000
+
+
+class BatchLoader:
+    """Coalesces loads of single documents into $in queries"""
+
+    def __init__(self, collection, projection: Dict[str, int], key: str = "id", max_batch: int = MAX_BATCH):
+        self.collection = collection
+        self.projection = projection
+        self.key = key
+        self.max_batch = max_batch
+        self._cache: Dict[Any, asyncio.Future] = {}
+        self._queue: List[Any] = []
+
+    def load(self, key: Any) -> "asyncio.Future[Optional[Dict[str, Any]]]":
+        """Future of the document with this key (None if there is none)"""
+        future = self._cache.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._cache[key] = loop.create_future()
+            if not self._queue:
+                # Dispatch once the current coroutines have queued their keys
+                loop.call_soon(self._dispatch)
+            self._queue.append(key)
+        return future
+
+    async def load_many(self, keys: Iterable[Any]) -> Dict[Any, Dict[str, Any]]:
+        """Documents by key; keys without a document are left out"""
+        keys = list(dict.fromkeys(keys))
+        documents = await asyncio.gather(*(self.load(key) for key in keys))
+        return {key: document for key, document in zip(keys, documents) if document is not None}
+
+    def prime(self, document: Dict[str, Any]):
+        """Cache a document read some other way"""
+        key = document[self.key]
+        future = self._cache.get(key)
+        if future is None or future.done():
+            future = self._cache[key] = asyncio.get_running_loop().create_future()
+        future.set_result(document)
+
+    def _dispatch(self):
+        queue, self._queue = self._queue, []
+        for start in range(0, len(queue), self.max_batch):
+            asyncio.ensure_future(self._fetch(queue[start:start + self.max_batch]))
+
+    async def _fetch(self, keys: List[Any]):
+        try:
+            cursor = self.collection.find({self.key: {"$in": keys}}, self.projection)
+            documents = {document[self.key]: document async for document in cursor}
+        except Exception as e:
+            for key in keys:
+                future = self._cache.pop(key)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key in keys:
+            future = self._cache[key]
+            if not future.done():
+                future.set_result(documents.get(key))
+
+
+class Loaders:
+    """Request-scoped loaders, one per collection, created on first use"""
+
+    def __init__(self, db, projections: Dict[str, Dict[str, int]]):
+        self.db = db
+        self.projections = projections
+        self._loaders: Dict[str, BatchLoader] = {}
+
+    def __getitem__(self, collection: str) -> BatchLoader:
+        loader = self._loaders.get(collection)
+        if loader is None:
+            loader = self._loaders[collection] = BatchLoader(self.db[collection], self.projections[collection])
+        return loader
@@ -0,0 +1,388 @@
+"""
+Real-time change feed for projects, inventory and equipment
+
+Every write is turned into an entity-level delta:
+
+    {"type": "change", "seq": 42, "entity": "projects", "op": "update",
+     "id": "<project id>", "fields": {"final_list": {...}, "updated_at": "..."},
+     "version": 7, "ts": "..."}
+
+and pushed to subscribed clients over SSE (GET /api/changes) or WebSocket
+(/api/changes/ws). Subscriptions select entities and, for projects, specific
+project ids, so a decorator editing one project only receives that project's
+deltas.
+
+Sources:
+- local: the write paths in server.py call publish() after each write
+  (single instance, or a MongoDB without change streams)
+- change_stream: when MongoDB is a replica set or sharded cluster, a change
+  stream on the three collections feeds every instance, including writes made
+  by other instances and by the upload queue; local publish() calls are then
+  ignored so clients do not receive each change twice
+
+Backpressure: each subscriber has a bounded queue. A consumer that falls
+behind by more than CHANGE_FEED_QUEUE_SIZE events has its backlog dropped and
+receives a single {"type": "resync"} event instead; the client refetches the
+entities it shows. Replaying a long backlog to a slow client would cost more
+than the refetch and hold memory for every event in between.
+
+Configuration (environment):
+    CHANGE_FEED_SOURCE=auto          auto | local (never open a change stream)
+    CHANGE_FEED_QUEUE_SIZE=256       per-subscriber backlog before a resync
+    CHANGE_FEED_HISTORY=1000         recent events kept for SSE reconnects (Last-Event-ID)
+    CHANGE_FEED_HEARTBEAT=15         seconds between keepalives on idle connections
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Deque, Dict, Iterable, List, Optional, Set, Union
+
+import orjson
+from pymongo.errors import OperationFailure, PyMongoError
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from metrics import CHANGE_FEED_EVENTS, CHANGE_FEED_RESYNCS, CHANGE_FEED_SUBSCRIBERS
+
+logger = logging.getLogger(__name__)
+
+# Entities are named after their collections
+ENTITIES = ("projects", "inventory", "equipment")
+
+# Change stream errors meaning the resume token is no longer usable
+HISTORY_LOST_CODES = (260, 280, 286)
+
+# Seconds between attempts to reopen a failed change stream
+CHANGE_STREAM_RETRY_SECONDS = 5
+
+
+def parse_entities(value: Union[None, str, Iterable[str]]) -> List[str]:
+    """Entities from "projects,inventory" or a list; all entities when empty"""
+    if not value:
+        return list(ENTITIES)
+    requested = [name.strip() for name in (value.split(",") if isinstance(value, str) else value) if name.strip()]
+    unknown = sorted(set(requested) - set(ENTITIES))
+    if unknown:
+        raise ValueError(f"Unknown entities: {', '.join(unknown)}. Available: {', '.join(ENTITIES)}")
+    return requested
+
+
+def parse_project_ids(value: Any) -> Optional[List[str]]:
+    """Project ids from a WebSocket message: a list of strings, or none for all projects"""
+    if value is None:
+        return None
+    if not isinstance(value, list) or not all(isinstance(project_id, str) for project_id in value):
+        raise ValueError("project_ids must be a list of strings")
+    return value
+
+
+def encode_event(event: Dict[str, Any]) -> bytes:
+    """JSON for the wire (datetimes as UTC with a "Z" suffix, like the REST responses)"""
+    return orjson.dumps(event, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+
+
+class Subscription:
+    """One client's filter and bounded event queue"""
+
+    def __init__(self, entities: Iterable[str], project_ids: Optional[Iterable[str]], queue_size: int):
+        self.queue_size = queue_size
+        self.update(entities, project_ids)
+        self._events: Deque[Dict[str, Any]] = deque()
+        self._wakeup = asyncio.Event()
+        self._overflowed = False
+
+    def update(self, entities: Iterable[str], project_ids: Optional[Iterable[str]]):
+        """Change the filter (WebSocket clients resubscribe when they open another project)"""
+        self.entities = frozenset(entities)
+        self.project_ids = frozenset(project_ids) if project_ids else None
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        entity = event.get("entity")
+        if entity is None:
+            # Feed-wide resync
+            return True
+        if entity not in self.entities:
+            return False
+        if entity == "projects" and self.project_ids is not None and event.get("id") is not None:
+            return event["id"] in self.project_ids
+        return True
+
+    def push(self, event: Dict[str, Any]):
+        """Queue an event without blocking the publisher"""
+        if self._overflowed:
+            return
+        if len(self._events) >= self.queue_size:
+            # Slow consumer: drop the backlog, the client refetches instead
+            self._events.clear()
+            self._overflowed = True
+            CHANGE_FEED_RESYNCS.labels("overflow").inc()
+        else:
+            self._events.append(event)
+        self._wakeup.set()
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Next event, or None if nothing arrived within timeout"""
+        if not self._events and not self._overflowed:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        if self._overflowed:
+            self._overflowed = False
+            return {"type": "resync", "reason": "overflow"}
+        return self._events.popleft()
+
+
+class ChangeFeed:
+    """Fan-out of entity changes to subscribers"""
+
+    def __init__(self, queue_size: Optional[int] = None, history_size: Optional[int] = None):
+        self.queue_size = queue_size or int(os.environ.get('CHANGE_FEED_QUEUE_SIZE', 256))
+        self.history: Deque[Dict[str, Any]] = deque(
+            maxlen=history_size or int(os.environ.get('CHANGE_FEED_HISTORY', 1000))
+        )
+        self.heartbeat = float(os.environ.get('CHANGE_FEED_HEARTBEAT', 15))
+        self.source = "local"
+        # Identifies this process's sequence numbers in SSE event ids
+        self.feed_id = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._subscriptions: Set[Subscription] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- publishing ----------
+
+    def publish(
+        self,
+        entity: str,
+        op: str,
+        entity_id: str,
+        fields: Optional[Dict[str, Any]] = None,
+        version: Optional[int] = None,
+    ):
+        """Record a write made by this process (ignored when a change stream is the source)"""
+        if self.source != "local":
+            return
+        self._dispatch(entity, op, entity_id, fields, version)
+
+    def _dispatch(self, entity: str, op: str, entity_id: str, fields: Optional[Dict[str, Any]], version: Optional[int]):
+        if fields and "_id" in fields:
+            # insert_one() adds the ObjectId to the inserted document
+            fields = {name: value for name, value in fields.items() if name != "_id"}
+        self._seq += 1
+        event = {
+            "type": "change",
+            "seq": self._seq,
+            "entity": entity,
+            "op": op,
+            "id": entity_id,
+            "fields": fields or {},
+            "version": version,
+            "ts": datetime.now(timezone.utc),
+        }
+        self.history.append(event)
+        CHANGE_FEED_EVENTS.labels(entity, op, self.source).inc()
+        for subscription in self._subscriptions:
+            if subscription.matches(event):
+                subscription.push(event)
+
+    def _resync_all(self, reason: str, entity: Optional[str] = None):
+        """Tell subscribers to refetch (changes were missed)"""
+        event = {"type": "resync", "reason": reason, "entity": entity}
+        CHANGE_FEED_RESYNCS.labels(reason).inc()
+        for subscription in self._subscriptions:
+            if subscription.matches(event):
+                subscription.push(event)
+
+    # ---------- subscribing ----------
+
+    def subscribe(self, entities: Optional[Iterable[str]] = None, project_ids: Optional[Iterable[str]] = None) -> Subscription:
+        subscription = Subscription(entities or ENTITIES, project_ids, self.queue_size)
+        self._subscriptions.add(subscription)
+        CHANGE_FEED_SUBSCRIBERS.set(len(self._subscriptions))
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscriptions.discard(subscription)
+        CHANGE_FEED_SUBSCRIBERS.set(len(self._subscriptions))
+
+    def event_id(self, event: Dict[str, Any]) -> str:
+        return f"{self.feed_id}:{event['seq']}"
+
+    def replay(self, subscription: Subscription, last_event_id: str) -> List[Dict[str, Any]]:
+        """
+        Events a reconnecting SSE client missed
+
+        Returns a single resync event if the id belongs to another process or
+        the missed events are no longer in the history.
+        """
+        feed_id, _, seq = last_event_id.partition(":")
+        if feed_id != self.feed_id or not seq.isdigit():
+            return [{"type": "resync", "reason": "reconnect"}]
+        seq = int(seq)
+        if seq >= self._seq:
+            return []
+        if not self.history or self.history[0]["seq"] > seq + 1:
+            return [{"type": "resync", "reason": "reconnect"}]
+        return [event for event in self.history if event["seq"] > seq and subscription.matches(event)]
+
+    def _ready_event(self) -> Dict[str, Any]:
+        return {"type": "ready", "feed_id": self.feed_id, "seq": self._seq, "source": self.source}
+
+    async def sse_stream(
+        self,
+        entities: List[str],
+        project_ids: Optional[List[str]] = None,
+        last_event_id: Optional[str] = None,
+    ) -> AsyncIterator[bytes]:
+        """text/event-stream body for one client; unsubscribes when the client goes away"""
+        # Subscribed here rather than by the caller so a response that is never
+        # iterated cannot leave a subscription behind
+        subscription = self.subscribe(entities, project_ids)
+        # Taken together with subscribing: later events arrive through the queue only
+        missed = self.replay(subscription, last_event_id) if last_event_id else []
+        try:
+            yield b"retry: 3000\n" + self._sse_message(self._ready_event())
+            for event in missed:
+                yield self._sse_message(event)
+            while True:
+                event = await subscription.get(timeout=self.heartbeat)
+                if event is None:
+                    yield b": keepalive\n\n"
+                else:
+                    yield self._sse_message(event)
+        finally:
+            self.unsubscribe(subscription)
+
+    async def websocket_session(self, websocket: WebSocket, entities: List[str], project_ids: Optional[List[str]] = None):
+        """
+        Push events to an accepted, authenticated WebSocket
+
+        The client may send {"entities": [...], "project_ids": [...]} at any
+        time to change its subscription.
+        """
+        subscription = self.subscribe(entities, project_ids)
+
+        async def receive_filters():
+            while True:
+                message = await websocket.receive_json()
+                try:
+                    subscription.update(
+                        parse_entities(message.get("entities")), parse_project_ids(message.get("project_ids"))
+                    )
+                except (AttributeError, ValueError) as e:
+                    await websocket.send_text(encode_event({"type": "error", "detail": str(e)}).decode())
+
+        async def send_events():
+            await websocket.send_text(encode_event(self._ready_event()).decode())
+            while True:
+                event = await subscription.get(timeout=self.heartbeat)
+                # A slow socket blocks here, so events pile up in the subscription queue
+                # until it overflows into a resync
+                await websocket.send_text(encode_event(event or {"type": "ping"}).decode())
+
+        tasks = [asyncio.create_task(receive_filters()), asyncio.create_task(send_events())]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if error and not isinstance(error, WebSocketDisconnect):
+                    logger.warning(f"Change feed WebSocket closed: {error!r}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.unsubscribe(subscription)
+
+    def _sse_message(self, event: Dict[str, Any]) -> bytes:
+        if event["type"] == "change":
+            return b"id: " + self.event_id(event).encode() + b"\nevent: change\ndata: " + encode_event(event) + b"\n\n"
+        return b"event: " + event["type"].encode() + b"\ndata: " + encode_event(event) + b"\n\n"
+
+    # ---------- change streams ----------
+
+    async def start(self, db):
+        """Switch to a change stream when the deployment supports one"""
+        if os.environ.get('CHANGE_FEED_SOURCE', 'auto') == 'local':
+            return
+        try:
+            hello = await db.command("hello")
+            build_info = await db.command("buildInfo")
+        except Exception as e:
+            logger.info(f"Change feed: using local events ({e})")
+            return
+        if not hello.get("setName") and hello.get("msg") != "isdbgrid":
+            logger.info("Change feed: standalone MongoDB, using local events")
+            return
+
+        # Pre-images (MongoDB 6.0+) identify deleted documents by their "id" field
+        pre_images = build_info.get("versionArray", [0])[0] >= 6
+        self.source = "change_stream"
+        self._task = asyncio.create_task(self._watch(db, pre_images))
+        logger.info("Change feed: using MongoDB change streams")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _watch(self, db, pre_images: bool):
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": list(ENTITIES)},
+            "operationType": {"$in": ["insert", "update", "replace", "delete"]},
+        }}]
+        options = {"full_document": "updateLookup"}
+        if pre_images:
+            options["full_document_before_change"] = "whenAvailable"
+        resume_token = None
+        while True:
+            try:
+                async with db.watch(pipeline, resume_after=resume_token, **options) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self._apply(change)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code in HISTORY_LOST_CODES:
+                    # The oplog rolled past our position: start fresh and make clients refetch
+                    resume_token = None
+                    self._resync_all("history_lost")
+                logger.warning(f"Change stream failed, reopening: {e}")
+                await asyncio.sleep(CHANGE_STREAM_RETRY_SECONDS)
+            except PyMongoError as e:
+                logger.warning(f"Change stream interrupted, reopening: {e}")
+                await asyncio.sleep(CHANGE_STREAM_RETRY_SECONDS)
+
+    def _apply(self, change: Dict[str, Any]):
+        entity = change["ns"]["coll"]
+        operation = change["operationType"]
+        document = change.get("fullDocument")
+
+        if operation == "delete":
+            before = change.get("fullDocumentBeforeChange")
+            if before is None:
+                # Only the ObjectId is known; the client cannot tell which entity went away
+                self._resync_all("delete", entity)
+                return
+            self._dispatch(entity, "delete", before.get("id"), None, before.get("version"))
+            return
+
+        if document is None:
+            # Deleted before the lookup; the delete event follows
+            return
+        document.pop("_id", None)
+        if operation == "update":
+            description = change.get("updateDescription", {})
+            # Dotted paths ("images.2", "final_list.items") are reported as their top-level field
+            paths = list(description.get("updatedFields", {})) + list(description.get("removedFields", []))
+            top_level = {path.split(".", 1)[0] for path in paths}
+            fields = {name: document.get(name) for name in top_level}
+        else:
+            fields = document
+        self._dispatch(entity, "insert" if operation == "insert" else "update",
+                       document.get("id"), fields, document.get("version"))
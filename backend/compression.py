@@ -0,0 +1,211 @@
+"""
+Response compression (brotli / gzip)
+
+Pure ASGI middleware that picks an encoding from Accept-Encoding (brotli when
+the client accepts it and the brotli package is installed, gzip otherwise).
+
+- Single-body responses are compressed in one go if they reach the minimum size
+- Streaming responses (NDJSON, SSE, file streams) are compressed chunk by
+  chunk with a sync flush after every chunk, so each line/event reaches the
+  client as soon as it is produced
+- Images and other already-compressed content types, responses that already
+  have a Content-Encoding, and the excluded path prefixes are passed through
+
+Configuration (environment):
+    COMPRESSION=0                   disable
+    COMPRESSION_MIN_SIZE=1024       smallest body worth compressing, bytes
+    COMPRESSION_GZIP_LEVEL=6        1 (fast) - 9 (small)
+    COMPRESSION_BROTLI_QUALITY=4    0 (fast) - 11 (small); 4-5 suits dynamic responses
+"""
+
+import asyncio
+import os
+import zlib
+from typing import Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Image files are already compressed; compressing them again only costs CPU
+EXCLUDED_PATH_PREFIXES = ("/api/uploads/", "/api/files/", "/api/telegram/image/")
+
+# Bodies at least this large are compressed in a worker thread (zlib and brotli release the GIL)
+THREAD_THRESHOLD = 256 * 1024
+
+# Content types that do not shrink
+INCOMPRESSIBLE_TYPES = ("image/", "video/", "audio/", "application/zip", "application/gzip", "application/octet-stream")
+
+
+class _Encoder:
+    """Incremental compressor with a common interface for gzip and brotli"""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            # wbits=31: zlib stream with a gzip header and trailer
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        """Emit everything compressed so far without ending the stream"""
+        if self.encoding == "br":
+            return self._compressor.flush()
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+def negotiate_encoding(accept_encoding: str, brotli_available: bool = True) -> Optional[str]:
+    """Preferred encoding from an Accept-Encoding header: br, gzip or None"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    wildcard = accepted.get("*", 0.0)
+    candidates = (("br",) if brotli_available else ()) + ("gzip",)
+    best, best_quality = None, 0.0
+    for encoding in candidates:
+        quality = accepted.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class CompressionMiddleware:
+    """Compress HTTP responses according to Accept-Encoding"""
+
+    def __init__(
+        self,
+        app,
+        minimum_size: Optional[int] = None,
+        gzip_level: Optional[int] = None,
+        brotli_quality: Optional[int] = None,
+    ):
+        self.app = app
+        self.enabled = os.environ.get('COMPRESSION', '1') not in ('0', 'false', 'no')
+        self.minimum_size = minimum_size if minimum_size is not None else int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+        self.gzip_level = gzip_level if gzip_level is not None else int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+        self.brotli_quality = (
+            brotli_quality if brotli_quality is not None else int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 4))
+        )
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http" or scope["path"].startswith(EXCLUDED_PATH_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = negotiate_encoding(accept_encoding, brotli is not None)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressingResponder(self, encoding, send)
+        await self.app(scope, receive, responder)
+
+
+class _CompressingResponder:
+    """send() wrapper that decides on compression once the first body chunk arrives"""
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.send = send
+        self.start_message = None
+        self.encoder: Optional[_Encoder] = None
+        # None until decided, then True (compressing) or False (pass-through)
+        self.compressing: Optional[bool] = None
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            # Held back until the first body chunk shows whether compression is worthwhile
+            self.start_message = message
+            return
+
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressing is None:
+            self.compressing = self._should_compress(body, more_body)
+            if not self.compressing:
+                await self.send(self.start_message)
+            else:
+                self.encoder = _Encoder(self.encoding, self.middleware.gzip_level, self.middleware.brotli_quality)
+                if not more_body:
+                    # Whole body available: compress and send with an exact Content-Length
+                    if len(body) >= THREAD_THRESHOLD:
+                        compressed = await asyncio.to_thread(self._compress_all, body)
+                    else:
+                        compressed = self._compress_all(body)
+                    await self.send(self._compressed_start(len(compressed)))
+                    await self.send({"type": "http.response.body", "body": compressed})
+                    return
+                await self.send(self._compressed_start(None))
+
+        if not self.compressing:
+            await self.send(message)
+            return
+
+        data = self.encoder.compress(body)
+        data += self.encoder.flush() if more_body else self.encoder.finish()
+        await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+    def _compress_all(self, body: bytes) -> bytes:
+        return self.encoder.compress(body) + self.encoder.finish()
+
+    def _should_compress(self, body: bytes, more_body: bool) -> bool:
+        headers, content_type = self._headers()
+        if b"content-encoding" in headers:
+            return False
+        if content_type.startswith(INCOMPRESSIBLE_TYPES):
+            return False
+        # Streams are compressed regardless of the first chunk's size
+        return more_body or len(body) >= self.middleware.minimum_size
+
+    def _headers(self) -> Tuple[set, str]:
+        names = set()
+        content_type = ""
+        for name, value in self.start_message.get("headers", []):
+            names.add(name.lower())
+            if name.lower() == b"content-type":
+                content_type = value.decode("latin-1").lower()
+        return names, content_type
+
+    def _compressed_start(self, content_length: Optional[int]):
+        original = self.start_message.get("headers", [])
+        headers = [(name, value) for name, value in original if name.lower() not in (b"content-length", b"vary")]
+        vary = b", ".join(value for name, value in original if name.lower() == b"vary")
+        if b"accept-encoding" not in vary.lower():
+            vary = vary + b", Accept-Encoding" if vary else b"Accept-Encoding"
+        headers.append((b"content-encoding", self.encoding.encode()))
+        headers.append((b"vary", vary))
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode()))
+        return {**self.start_message, "headers": headers}
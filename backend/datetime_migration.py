@@ -0,0 +1,156 @@
+"""
+Online migration of ISO-string timestamps to native BSON datetimes
+
+Documents written before datetimes were stored natively hold them as ISO
+strings. The migration pages through each collection by _id, parses the string
+fields and rewrites them in bulk. Each update is conditional on the field still
+holding the original string, so a concurrent write from the app always wins and
+the migration can run while the API is serving traffic. It is idempotent: a
+second run finds nothing to do.
+
+Run it from the command line (reads MONGO_URL/DB_NAME from backend/.env):
+
+    python datetime_migration.py [--batch-size 500] [--pause-ms 50] [--dry-run]
+
+The API also runs it in the background on startup.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Top-level datetime fields per collection
+DATETIME_FIELDS = {
+    "users": ("created_at", "last_login"),
+    "projects": ("project_date", "created_at", "updated_at"),
+    "inventory": ("created_at", "updated_at"),
+    "equipment": ("created_at", "updated_at"),
+    "logs": ("timestamp",),
+    "upload_jobs": ("next_attempt_at", "lease_until", "created_at", "updated_at"),
+    "telegram_deletions": ("created_at",),
+}
+
+
+def parse_timestamp(value: str) -> Optional[datetime]:
+    """Parse an ISO timestamp as stored by earlier versions; naive values are UTC"""
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class DatetimeMigration:
+    """Rewrites string timestamps as BSON datetimes in batches"""
+
+    def __init__(self, db, batch_size: int = 500, pause_seconds: float = 0.05):
+        """
+        Args:
+            db: Motor database
+            batch_size: Documents read and rewritten per round trip
+            pause_seconds: Sleep between batches to leave room for API traffic
+        """
+        self.db = db
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+
+    async def run(self, dry_run: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        Migrate every collection
+
+        Returns:
+            Per collection: scanned documents, rewritten documents and values
+            that could not be parsed (left as strings)
+        """
+        report = {}
+        for collection, fields in DATETIME_FIELDS.items():
+            report[collection] = await self.migrate_collection(collection, fields, dry_run=dry_run)
+        return report
+
+    async def migrate_collection(self, name: str, fields, dry_run: bool = False) -> Dict[str, Any]:
+        collection = self.db[name]
+        stats = {"scanned": 0, "migrated": 0, "unparseable": 0}
+        started = time.monotonic()
+
+        string_filter = {"$or": [{field: {"$type": "string"}} for field in fields]}
+        last_id = None
+        while True:
+            query = string_filter if last_id is None else {"$and": [string_filter, {"_id": {"$gt": last_id}}]}
+            cursor = collection.find(query, {field: 1 for field in fields}).sort("_id", 1).limit(self.batch_size)
+            docs = await cursor.to_list(self.batch_size)
+            if not docs:
+                break
+            last_id = docs[-1]["_id"]
+            stats["scanned"] += len(docs)
+
+            operations = []
+            for doc in docs:
+                condition = {"_id": doc["_id"]}
+                update = {}
+                for field in fields:
+                    value = doc.get(field)
+                    if not isinstance(value, str):
+                        continue
+                    parsed = parse_timestamp(value)
+                    if parsed is None:
+                        stats["unparseable"] += 1
+                        continue
+                    # Only rewrite if the app has not replaced the value meanwhile
+                    condition[field] = value
+                    update[field] = parsed
+                if update:
+                    operations.append(UpdateOne(condition, {"$set": update}))
+
+            if operations and not dry_run:
+                result = await collection.bulk_write(operations, ordered=False)
+                stats["migrated"] += result.modified_count
+            elif operations:
+                stats["migrated"] += len(operations)
+
+            if len(docs) < self.batch_size:
+                break
+            await asyncio.sleep(self.pause_seconds)
+
+        stats["duration_seconds"] = round(time.monotonic() - started, 3)
+        if stats["migrated"] or stats["unparseable"]:
+            logger.info(
+                f"Datetime migration {'(dry run) ' if dry_run else ''}{name}: "
+                f"{stats['migrated']} documents rewritten, {stats['unparseable']} unparseable values"
+            )
+        return stats
+
+
+async def _main(args):
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True, tzinfo=timezone.utc)
+    db = client[os.environ.get('DB_NAME', 'sls1_db')]
+    try:
+        migration = DatetimeMigration(db, batch_size=args.batch_size, pause_seconds=args.pause_ms / 1000)
+        report = await migration.run(dry_run=args.dry_run)
+    finally:
+        client.close()
+
+    for collection, stats in report.items():
+        print(f"{collection:<20} scanned {stats['scanned']:>7}  migrated {stats['migrated']:>7}  "
+              f"unparseable {stats['unparseable']:>5}  ({stats['duration_seconds']} s)")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Convert ISO-string timestamps to BSON datetimes")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause-ms", type=float, default=50, help="Pause between batches")
+    parser.add_argument("--dry-run", action="store_true", help="Count documents without rewriting them")
+    asyncio.run(_main(parser.parse_args()))
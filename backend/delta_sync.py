@@ -0,0 +1,265 @@
+"""
+Delta sync ("changes since") for offline-capable clients
+
+GET /api/sync?since=<token> returns the projects, inventory and equipment
+items written since the token, plus tombstones for the ones deleted, and a new
+token to pass next time. Without a token (or with one older than the tombstone
+retention, or than the last wholesale reload of the data) the client gets a
+full snapshot, starting with "reset": true, and replaces its local copy.
+
+Documents are read in (updated_at, id) order, which the write paths keep
+meaningful by setting updated_at, so a sync is a range scan on an index and
+its cost follows the number of changes, not the size of the collections.
+Responses are paged ("has_more"): the token then carries the position of the
+last document as well as its updated_at, so a page boundary inside a
+millisecond shared by more than a page of documents (bulk imports, snapshot
+fan-out) still moves forward. A snapshot is paged the same way; when its last
+page is sent, the token goes back to when the snapshot started, so whatever
+changed or was deleted meanwhile follows as ordinary changes.
+
+Once there is nothing more to page, the next token is taken OVERLAP_SECONDS
+before the read, so a write that was still in flight (or stamped by an
+instance with a slightly late clock) is picked up by the following sync.
+Clients therefore receive some documents twice and apply them by id;
+"version" tells which copy is newer.
+
+Client algorithm:
+    1. GET /api/sync?since=<stored token>
+    2. reset: drop the local copy first
+    3. upsert projects/inventory/equipment by id, then remove ids in "deleted"
+    4. store "token"; repeat immediately while "has_more" is true
+
+Configuration (environment):
+    SYNC_TOMBSTONE_DAYS=30    how long deletions are remembered
+    SYNC_OVERLAP_SECONDS=5    re-read window behind the token
+"""
+
+import base64
+import binascii
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from models import EquipmentItem, InventoryItem, Project
+from responses import model_projection, trusted_documents
+
+logger = logging.getLogger(__name__)
+
+# Synced collections and the models their documents are written from
+SYNC_MODELS = {
+    "projects": Project,
+    "inventory": InventoryItem,
+    "equipment": EquipmentItem,
+}
+
+# Documents per collection per response
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 2000
+
+# Snapshots start from the beginning of time
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Cursor key of the tombstones (ordered by deleted_at, _id)
+TOMBSTONES = "tombstones"
+
+
+class InvalidSyncToken(ValueError):
+    """The since parameter is not a token issued by this endpoint"""
+
+
+class SyncPosition:
+    """
+    Where a client is: a watermark plus, for collections whose previous page
+    ended exactly on it, the id of the last document sent at that millisecond
+
+    snapshot is when the snapshot being paged started (None between deltas).
+    """
+
+    def __init__(self, watermark: datetime, after: Optional[Dict[str, str]] = None,
+                 snapshot: Optional[datetime] = None):
+        self.watermark = watermark
+        self.after = after or {}
+        self.snapshot = snapshot
+
+    def query(self, collection: str, field: str, tiebreak: str) -> Dict[str, Any]:
+        """Documents at or after the position in (field, tiebreak) order"""
+        last = self.after.get(collection)
+        if last is None:
+            return {field: {"$gte": self.watermark}}
+        if tiebreak == "_id":
+            last = ObjectId(last)
+        return {"$or": [
+            {field: {"$gt": self.watermark}},
+            {field: self.watermark, tiebreak: {"$gt": last}},
+        ]}
+
+
+def encode_token(position: SyncPosition) -> str:
+    token = str(_millis(position.watermark))
+    if position.after or position.snapshot:
+        state = {"after": position.after}
+        if position.snapshot:
+            state["snapshot"] = _millis(position.snapshot)
+        token += "." + base64.urlsafe_b64encode(orjson.dumps(state)).decode().rstrip("=")
+    return token
+
+
+def decode_token(token: str) -> SyncPosition:
+    millis, _, encoded = token.partition(".")
+    if not millis.isdigit():
+        raise InvalidSyncToken("Invalid sync token")
+    position = SyncPosition(_from_millis(int(millis)))
+    if not encoded:
+        return position
+    try:
+        state = orjson.loads(base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4)))
+        after = state.get("after") or {}
+        if not all(isinstance(key, str) and isinstance(value, str) for key, value in after.items()):
+            raise ValueError("cursor ids must be strings")
+        if TOMBSTONES in after:
+            ObjectId(after[TOMBSTONES])
+        snapshot = state.get("snapshot")
+        position.after = after
+        position.snapshot = _from_millis(int(snapshot)) if snapshot is not None else None
+    except (binascii.Error, ValueError, TypeError, AttributeError, InvalidId, orjson.JSONDecodeError):
+        raise InvalidSyncToken("Invalid sync token")
+    return position
+
+
+def _millis(value: datetime) -> int:
+    return int(_as_utc(value).timestamp() * 1000)
+
+
+def _from_millis(millis: int) -> datetime:
+    return datetime.fromtimestamp(millis / 1000, tz=timezone.utc)
+
+
+class DeltaSync:
+    """Change queries over updated_at and the tombstone collection"""
+
+    def __init__(self, db):
+        self.db = db
+        self.tombstones = db.tombstones
+        self.state = db.sync_state
+        self.retention = timedelta(days=float(os.environ.get('SYNC_TOMBSTONE_DAYS', 30)))
+        self.overlap = timedelta(seconds=float(os.environ.get('SYNC_OVERLAP_SECONDS', 5)))
+        self.projections = {name: model_projection(model) for name, model in SYNC_MODELS.items()}
+
+    async def start(self):
+        """Create the indexes the sync queries rely on"""
+        for collection in SYNC_MODELS:
+            await self.db[collection].create_index([("updated_at", 1), ("id", 1)])
+        await self.tombstones.create_index([("deleted_at", 1)], expireAfterSeconds=int(self.retention.total_seconds()))
+
+    async def record_deletion(self, collection: str, entity_id: str):
+        """Remember a deleted document until every client has had the chance to sync"""
+        await self.tombstones.insert_one({
+            "collection": collection,
+            "id": entity_id,
+            "deleted_at": datetime.now(timezone.utc),
+        })
+
+    async def reset(self):
+        """
+        Forget the tombstones after the data was replaced wholesale
+
+        Tokens issued before get a full snapshot, as the deletions they would
+        need are gone.
+        """
+        await self.tombstones.delete_many({})
+        # Past the millisecond of the tokens already handed out
+        at = _from_millis(_millis(datetime.now(timezone.utc)) + 1)
+        await self.state.update_one({"_id": "reset"}, {"$set": {"at": at}}, upsert=True)
+
+    async def _oldest_valid(self, now: datetime) -> datetime:
+        """
+        Tokens older than this get a snapshot: tombstone retention, or the last
+        reset (tokens handed out after it start at most the overlap before it)
+        """
+        oldest = now - self.retention
+        state = await self.state.find_one({"_id": "reset"})
+        if state and _as_utc(state["at"]) - self.overlap > oldest:
+            oldest = _as_utc(state["at"]) - self.overlap
+        return oldest
+
+    async def changes(self, since: Optional[str] = None, limit: int = DEFAULT_LIMIT) -> Dict[str, Any]:
+        """
+        Changes after a sync token
+
+        Raises:
+            InvalidSyncToken: since is not a token issued by this endpoint
+        """
+        now = datetime.now(timezone.utc)
+        position = decode_token(since) if since else None
+        reset = position is None or (position.snapshot or position.watermark) < await self._oldest_valid(now)
+        if reset:
+            position = SyncPosition(EPOCH, snapshot=now)
+        snapshot = position.snapshot is not None
+
+        # Last (sort value, tiebreak) sent of every collection that has more
+        page_ends: Dict[str, Tuple[datetime, Any]] = {}
+        response: Dict[str, Any] = {}
+
+        for collection, model in SYNC_MODELS.items():
+            docs = await (
+                self.db[collection].find(position.query(collection, "updated_at", "id"), self.projections[collection])
+                .sort([("updated_at", 1), ("id", 1)])
+                .limit(limit + 1)
+                .to_list(limit + 1)
+            )
+            if len(docs) > limit:
+                docs = docs[:limit]
+                page_ends[collection] = (_as_utc(docs[-1]["updated_at"]), docs[-1]["id"])
+            response[collection] = trusted_documents(model, docs)
+
+        deleted: Dict[str, List[str]] = {collection: [] for collection in SYNC_MODELS}
+        if not snapshot:
+            # The client has everything up to its token, deletions included
+            tombstones = await (
+                self.tombstones.find(
+                    position.query(TOMBSTONES, "deleted_at", "_id"),
+                    {"_id": 1, "collection": 1, "id": 1, "deleted_at": 1}
+                )
+                .sort([("deleted_at", 1), ("_id", 1)])
+                .limit(limit + 1)
+                .to_list(limit + 1)
+            )
+            if len(tombstones) > limit:
+                tombstones = tombstones[:limit]
+                page_ends[TOMBSTONES] = (_as_utc(tombstones[-1]["deleted_at"]), tombstones[-1]["_id"])
+            for tombstone in tombstones:
+                deleted.setdefault(tombstone["collection"], []).append(tombstone["id"])
+
+        if page_ends:
+            # Continue from the earliest page end; the other collections re-read from there
+            watermark = min(end for end, _ in page_ends.values())
+            next_position = SyncPosition(
+                watermark,
+                {name: str(last) for name, (end, last) in page_ends.items() if end == watermark},
+                position.snapshot
+            )
+        elif snapshot:
+            # Snapshot complete: continue with what changed since it started
+            next_position = SyncPosition(position.snapshot - self.overlap)
+        else:
+            # Never advance past what may still be in flight, and never move backwards
+            # (a client syncing again within the overlap window)
+            next_position = SyncPosition(max(now - self.overlap, position.watermark))
+
+        response.update({
+            "token": encode_token(next_position),
+            "reset": reset,
+            "has_more": bool(page_ends),
+            "deleted": deleted,
+        })
+        return response
+
+
+def _as_utc(value: datetime) -> datetime:
+    """Naive datetimes (a client opened without tz_aware) are UTC"""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
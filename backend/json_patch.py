@@ -0,0 +1,270 @@
+"""
+JSON Patch (RFC 6902) and JSON Merge Patch (RFC 7396) for stored documents
+
+A patch is applied in memory to the current document, and the difference
+between the two versions is compiled into the smallest MongoDB update:
+
+- changed or added object members    -> $set on the dotted path
+- removed object members             -> $unset on the dotted path
+- arrays that only grew at the end   -> $push with $each
+- arrays of unchanged length         -> $set of the changed elements by index,
+                                        each applied only if the stored element
+                                        is still the one that was read
+- any other array change             -> $set of the whole array, applied only
+                                        if the stored array is still the one
+                                        the patch was computed against
+
+Editors touching different fields (or different keys of full_details) thus
+never overwrite each other, and a payload of a few operators replaces the
+whole-document PATCH body.
+"""
+
+import copy
+from typing import Any, Dict, List, Tuple
+
+JSON_PATCH_MEDIA_TYPE = "application/json-patch+json"
+MERGE_PATCH_MEDIA_TYPE = "application/merge-patch+json"
+
+_MISSING = object()
+
+
+class PatchError(ValueError):
+    """The patch is malformed or cannot be applied to the document"""
+
+
+class PatchTestFailed(PatchError):
+    """A "test" operation did not match"""
+
+
+# ---------- RFC 6901 JSON Pointer ----------
+
+def parse_pointer(pointer: str) -> List[str]:
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise PatchError(f"Invalid JSON Pointer: {pointer!r}")
+    return [token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")]
+
+
+def _array_index(array: list, token: str, allow_end: bool) -> int:
+    if token == "-" and allow_end:
+        return len(array)
+    if not token.isdigit() or (token != "0" and token.startswith("0")):
+        raise PatchError(f"Invalid array index: {token!r}")
+    index = int(token)
+    if index > len(array) or (index == len(array) and not allow_end):
+        raise PatchError(f"Array index out of range: {index}")
+    return index
+
+
+def _resolve(document: Any, tokens: List[str]) -> Any:
+    value = document
+    for token in tokens:
+        if isinstance(value, dict):
+            if token not in value:
+                raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+            value = value[token]
+        elif isinstance(value, list):
+            value = value[_array_index(value, token, allow_end=False)]
+        else:
+            raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+    return value
+
+
+def _add(document: Any, tokens: List[str], value: Any) -> Any:
+    if not tokens:
+        return value
+    parent = _resolve(document, tokens[:-1])
+    if isinstance(parent, dict):
+        parent[tokens[-1]] = value
+    elif isinstance(parent, list):
+        parent.insert(_array_index(parent, tokens[-1], allow_end=True), value)
+    else:
+        raise PatchError(f"Cannot add to a scalar: /{'/'.join(tokens)}")
+    return document
+
+
+def _remove(document: Any, tokens: List[str]) -> Any:
+    if not tokens:
+        raise PatchError("Cannot remove the whole document")
+    parent = _resolve(document, tokens[:-1])
+    if isinstance(parent, dict):
+        if tokens[-1] not in parent:
+            raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+        return parent.pop(tokens[-1])
+    if isinstance(parent, list):
+        return parent.pop(_array_index(parent, tokens[-1], allow_end=False))
+    raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+
+
+def apply_json_patch(document: Dict[str, Any], operations: Any) -> Dict[str, Any]:
+    """Apply RFC 6902 operations to a copy of the document"""
+    if not isinstance(operations, list):
+        raise PatchError("A JSON Patch must be an array of operations")
+    result = copy.deepcopy(document)
+    for number, operation in enumerate(operations):
+        if not isinstance(operation, dict) or "op" not in operation or "path" not in operation:
+            raise PatchError(f"Operation {number}: \"op\" and \"path\" are required")
+        op = operation["op"]
+        tokens = parse_pointer(operation["path"])
+        if op in ("add", "replace", "test") and "value" not in operation:
+            raise PatchError(f"Operation {number}: \"value\" is required for {op}")
+
+        if op == "add":
+            result = _add(result, tokens, copy.deepcopy(operation["value"]))
+        elif op == "remove":
+            _remove(result, tokens)
+        elif op == "replace":
+            _resolve(result, tokens)
+            if tokens:
+                _remove(result, tokens)
+            result = _add(result, tokens, copy.deepcopy(operation["value"]))
+        elif op in ("move", "copy"):
+            if "from" not in operation:
+                raise PatchError(f"Operation {number}: \"from\" is required for {op}")
+            source = parse_pointer(operation["from"])
+            if op == "move":
+                if tokens[:len(source)] == source and tokens != source:
+                    raise PatchError(f"Operation {number}: cannot move a value into itself")
+                value = _remove(result, source)
+            else:
+                value = copy.deepcopy(_resolve(result, source))
+            result = _add(result, tokens, value)
+        elif op == "test":
+            if _resolve(result, tokens) != operation["value"]:
+                raise PatchTestFailed(f"Test failed at {operation['path']}")
+        else:
+            raise PatchError(f"Operation {number}: unknown op {op!r}")
+    return result
+
+
+def apply_merge_patch(target: Any, patch: Any) -> Any:
+    """Apply an RFC 7396 merge patch (returns a new value)"""
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply_merge_patch(result.get(key), value)
+    return result
+
+
+# ---------- compiling to MongoDB operators ----------
+
+def _addressable(key: str) -> bool:
+    """Keys that can appear in a dotted update path"""
+    return bool(key) and "." not in key and not key.startswith("$")
+
+
+def values_equal(old: Any, new: Any) -> bool:
+    """Equal and of the same JSON type (1, 1.0 and True are different values to store)"""
+    if isinstance(old, dict) and isinstance(new, dict):
+        return old.keys() == new.keys() and all(values_equal(old[key], new[key]) for key in old)
+    if isinstance(old, list) and isinstance(new, list):
+        return len(old) == len(new) and all(values_equal(a, b) for a, b in zip(old, new))
+    if old != new:
+        return False
+    if isinstance(old, str) and isinstance(new, str):
+        # str-based enums from the model equal the stored strings
+        return True
+    return type(old) is type(new)
+
+
+def _diff(path: str, old: Any, new: Any, update: Dict[str, Dict[str, Any]], conditions: Dict[str, Any]):
+    if isinstance(old, dict) and isinstance(new, dict) and all(_addressable(key) for key in list(old) + list(new)):
+        for key in old:
+            if key not in new:
+                update["$unset"][f"{path}.{key}"] = ""
+        for key, value in new.items():
+            old_value = old.get(key, _MISSING)
+            if old_value is _MISSING:
+                update["$set"][f"{path}.{key}"] = value
+            elif not values_equal(old_value, value):
+                _diff(f"{path}.{key}", old_value, value, update, conditions)
+        return
+
+    if isinstance(old, list) and isinstance(new, list):
+        if len(new) > len(old) and new[:len(old)] == old:
+            update["$push"][path] = {"$each": new[len(old):]}
+            return
+        if len(new) == len(old):
+            for index, (old_item, new_item) in enumerate(zip(old, new)):
+                if not values_equal(old_item, new_item):
+                    item_path = f"{path}.{index}"
+                    # An index path is only right while that element is still where it was
+                    conditions[item_path] = old_item
+                    _diff(item_path, old_item, new_item, update, conditions)
+            return
+
+    update["$set"][path] = new
+    if isinstance(old, list):
+        # Rewriting an array by value: only if nobody changed it meanwhile
+        conditions[path] = old
+
+
+def compile_update(old: Dict[str, Any], new: Dict[str, Any]) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Any]]:
+    """
+    Minimal update turning the top-level fields of old into new
+
+    Returns:
+        (update, conditions): the update document (only non-empty operators)
+        and extra filter conditions that must hold for it to be applied
+    """
+    update: Dict[str, Dict[str, Any]] = {"$set": {}, "$unset": {}, "$push": {}}
+    conditions: Dict[str, Any] = {}
+    for key in set(old) | set(new):
+        old_value = old.get(key, _MISSING)
+        new_value = new.get(key, _MISSING)
+        if new_value is _MISSING:
+            update["$unset"][key] = ""
+        elif old_value is _MISSING:
+            update["$set"][key] = new_value
+        elif not values_equal(old_value, new_value):
+            _diff(key, old_value, new_value, update, conditions)
+    return {operator: fields for operator, fields in update.items() if fields}, conditions
+
+
+def _written(operation: Dict[str, Any]) -> List[List[str]]:
+    """Paths whose value an operation may change"""
+    op = operation.get("op")
+    pointers = []
+    if op in ("add", "replace", "remove", "move", "copy"):
+        pointers.append(operation["path"])
+    if op == "move":
+        pointers.append(operation["from"])
+    paths = []
+    for pointer in pointers:
+        tokens = parse_pointer(pointer)
+        if tokens and (tokens[-1] == "-" or tokens[-1].isdigit()):
+            # Inserting or removing an array element shifts the ones after it
+            tokens = tokens[:-1]
+        paths.append(tokens)
+    return paths
+
+
+def test_conditions(operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Filter conditions repeating the scalar "test" operations of a patch
+
+    The tests are evaluated against the document that was read; repeating them
+    in the update filter makes them hold at the moment of the write as well.
+    A test of a path that an earlier operation wrote (or of anything inside or
+    around it) checks the patch's own result, not the stored document, and
+    is not repeated.
+    """
+    conditions = {}
+    written: List[List[str]] = []
+    for operation in operations:
+        if operation.get("op") != "test":
+            written.extend(_written(operation))
+            continue
+        if isinstance(operation.get("value"), (dict, list)):
+            continue
+        tokens = parse_pointer(operation["path"])
+        if any(tokens[:len(path)] == path or path[:len(tokens)] == tokens for path in written):
+            continue
+        if tokens and all(_addressable(token) for token in tokens):
+            conditions[".".join(tokens)] = operation["value"]
+    return conditions
@@ -0,0 +1,69 @@
+"""
+Project list line items
+
+preliminary_list, final_list and dismantling_list are stored as
+{"items": [...]}. Every line item carries a line_id so the item endpoints can
+change a single entry with positional $set/$pull instead of rewriting the
+whole list. Lists written before line ids existed (or PATCHed whole by older
+clients) get them assigned.
+"""
+
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from models import ProjectListName
+
+logger = logging.getLogger(__name__)
+
+
+def list_field(list_name: ProjectListName) -> str:
+    """Project field holding the list ("final" -> "final_list")"""
+    return f"{list_name.value}_list"
+
+
+LIST_FIELDS = tuple(list_field(name) for name in ProjectListName)
+
+
+def new_line_id() -> str:
+    return str(uuid.uuid4())
+
+
+def ensure_line_ids(project_list: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Copy of a list value in which every item has a line_id"""
+    if not isinstance(project_list, dict) or not isinstance(project_list.get("items"), list):
+        return project_list
+    items = [
+        item if not isinstance(item, dict) or item.get("line_id") else {"line_id": new_line_id(), **item}
+        for item in project_list["items"]
+    ]
+    return {**project_list, "items": items}
+
+
+async def assign_missing_line_ids(db) -> int:
+    """
+    Backfill line ids in stored projects (runs in the background on startup)
+
+    Each list is rewritten only if it still holds the items that were read,
+    so a concurrent edit is never overwritten. Returns the number of lists updated.
+    """
+    updated = 0
+    for field in LIST_FIELDS:
+        query = {f"{field}.items": {"$elemMatch": {"line_id": {"$exists": False}}}}
+        async for doc in db.projects.find(query, {"_id": 1, field: 1}):
+            items = doc[field]["items"]
+            result = await db.projects.update_one(
+                {"_id": doc["_id"], f"{field}.items": items},
+                {
+                    "$set": {
+                        field: ensure_line_ids(doc[field]),
+                        "updated_at": datetime.now(timezone.utc)
+                    },
+                    "$inc": {"version": 1}
+                }
+            )
+            updated += result.modified_count
+    if updated:
+        logger.info(f"Assigned line ids in {updated} project lists")
+    return updated
@@ -0,0 +1,160 @@
+"""
+Event loop watchdog
+
+A heartbeat coroutine wakes up every few milliseconds and records event loop
+lag. A separate thread watches the heartbeat: when it goes stale for longer
+than the threshold, the loop is blocked by a synchronous call (bcrypt, Pillow,
+file I/O, ...) and the thread captures the loop thread's stack while the call
+is still running. Each stall is logged with that stack, counted in
+event_loop_stalls_total by code location and kept in a ring buffer for the
+admin endpoint.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional
+
+from metrics import EVENT_LOOP_LAG, EVENT_LOOP_LAG_LAST, EVENT_LOOP_STALLS
+
+logger = logging.getLogger(__name__)
+
+# Frames from this directory are application code; the innermost one names the stall location
+APP_DIR = str(Path(__file__).parent)
+
+# Frames kept in a stall report
+STACK_LIMIT = 40
+
+
+def _location(frames: List[traceback.FrameSummary]) -> str:
+    """file:function of the innermost application frame (library frames are less useful)"""
+    for frame in reversed(frames):
+        if frame.filename.startswith(APP_DIR) and "site-packages" not in frame.filename:
+            return f"{Path(frame.filename).name}:{frame.name}"
+    if frames:
+        return f"{Path(frames[-1].filename).name}:{frames[-1].name}"
+    return "unknown"
+
+
+class LoopWatchdog:
+    """Measures event loop lag and captures the stack of loop-blocking calls"""
+
+    def __init__(
+        self,
+        threshold_ms: Optional[float] = None,
+        interval: Optional[float] = None,
+        size: Optional[int] = None,
+    ):
+        """
+        Args:
+            threshold_ms: Stalls at least this long are reported (LOOP_STALL_THRESHOLD_MS, default 100)
+            interval: Heartbeat period in seconds (LOOP_HEARTBEAT_INTERVAL, default 0.05)
+            size: Ring buffer capacity (LOOP_STALL_LOG_SIZE, default 100)
+        """
+        self.threshold_ms = threshold_ms if threshold_ms is not None else float(os.environ.get('LOOP_STALL_THRESHOLD_MS', 100))
+        self.interval = interval if interval is not None else float(os.environ.get('LOOP_HEARTBEAT_INTERVAL', 0.05))
+        self.enabled = os.environ.get('LOOP_WATCHDOG', '1') not in ('0', 'false', 'no')
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=size or int(os.environ.get('LOOP_STALL_LOG_SIZE', 100)))
+
+        self._lock = threading.Lock()
+        # Monotonic time at which the heartbeat is next expected to run
+        self._due = 0.0
+        # Stack captured by the watchdog thread for the stall in progress
+        self._pending: Optional[Dict[str, Any]] = None
+
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    async def start(self):
+        """Start the heartbeat and the watchdog thread"""
+        if not self.enabled or self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._due = time.monotonic() + self.interval
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Event loop watchdog started (threshold {self.threshold_ms} ms)")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._stop.set()
+        self._thread.join(timeout=1)
+        self._thread = None
+
+    # ---- Loop side ----
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            with self._lock:
+                lag = max(0.0, now - self._due)
+                self._due = now + self.interval
+                pending, self._pending = self._pending, None
+
+            EVENT_LOOP_LAG.observe(lag)
+            EVENT_LOOP_LAG_LAST.set(lag)
+            if lag * 1000 >= self.threshold_ms:
+                self._record(lag, pending)
+
+    def _record(self, lag: float, pending: Optional[Dict[str, Any]]):
+        """Report a finished stall (the stack is missing if it ended before the thread looked)"""
+        frames = pending["frames"] if pending else []
+        location = _location(frames) if frames else "unknown"
+        stall = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": round(lag * 1000, 1),
+            "location": location,
+            "stack": traceback.format_list(frames),
+        }
+        self.stalls.append(stall)
+        EVENT_LOOP_STALLS.labels(location).inc()
+        logger.warning(
+            f"Event loop blocked for {stall['duration_ms']} ms at {location}"
+            + (f"\n{''.join(stall['stack'])}" if frames else "")
+        )
+
+    # ---- Watchdog thread ----
+
+    def _watch(self):
+        # Check often enough to catch a stall while it is still running
+        check_interval = max(self.threshold_ms / 2000, 0.01)
+        while not self._stop.wait(check_interval):
+            with self._lock:
+                overdue = time.monotonic() - self._due
+                if overdue * 1000 < self.threshold_ms or self._pending is not None:
+                    continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            frames = traceback.extract_stack(frame, limit=STACK_LIMIT)
+            with self._lock:
+                # The heartbeat may have run while the stack was being extracted
+                if time.monotonic() - self._due >= overdue:
+                    self._pending = {"frames": frames}
+
+    # ---- Reading ----
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Newest stalls first"""
+        stalls = list(self.stalls)
+        stalls.reverse()
+        return stalls[:limit]
+
+    def clear(self):
+        self.stalls.clear()
@@ -0,0 +1,203 @@
+"""
+Prometheus metrics for the API
+
+- HTTP requests: count and latency by route template, method, status and role
+- MongoDB commands: latency by collection and command (pymongo CommandListener)
+- Image pipeline, storage backend and Telegram upstream latency
+- Event loop lag and stalls (filled by loop_watchdog)
+- Change feed subscribers, events and resyncs (filled by change_feed)
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Buckets tuned for an API whose requests are mostly single Mongo round trips
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total",
+    "HTTP requests",
+    ["route", "method", "status", "role"],
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency",
+    ["route", "method", "status", "role"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "HTTP requests currently being served",
+)
+MONGO_COMMAND_DURATION = Histogram(
+    "mongo_command_duration_seconds",
+    "MongoDB command latency",
+    ["collection", "command", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+IMAGE_PIPELINE_DURATION = Histogram(
+    "image_pipeline_duration_seconds",
+    "Image processing and storage latency",
+    ["stage", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+TELEGRAM_REQUEST_DURATION = Histogram(
+    "telegram_request_duration_seconds",
+    "Telegram Bot API latency",
+    ["method", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Delay between a scheduled wakeup and its execution on the event loop",
+    buckets=LATENCY_BUCKETS,
+)
+EVENT_LOOP_LAG_LAST = Gauge(
+    "event_loop_lag_last_seconds",
+    "Most recent event loop lag sample",
+)
+EVENT_LOOP_STALLS = Counter(
+    "event_loop_stalls_total",
+    "Event loop stalls above the watchdog threshold, by blocking code location",
+    ["location"],
+)
+CHANGE_FEED_SUBSCRIBERS = Gauge(
+    "change_feed_subscribers",
+    "Clients connected to the change feed (SSE and WebSocket)",
+)
+CHANGE_FEED_EVENTS = Counter(
+    "change_feed_events_total",
+    "Entity changes published to the change feed",
+    ["entity", "op", "source"],
+)
+CHANGE_FEED_RESYNCS = Counter(
+    "change_feed_resyncs_total",
+    "Resync events sent instead of deltas (slow consumer, lost history, unidentified delete)",
+    ["reason"],
+)
+
+# Label used for requests that did not match any route (keeps cardinality bounded)
+UNMATCHED_ROUTE = "unmatched"
+ANONYMOUS_ROLE = "anonymous"
+
+
+def metrics_response() -> Tuple[bytes, str]:
+    """Render all metrics in the Prometheus text format"""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+@contextmanager
+def observe(histogram: Histogram, **labels):
+    """Time a block and record it in a histogram with an outcome=ok/error label"""
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        histogram.labels(outcome=outcome, **labels).observe(time.perf_counter() - start)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording request count and latency
+
+    The route label is the matched route template (e.g. /api/projects/{project_id}),
+    taken from scope["route"] after routing, and the role label comes from
+    scope["state"]["user_role"], which the auth dependency fills in.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        # labels -> (counter child, histogram child); .labels() takes a lock on every call
+        self._children: Dict[Tuple[str, str, str, str], Tuple] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_PROGRESS.dec()
+            route = scope.get("route")
+            labels = (
+                getattr(route, "path", UNMATCHED_ROUTE),
+                scope["method"],
+                str(status_code),
+                scope.get("state", {}).get("user_role", ANONYMOUS_ROLE),
+            )
+            children = self._children.get(labels)
+            if children is None:
+                children = self._children[labels] = (
+                    HTTP_REQUESTS.labels(*labels),
+                    HTTP_REQUEST_DURATION.labels(*labels),
+                )
+            children[0].inc()
+            children[1].observe(time.perf_counter() - start)
+
+
+class MongoMetricsListener(monitoring.CommandListener):
+    """pymongo command listener recording per-collection command latency"""
+
+    # Commands whose first value is not a collection name
+    _NON_COLLECTION_COMMANDS = frozenset({
+        "ismaster", "isMaster", "hello", "ping", "buildInfo", "endSessions",
+        "saslStart", "saslContinue", "getMore", "killCursors", "listCollections",
+    })
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # request_id -> (collection, command); pymongo only passes the command to started()
+        self._pending: Dict[Tuple[int, int], Tuple[str, str]] = {}
+
+    @staticmethod
+    def _key(event) -> Tuple[int, int]:
+        return event.request_id, event.operation_id
+
+    def collection_for(self, event) -> str:
+        """Collection targeted by a command (getMore names it in the "collection" field)"""
+        command = event.command
+        if event.command_name == "getMore":
+            return str(command.get("collection", ""))
+        if event.command_name in self._NON_COLLECTION_COMMANDS:
+            return ""
+        value = command.get(event.command_name)
+        return value if isinstance(value, str) else ""
+
+    def started(self, event):
+        with self._lock:
+            self._pending[self._key(event)] = (self.collection_for(event), event.command_name)
+
+    def _finish(self, event, outcome: str):
+        with self._lock:
+            collection, command = self._pending.pop(self._key(event), ("", event.command_name))
+        MONGO_COMMAND_DURATION.labels(collection, command, outcome).observe(event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
@@ -77,6 +77,50 @@ class Project(BaseModel):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     created_by: Optional[str] = None
+    version: int = 0  # Incremented on every write
+
+
+# Project list rows (GET /api/projects/summary), computed by an aggregation pipeline
+class ListRollup(BaseModel):
+    items: int = 0
+    quantity: int = 0
+    inventory_quantity: int = 0
+    equipment_quantity: int = 0
+    manual_quantity: int = 0
+
+
+class ProjectSummary(BaseModel):
+    id: str
+    title: str
+    lead_decorator: str
+    project_date: datetime
+    status: ProjectStatus
+    curator_agreement: bool = False
+    decorator_agreement: bool = False
+    preliminary: ListRollup
+    final: ListRollup
+    dismantling: ListRollup
+    updated_at: datetime
+    version: int = 0
+
+
+class CalendarBucket(BaseModel):
+    start: datetime
+    end: datetime
+    count: int
+    projects: List[ProjectSummary]
+
+
+# GET /api/projects/calendar
+class CalendarResponse(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+    
+    from_date: datetime = Field(alias="from")
+    to_date: datetime = Field(alias="to")
+    group: str
+    timezone: str
+    total: int
+    buckets: List[CalendarBucket]
 
 
 class ProjectCreate(BaseModel):
@@ -99,6 +143,40 @@ class ProjectUpdate(BaseModel):
     decorator_agreement: Optional[bool] = None
 
 
+# Project list line item models
+class ProjectListName(str, Enum):
+    PRELIMINARY = "preliminary"
+    FINAL = "final"
+    DISMANTLING = "dismantling"
+
+
+class LineItemSource(str, Enum):
+    INVENTORY = "inventory"
+    EQUIPMENT = "equipment"
+    MANUAL = "manual"
+
+
+class LineItemCreate(BaseModel):
+    id: Optional[str] = None  # Inventory or equipment item id (not set for manual entries)
+    name: str
+    category: Optional[str] = None
+    quantity: int = Field(default=1, ge=1)
+    source: LineItemSource = LineItemSource.MANUAL
+    notes: Optional[str] = None
+    position: Optional[int] = Field(default=None, ge=0)  # Insert position, appended by default
+
+
+class LineItemUpdate(BaseModel):
+    name: Optional[str] = None
+    category: Optional[str] = None
+    quantity: Optional[int] = Field(default=None, ge=1)
+    notes: Optional[str] = None
+
+
+class LineItemOrder(BaseModel):
+    line_ids: List[str]
+
+
 # Inventory Models
 class InventoryItem(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -112,6 +190,7 @@ class InventoryItem(BaseModel):
     images: List[str] = Field(default_factory=list)  # URLs or paths to images
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    version: int = 0  # Incremented on every write
 
 
 class InventoryItemCreate(BaseModel):
@@ -144,6 +223,7 @@ class EquipmentItem(BaseModel):
     images: List[str] = Field(default_factory=list)  # URLs or paths to images
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    version: int = 0  # Incremented on every write
 
 
 class EquipmentItemCreate(BaseModel):
@@ -163,6 +243,81 @@ class EquipmentItemUpdate(BaseModel):
     images: Optional[List[str]] = None
 
 
+# Batched lookups by id (POST /api/inventory/lookup, /api/equipment/lookup)
+MAX_LOOKUP_IDS = 5000
+
+
+class ItemLookup(BaseModel):
+    ids: List[str] = Field(min_length=1, max_length=MAX_LOOKUP_IDS)
+    fields: Optional[List[str]] = None  # Only these fields ("id" is always returned)
+
+
+class InventoryLookupResult(BaseModel):
+    items: Dict[str, InventoryItem]
+    missing: List[str]
+
+
+class EquipmentLookupResult(BaseModel):
+    items: Dict[str, EquipmentItem]
+    missing: List[str]
+
+
+# Stock ledger (inventory and equipment quantities)
+class StockMovementKind(str, Enum):
+    RECEIVE = "receive"        # new units: on hand +
+    WRITE_OFF = "write_off"    # lost units: on hand -
+    RESERVE = "reserve"        # promised to a project: reserved +
+    RELEASE = "release"        # promise withdrawn: reserved -
+    ISSUE = "issue"            # reserved units leave for the project: reserved -, out +
+    RETURN = "return"          # back from the project intact: out -
+    DAMAGE = "damage"          # back from the project damaged: out -, damaged +
+    REPAIR = "repair"          # damaged units usable again: damaged -
+    SCRAP = "scrap"            # damaged units thrown away: damaged -, on hand -
+    ADJUST = "adjust"          # total_quantity edited by hand
+
+
+class StockLevels(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    
+    collection: str
+    item_id: str
+    on_hand: int = 0
+    reserved: int = 0
+    out: int = 0
+    damaged: int = 0
+    available: int = 0  # on_hand - reserved - out - damaged
+    seq: int = 0  # Sequence number of the last movement
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class StockMovement(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    collection: str
+    item_id: str
+    seq: int
+    kind: StockMovementKind
+    quantity: int
+    deltas: Dict[str, int]
+    project_id: Optional[str] = None
+    note: Optional[str] = None
+    user_id: Optional[str] = None
+    at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class StockMovementCreate(BaseModel):
+    kind: StockMovementKind
+    quantity: int = Field(ge=1)
+    project_id: Optional[str] = None
+    note: Optional[str] = None
+
+
+class StockMovementResult(BaseModel):
+    movement: StockMovement
+    levels: StockLevels
+
+
 # Log Models
 class LogEntry(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -192,6 +347,11 @@ class Token(BaseModel):
     token_type: str = "bearer"
 
 
+class StreamToken(BaseModel):
+    token: str
+    expires_in: int  # Seconds
+
+
 class TokenData(BaseModel):
     user_id: str
     email: str
@@ -0,0 +1,214 @@
+"""
+On-demand statistical profiler
+
+A sampling thread reads the stack of every thread with sys._current_frames()
+at a fixed interval, and on each tick asks the event loop for the await chain
+of every suspended asyncio task. Identical stacks are counted, so the result
+is a folded profile that can be rendered as collapsed stacks (flamegraph.pl,
+speedscope, inferno) or as a speedscope JSON document.
+
+Thread stacks show where CPU time goes (serialization, Pydantic, Pillow);
+task stacks show where requests are waiting. Only one profile runs at a time.
+"""
+
+import asyncio
+import os
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+APP_DIR = str(Path(__file__).parent)
+STDLIB_DIR = sysconfig.get_paths()["stdlib"]
+
+# Innermost frames in these modules mean the thread is idle (waiting for work or I/O)
+IDLE_MODULES = ("threading.py", "selectors.py", "queue.py", "thread.py")
+
+# Maximum depth of a sampled stack
+MAX_DEPTH = 128
+
+Frame = Tuple[str, str, int]
+Stack = Tuple[Frame, ...]
+
+
+class ProfilerBusyError(Exception):
+    """Another profile is already running"""
+
+
+def _short_path(filename: str) -> str:
+    """Path relative to the app, site-packages or the standard library, for readable frame names"""
+    for marker in ("site-packages/", "dist-packages/"):
+        if marker in filename:
+            return filename.split(marker, 1)[1]
+    for base in (APP_DIR, STDLIB_DIR):
+        if filename.startswith(base + os.sep):
+            return filename[len(base) + 1:]
+    return filename
+
+
+def _frame_key(code) -> Frame:
+    # Function start line rather than the current line, so samples of one function fold together
+    return code.co_name, _short_path(code.co_filename), code.co_firstlineno
+
+
+def _thread_stack(frame) -> Stack:
+    stack = []
+    while frame is not None and len(stack) < MAX_DEPTH:
+        stack.append(_frame_key(frame.f_code))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+def _task_stack(task: asyncio.Task) -> Stack:
+    """Await chain of a suspended task, outermost coroutine first"""
+    stack = []
+    coro = task.get_coro()
+    while coro is not None and len(stack) < MAX_DEPTH:
+        code = getattr(coro, "cr_code", None) or getattr(coro, "gi_code", None)
+        if code is None:
+            # Futures and other awaitables end the chain
+            stack.append((type(coro).__name__, "", 0))
+            break
+        stack.append(_frame_key(code))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return tuple(stack)
+
+
+class SamplingProfiler:
+    """Samples all threads and asyncio tasks for a fixed duration"""
+
+    def __init__(self, max_seconds: Optional[float] = None):
+        """
+        Args:
+            max_seconds: Longest allowed profile (PROFILE_MAX_SECONDS, default 30)
+        """
+        self.max_seconds = max_seconds if max_seconds is not None else float(os.environ.get('PROFILE_MAX_SECONDS', 30))
+        self._lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def profile(self, seconds: float, interval: float = 0.005, include_idle: bool = False) -> Dict[str, Any]:
+        """
+        Profile the process
+
+        Args:
+            seconds: Duration (capped at max_seconds)
+            interval: Sampling interval in seconds
+            include_idle: Keep samples of threads blocked in waits/select
+
+        Returns:
+            {"duration": ..., "interval": ..., "samples": {root: Counter(stack -> count)}}
+
+        Raises:
+            ProfilerBusyError: Another profile is running
+        """
+        if self._lock.locked():
+            raise ProfilerBusyError("A profile is already running")
+
+        async with self._lock:
+            seconds = min(seconds, self.max_seconds)
+            loop = asyncio.get_running_loop()
+            current_task = asyncio.current_task()
+            samples: Dict[str, Counter] = {}
+            samples_lock = threading.Lock()
+            finished = False
+
+            def add(root: str, stack: Stack):
+                with samples_lock:
+                    samples.setdefault(root, Counter())[stack] += 1
+
+            def sample_tasks():
+                # Runs on the event loop, where the task set can be read safely
+                if finished:
+                    return
+                for task in asyncio.all_tasks(loop):
+                    if task is current_task or task.done():
+                        continue
+                    stack = _task_stack(task)
+                    if stack:
+                        add(f"task:{stack[0][0]}", stack)
+
+            def sample_threads():
+                own_id = threading.get_ident()
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                deadline = time.monotonic() + seconds
+                while time.monotonic() < deadline:
+                    for thread_id, frame in sys._current_frames().items():
+                        if thread_id == own_id:
+                            continue
+                        stack = _thread_stack(frame)
+                        if not stack or (not include_idle and stack[-1][1].endswith(IDLE_MODULES)):
+                            continue
+                        add(f"thread:{names.get(thread_id, thread_id)}", stack)
+                    loop.call_soon_threadsafe(sample_tasks)
+                    time.sleep(interval)
+
+            started = time.monotonic()
+            await asyncio.to_thread(sample_threads)
+            finished = True
+            return {
+                "duration": round(time.monotonic() - started, 3),
+                "interval": interval,
+                "samples": samples,
+            }
+
+
+def _frame_name(frame: Frame) -> str:
+    name, filename, line = frame
+    return f"{name} ({filename}:{line})" if filename else name
+
+
+def to_collapsed(profile: Dict[str, Any]) -> str:
+    """Collapsed stacks: "root;outer;...;inner count" per line"""
+    lines = []
+    for root, stacks in profile["samples"].items():
+        for stack, count in stacks.most_common():
+            frames = ";".join(_frame_name(frame).replace(";", ":") for frame in stack)
+            lines.append(f"{root};{frames} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def to_speedscope(profile: Dict[str, Any], name: str = "profile") -> Dict[str, Any]:
+    """Speedscope file format: one sampled profile per thread/task root"""
+    frames: List[Dict[str, Any]] = []
+    frame_index: Dict[Frame, int] = {}
+    profiles = []
+
+    for root, stacks in profile["samples"].items():
+        sample_list = []
+        weights = []
+        for stack, count in stacks.most_common():
+            indexes = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                indexes.append(frame_index[frame])
+            sample_list.append(indexes)
+            weights.append(round(count * profile["interval"], 6))
+        profiles.append({
+            "type": "sampled",
+            "name": root,
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": round(sum(weights), 6),
+            "samples": sample_list,
+            "weights": weights,
+        })
+
+    # Busiest threads/tasks first
+    profiles.sort(key=lambda p: p["endValue"], reverse=True)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "sls1-profiler",
+        "activeProfileIndex": 0,
+        "shared": {"frames": frames},
+        "profiles": profiles,
+    }
@@ -0,0 +1,129 @@
+"""
+Project calendar: projects in a date range, bucketed by month or week
+
+project_date is a native BSON date (see datetime_migration.py), so a range
+is an index scan on {project_date, status} instead of reading every project.
+The status filter is answered from the same index keys; one index thus serves
+both the plain range and the range-per-status queries.
+
+Buckets follow the calendar of a time zone (query parameter tz, default
+CALENDAR_TIMEZONE or UTC): an event at 00:30 on the 1st in Moscow is 21:30 UTC
+on the last day of the previous month and belongs to the new month. Weeks
+start on Monday. Every bucket overlapping the range is returned, empty ones
+too, so a timeline can be drawn without filling gaps.
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Any, Dict, List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from models import ProjectStatus, ProjectSummary
+from project_summary import summary_pipeline
+from responses import trusted_documents
+
+# Widest range one request may ask for
+MAX_RANGE = timedelta(days=int(os.environ.get('CALENDAR_MAX_DAYS', 400)))
+
+
+class CalendarGrouping(str, Enum):
+    MONTH = "month"
+    WEEK = "week"
+
+
+class InvalidCalendarQuery(ValueError):
+    """The range or the time zone of a calendar query is not acceptable"""
+
+
+def _as_utc(value: datetime) -> datetime:
+    """Naive datetimes read from MongoDB (a client opened without tz_aware) are UTC"""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def bucket_start(value: datetime, grouping: CalendarGrouping, tz: ZoneInfo) -> datetime:
+    """Start (local midnight) of the month or week containing value"""
+    local = _as_utc(value).astimezone(tz)
+    day = local.date()
+    if grouping is CalendarGrouping.MONTH:
+        day = day.replace(day=1)
+    else:
+        day -= timedelta(days=day.weekday())
+    return datetime(day.year, day.month, day.day, tzinfo=tz)
+
+
+def next_bucket(start: datetime, grouping: CalendarGrouping) -> datetime:
+    if grouping is CalendarGrouping.MONTH:
+        if start.month == 12:
+            return start.replace(year=start.year + 1, month=1)
+        return start.replace(month=start.month + 1)
+    day = start.date() + timedelta(days=7)
+    return datetime(day.year, day.month, day.day, tzinfo=start.tzinfo)
+
+
+class ProjectCalendar:
+    """Range queries over project_date"""
+
+    def __init__(self, db):
+        self.db = db
+        self.default_timezone = os.environ.get('CALENDAR_TIMEZONE', 'UTC')
+
+    async def start(self):
+        """Create the index the range queries rely on"""
+        await self.db.projects.create_index([("project_date", 1), ("status", 1)])
+
+    def zone(self, name: Optional[str]) -> ZoneInfo:
+        try:
+            return ZoneInfo(name or self.default_timezone)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise InvalidCalendarQuery(f"Unknown time zone: {name}")
+
+    async def projects(
+        self,
+        start: datetime,
+        end: datetime,
+        statuses: Optional[List[ProjectStatus]] = None,
+        grouping: CalendarGrouping = CalendarGrouping.MONTH,
+        tz_name: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Projects with start <= project_date < end, in buckets
+
+        Raises:
+            InvalidCalendarQuery: empty or too wide range, unknown time zone
+        """
+        tz = self.zone(tz_name)
+        # A date without a time ("2025-06-01") means midnight on the calendar, not in UTC
+        start, end = (value if value.tzinfo else value.replace(tzinfo=tz) for value in (start, end))
+        if end <= start:
+            raise InvalidCalendarQuery("'to' must be after 'from'")
+        if end - start > MAX_RANGE:
+            raise InvalidCalendarQuery(f"The range must not exceed {MAX_RANGE.days} days")
+
+        match: Dict[str, Any] = {"project_date": {"$gte": start, "$lt": end}}
+        if statuses:
+            match["status"] = {"$in": [project_status.value for project_status in statuses]}
+        pipeline = summary_pipeline(match)
+        pipeline.insert(1, {"$sort": {"project_date": 1}})
+        rows = trusted_documents(ProjectSummary, await self.db.projects.aggregate(pipeline).to_list(None))
+
+        buckets = []
+        bucket = bucket_start(start, grouping, tz)
+        index = 0
+        while bucket < end:
+            bucket_end = next_bucket(bucket, grouping)
+            projects = []
+            while index < len(rows) and _as_utc(rows[index]["project_date"]) < bucket_end:
+                projects.append(rows[index])
+                index += 1
+            buckets.append({"start": bucket, "end": bucket_end, "count": len(projects), "projects": projects})
+            bucket = bucket_end
+
+        return {
+            "from": start,
+            "to": end,
+            "group": grouping.value,
+            "timezone": tz.key,
+            "total": len(rows),
+            "buckets": buckets,
+        }
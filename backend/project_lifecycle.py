@@ -0,0 +1,253 @@
+"""
+Project status lifecycle
+
+Создан -> На согласовании -> Согласован -> Сбор проекта -> Монтаж -> Демонтаж -> Разбор
+
+A status change is validated against TRANSITIONS (a project can also go back
+from approval to editing); admins may set any status to correct mistakes.
+The write is conditional on the status that was validated, so two concurrent
+changes cannot both pass.
+
+After the write, the hooks registered for the new status run as background
+tasks, so the PATCH returns without waiting for them:
+
+- Согласован: the final list is frozen into reservations (one document per
+  inventory/equipment line in the reservations collection)
+- Монтаж:     the dismantling list is generated from the final list, unless
+              someone already filled it
+- Разбор:     the project's reservations are released (also when approval
+              is withdrawn, back to На согласовании or Создан)
+
+With a stock ledger, reservations are also recorded as reserve/release
+movements of the items (the change of the reserved quantity per item), so
+the items' "reserved" and "available" counters follow the approved projects.
+Units issued to the project have left "reserved" already: a release gives
+back at most what the ledger still holds reserved for the project.
+
+Hooks of one project run one at a time in the order of the transitions, so
+a quick approve-withdraw-approve ends with the reservations of the last
+approval. Hooks are idempotent: running one twice leaves the same result,
+and a failed hook is logged and can be redone by repeating the transition.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from pymongo import ReplaceOne, ReturnDocument
+
+from line_items import new_line_id
+from models import LineItemSource, ProjectStatus, StockMovementKind, UserRole
+from stock_ledger import InsufficientStock
+
+logger = logging.getLogger(__name__)
+
+TRANSITIONS: Dict[ProjectStatus, Set[ProjectStatus]] = {
+    ProjectStatus.CREATED: {ProjectStatus.PENDING_APPROVAL},
+    ProjectStatus.PENDING_APPROVAL: {ProjectStatus.CREATED, ProjectStatus.APPROVED},
+    ProjectStatus.APPROVED: {ProjectStatus.PENDING_APPROVAL, ProjectStatus.PROJECT_BUILD},
+    ProjectStatus.PROJECT_BUILD: {ProjectStatus.ASSEMBLY},
+    ProjectStatus.ASSEMBLY: {ProjectStatus.DISASSEMBLY},
+    ProjectStatus.DISASSEMBLY: {ProjectStatus.BREAKDOWN},
+    ProjectStatus.BREAKDOWN: set(),
+}
+
+# Seconds the shutdown waits for running hooks before cancelling them
+SHUTDOWN_GRACE_SECONDS = 10
+
+Hook = Callable[[str], Awaitable[None]]
+
+
+class InvalidTransition(ValueError):
+    """The status cannot be changed this way"""
+
+
+def check_transition(current: Optional[str], new: ProjectStatus, role: UserRole):
+    """
+    Raises:
+        InvalidTransition: new is not reachable from current for this role
+    """
+    if role == UserRole.ADMIN:
+        return
+    try:
+        current_status = ProjectStatus(current)
+    except ValueError:
+        # No or unknown stored status: any status brings the project back on track
+        return
+    if new not in TRANSITIONS[current_status]:
+        allowed = ", ".join(status.value for status in TRANSITIONS[current_status]) or "none"
+        raise InvalidTransition(
+            f"Status cannot change from '{current_status.value}' to '{new.value}' (allowed: {allowed})"
+        )
+
+
+class ProjectLifecycle:
+    """Runs the hooks of status transitions in the background"""
+
+    def __init__(self, db, change_feed=None, stock=None):
+        self.db = db
+        self.reservations = db.reservations
+        self.change_feed = change_feed
+        self.stock = stock
+        self.hooks: Dict[ProjectStatus, List[Hook]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        # Per project, kept for the life of the process (a small object per project that changed status)
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+        self.on_enter(ProjectStatus.APPROVED)(self.reserve_final_list)
+        self.on_enter(ProjectStatus.ASSEMBLY)(self.generate_dismantling_list)
+        for status in (ProjectStatus.BREAKDOWN, ProjectStatus.PENDING_APPROVAL, ProjectStatus.CREATED):
+            self.on_enter(status)(self.release_reservations)
+
+    def on_enter(self, status: ProjectStatus):
+        """Decorator registering a hook called with the project id after it enters status"""
+        def register(hook: Hook) -> Hook:
+            self.hooks.setdefault(status, []).append(hook)
+            return hook
+        return register
+
+    async def start(self):
+        await self.reservations.create_index([("project_id", 1), ("line_id", 1)], unique=True)
+        await self.reservations.create_index("item_id")
+
+    async def stop(self):
+        """Let running hooks finish (up to SHUTDOWN_GRACE_SECONDS), then cancel them"""
+        if not self._tasks:
+            return
+        done, pending = await asyncio.wait(self._tasks, timeout=SHUTDOWN_GRACE_SECONDS)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def status_changed(self, project_id: str, old: Optional[str], new: ProjectStatus):
+        """Schedule the hooks of the new status (call after the write succeeded)"""
+        if old == new.value:
+            return
+        for hook in self.hooks.get(new, []):
+            task = asyncio.create_task(self._run(hook, project_id, new))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, hook: Hook, project_id: str, status: ProjectStatus):
+        # asyncio.Lock wakes waiters in FIFO order: hooks run in the order they were scheduled
+        lock = self._locks.setdefault(project_id, asyncio.Lock())
+        try:
+            async with lock:
+                await hook(project_id)
+        except Exception as e:
+            logger.error(f"Hook {hook.__name__} for project {project_id} ({status.value}) failed: {e}")
+
+    # ---------- hooks ----------
+
+    async def reserve_final_list(self, project_id: str):
+        """Freeze the final list's inventory and equipment lines into reservations"""
+        project = await self.db.projects.find_one(
+            {"id": project_id}, {"_id": 0, "final_list": 1, "project_date": 1}
+        )
+        if not project:
+            return
+        items = (project.get("final_list") or {}).get("items") or []
+        now = datetime.now(timezone.utc)
+        sources = (LineItemSource.INVENTORY.value, LineItemSource.EQUIPMENT.value)
+        lines = [
+            item for item in items
+            if isinstance(item, dict) and item.get("source") in sources and item.get("id") and item.get("line_id")
+        ]
+        reserved_before = await self._reserved_quantities(project_id)
+        # Lines removed from the list since the last approval
+        await self.reservations.delete_many({
+            "project_id": project_id,
+            "line_id": {"$nin": [item["line_id"] for item in lines]}
+        })
+        if lines:
+            await self.reservations.bulk_write([
+                ReplaceOne(
+                    {"project_id": project_id, "line_id": item["line_id"]},
+                    {
+                        "project_id": project_id,
+                        "line_id": item["line_id"],
+                        "source": item["source"],
+                        "item_id": item["id"],
+                        "name": item.get("name"),
+                        "quantity": item.get("quantity", 1),
+                        "project_date": project.get("project_date"),
+                        "reserved_at": now,
+                    },
+                    upsert=True
+                )
+                for item in lines
+            ], ordered=False)
+        await self._record_reservations(project_id, reserved_before)
+        logger.info(f"Reserved {len(lines)} lines for project {project_id}")
+
+    async def generate_dismantling_list(self, project_id: str):
+        """Fill an empty dismantling list with the lines of the final list"""
+        project = await self.db.projects.find_one({"id": project_id}, {"_id": 0, "final_list": 1})
+        items = ((project or {}).get("final_list") or {}).get("items") or []
+        if not items:
+            return
+        dismantling_list = {"items": [
+            {**item, "line_id": new_line_id()} if isinstance(item, dict) else item for item in items
+        ]}
+        now = datetime.now(timezone.utc)
+        updated_project = await self.db.projects.find_one_and_update(
+            {
+                "id": project_id,
+                "$or": [{"dismantling_list": None}, {"dismantling_list.items": {"$size": 0}}]
+            },
+            {"$set": {"dismantling_list": dismantling_list, "updated_at": now}, "$inc": {"version": 1}},
+            projection={"_id": 0, "version": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if updated_project and self.change_feed:
+            self.change_feed.publish(
+                "projects", "update", project_id,
+                {"dismantling_list": dismantling_list, "updated_at": now}, updated_project["version"]
+            )
+
+    async def release_reservations(self, project_id: str):
+        """Return the project's reserved items"""
+        reserved_before = await self._reserved_quantities(project_id)
+        result = await self.reservations.delete_many({"project_id": project_id})
+        await self._record_reservations(project_id, reserved_before)
+        if result.deleted_count:
+            logger.info(f"Released {result.deleted_count} reservations of project {project_id}")
+
+    async def _reserved_quantities(self, project_id: str) -> Dict[Tuple[str, str], int]:
+        """Reserved quantity per (source, item id) of a project"""
+        quantities: Dict[Tuple[str, str], int] = {}
+        async for reservation in self.reservations.find(
+            {"project_id": project_id}, {"_id": 0, "source": 1, "item_id": 1, "quantity": 1}
+        ):
+            key = (reservation["source"], reservation["item_id"])
+            quantity = reservation.get("quantity")
+            quantities[key] = quantities.get(key, 0) + (quantity if isinstance(quantity, int) else 1)
+        return quantities
+
+    async def _record_reservations(self, project_id: str, reserved_before: Dict[Tuple[str, str], int]):
+        """Record the change of the project's reservations as ledger movements"""
+        if self.stock is None:
+            return
+        reserved_after = await self._reserved_quantities(project_id)
+        for source, item_id in reserved_before.keys() | reserved_after.keys():
+            change = reserved_after.get((source, item_id), 0) - reserved_before.get((source, item_id), 0)
+            if not change:
+                continue
+            try:
+                if change > 0:
+                    # Not enforced: an overbooked item shows as negative availability
+                    await self.stock.record(
+                        source, item_id, StockMovementKind.RESERVE, change, project_id=project_id, enforce=False
+                    )
+                    continue
+                quantity = min(-change, await self.stock.reserved_for(source, item_id, project_id))
+                if quantity:
+                    await self.stock.record(
+                        source, item_id, StockMovementKind.RELEASE, quantity, project_id=project_id
+                    )
+            except LookupError:
+                # The item was deleted since it was added to the list
+                pass
+            except InsufficientStock as e:
+                logger.warning(f"Release of {source} {item_id} for project {project_id} skipped: {e}")
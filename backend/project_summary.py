@@ -0,0 +1,71 @@
+"""
+Project list rollups
+
+The projects page only shows title, date, status and decorator, but
+GET /api/projects returns whole documents with all three lists and
+full_details. GET /api/projects/summary instead runs one aggregation whose
+$project stage reduces every list to counts inside MongoDB, so the rows that
+cross the wire (and get decoded) stay a few hundred bytes however large the
+lists grow.
+"""
+
+from typing import Any, Dict, List, Optional
+
+from line_items import list_field
+from models import LineItemSource, ProjectListName, ProjectSummary
+from responses import model_projection
+
+# Fields copied as they are
+_SUMMARY_FIELDS = [
+    name for name in model_projection(ProjectSummary)
+    if name != "_id" and name not in {list_name.value for list_name in ProjectListName}
+]
+
+
+def _items(list_name: ProjectListName, source: Optional[LineItemSource] = None) -> str:
+    """Temporary field holding the items of a list (of one source)"""
+    return f"_{list_name.value}_{source.value}" if source else f"_{list_name.value}"
+
+
+def _list_rollup(list_name: ProjectListName) -> Dict[str, Any]:
+    # $sum over a field path of an array skips missing and non-numeric quantities
+    return {
+        "items": {"$size": f"${_items(list_name)}"},
+        "quantity": {"$sum": f"${_items(list_name)}.quantity"},
+        **{
+            f"{source.value}_quantity": {"$sum": f"${_items(list_name, source)}.quantity"}
+            for source in LineItemSource
+        },
+    }
+
+
+def summary_pipeline(match: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Aggregation returning ProjectSummary rows"""
+    pipeline: List[Dict[str, Any]] = [{"$match": match}] if match else []
+    pipeline += [
+        # Only the item arrays of the lists (anything else stored there counts as empty)
+        {"$project": {
+            "_id": 0,
+            **{name: 1 for name in _SUMMARY_FIELDS},
+            **{
+                _items(list_name): {"$cond": [
+                    {"$isArray": f"${list_field(list_name)}.items"}, f"${list_field(list_name)}.items", []
+                ]}
+                for list_name in ProjectListName
+            },
+        }},
+        {"$addFields": {
+            _items(list_name, source): {"$filter": {
+                "input": f"${_items(list_name)}",
+                "as": "item",
+                "cond": {"$eq": ["$$item.source", source.value]}
+            }}
+            for list_name in ProjectListName
+            for source in LineItemSource
+        }},
+        {"$project": {
+            **{name: 1 for name in _SUMMARY_FIELDS},
+            **{list_name.value: _list_rollup(list_name) for list_name in ProjectListName},
+        }},
+    ]
+    return pipeline
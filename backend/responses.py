@@ -0,0 +1,68 @@
+"""
+Fast JSON responses
+
+FastJSONResponse is the app-wide response class: orjson instead of the standard
+json encoder, with UTC datetimes rendered with a "Z" suffix like Pydantic does.
+
+trusted_response() is the fast path for reads. Documents in MongoDB are
+written from model_dump(), so they already have the shape of the response
+model; instead of building a model per document, validating it again against
+response_model and running jsonable_encoder, the documents are projected to
+the model's fields, completed with static defaults and handed straight to
+orjson. Endpoints keep response_model=..., so the OpenAPI schema is unchanged.
+"""
+
+from typing import Any, Dict, Iterable, Type, Union
+
+import orjson
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+from pydantic_core import PydanticUndefined
+
+
+class FastJSONResponse(ORJSONResponse):
+    """ORJSONResponse with Pydantic-compatible UTC datetimes"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+
+
+def model_projection(model: Type[BaseModel]) -> Dict[str, int]:
+    """MongoDB projection returning exactly the model's fields (no _id, no extra keys)"""
+    return {"_id": 0, **{name: 1 for name in model.model_fields}}
+
+
+def model_defaults(model: Type[BaseModel]) -> Dict[str, Any]:
+    """Static field defaults, used to complete documents written before a field existed"""
+    return {
+        name: field.default
+        for name, field in model.model_fields.items()
+        if field.default is not PydanticUndefined and field.default_factory is None
+    }
+
+
+_defaults_cache: Dict[Type[BaseModel], Dict[str, Any]] = {}
+
+
+def trusted_documents(model: Type[BaseModel], docs: Union[Dict[str, Any], Iterable[Dict[str, Any]]]):
+    """Documents read with model_projection(model), completed with the model's static defaults"""
+    defaults = _defaults_cache.get(model)
+    if defaults is None:
+        defaults = _defaults_cache[model] = model_defaults(model)
+
+    if isinstance(docs, dict):
+        return {**defaults, **docs} if defaults else docs
+    if defaults:
+        return [{**defaults, **doc} for doc in docs]
+    return list(docs)
+
+
+def trusted_response(model: Type[BaseModel], docs: Union[Dict[str, Any], Iterable[Dict[str, Any]]],
+                     status_code: int = 200) -> FastJSONResponse:
+    """
+    Serialize documents read with model_projection(model) without re-validation
+
+    Only for documents this app wrote itself; anything user-controlled or
+    assembled by hand must still go through the model.
+    """
+    return FastJSONResponse(content=trusted_documents(model, docs), status_code=status_code)
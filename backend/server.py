@@ -1,27 +1,64 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, UploadFile, File
-from fastapi.responses import FileResponse, RedirectResponse
+from fastapi import (
+    FastAPI, APIRouter, Depends, HTTPException, Query, Request, Response, status,
+    UploadFile, File, Form, WebSocket, WebSocketDisconnect
+)
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from fastapi.exceptions import RequestValidationError
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pydantic import ValidationError
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
+from bson import json_util
 import os
+import json
+import asyncio
 import logging
 from pathlib import Path
 from typing import List, Optional
 from datetime import datetime, timezone, timedelta
 
 from models import (
-    User, UserCreate, UserLogin, UserResponse, Token,
-    Project, ProjectCreate, ProjectUpdate, ProjectStatus,
+    User, UserCreate, UserLogin, UserResponse, Token, StreamToken,
+    Project, ProjectCreate, ProjectUpdate, ProjectStatus, ProjectSummary, CalendarResponse,
+    ProjectListName, LineItemCreate, LineItemUpdate, LineItemOrder,
     InventoryItem, InventoryItemCreate, InventoryItemUpdate,
     EquipmentItem, EquipmentItemCreate, EquipmentItemUpdate,
+    ItemLookup, InventoryLookupResult, EquipmentLookupResult,
+    StockLevels, StockMovement, StockMovementCreate, StockMovementKind, StockMovementResult,
     LogEntry, LogEntryCreate, UserRole, TokenData
 )
 from auth import (
-    get_password_hash, verify_password, create_access_token,
-    get_current_user, get_current_admin_user, get_current_curator_or_admin
+    get_password_hash, verify_password, create_access_token, decode_access_token,
+    get_current_user, get_current_admin_user, get_current_curator_or_admin,
+    create_stream_token, get_stream_user, STREAM_TOKEN_EXPIRE_SECONDS
 )
 from storage_service import storage_service
+from upload_queue import UploadQueue
+from storage_gc import StorageReconciler
+from metrics import MetricsMiddleware, MongoMetricsListener, metrics_response
+from loop_watchdog import LoopWatchdog
+from datetime_migration import DatetimeMigration
+from compression import CompressionMiddleware
+from change_feed import ChangeFeed, parse_entities, parse_project_ids
+from json_patch import (
+    JSON_PATCH_MEDIA_TYPE, MERGE_PATCH_MEDIA_TYPE, PatchError, PatchTestFailed,
+    apply_json_patch, apply_merge_patch, compile_update, test_conditions
+)
+from audit_diff import AuditDetails, expand_details
+from project_summary import summary_pipeline
+from snapshot_refresh import SnapshotRefresher, snapshot_changed
+from stock_ledger import StockLedger, InsufficientStock
+from project_lifecycle import ProjectLifecycle, InvalidTransition, check_transition
+from project_calendar import ProjectCalendar, CalendarGrouping, InvalidCalendarQuery
+from line_items import LIST_FIELDS, list_field, new_line_id, ensure_line_ids, assign_missing_line_ids
+from delta_sync import DeltaSync, InvalidSyncToken, DEFAULT_LIMIT as SYNC_DEFAULT_LIMIT, MAX_LIMIT as SYNC_MAX_LIMIT
+from batch_loader import BatchLoader, Loaders
+from responses import FastJSONResponse, model_projection, trusted_documents, trusted_response
+from profiler import SamplingProfiler, ProfilerBusyError, to_collapsed, to_speedscope
+from slow_query_log import SlowQueryLog
 
 
 ROOT_DIR = Path(__file__).parent
@@ -29,34 +66,123 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ.get('DB_NAME', 'sls1_db')]
+slow_query_log = SlowQueryLog()
+loop_watchdog = LoopWatchdog()
+# Datetimes are stored as native BSON dates and decoded as timezone-aware UTC
+client = AsyncIOMotorClient(
+    mongo_url,
+    tz_aware=True,
+    tzinfo=timezone.utc,
+    event_listeners=[MongoMetricsListener(), slow_query_log]
+)
+
+# Real-time change feed (SSE / WebSocket)
+change_feed = ChangeFeed()
+
+# UPDATE log entries store a diff of what changed, not the written payload
+audit_details = AuditDetails()
+
+
+def bind_database(database):
+    """
+    Create every module-level service that keeps a reference to the database
+
+    Called once at import with the Motor database; the load test calls it again
+    with a mongomock database, so nothing keeps pointing at the real server.
+    """
+    global db, delta_sync, stock_ledger, project_lifecycle, project_calendar
+    global snapshot_refresher, upload_queue, deletion_sweeper, storage_reconciler
+    db = database
+
+    # "Changes since" queries and deletion tombstones for offline clients
+    delta_sync = DeltaSync(db)
+
+    # Stock movements of inventory and equipment with per-item counters (on hand, reserved, out)
+    stock_ledger = StockLedger(db)
+
+    # Status transitions and their background hooks (reservations, dismantling list)
+    project_lifecycle = ProjectLifecycle(db, change_feed, stock_ledger)
+
+    # Date range queries over projects
+    project_calendar = ProjectCalendar(db)
+
+    # Keeps the item names/categories/photos copied into project lists up to date
+    snapshot_refresher = SnapshotRefresher(db, change_feed)
+
+    # Background upload queue for remote storage backends
+    upload_queue = UploadQueue(db, storage_service, change_feed, snapshot_refresher)
+
+    # Storage backends that keep data in MongoDB (GridFS, Telegram deletion queue)
+    storage_service.bind_database(db)
+
+    # Batched deletion of Telegram messages (None when Telegram storage is off)
+    deletion_sweeper = storage_service.deletion_sweeper
+
+    # Orphaned upload garbage collector
+    storage_reconciler = StorageReconciler(db, storage_service)
+
+
+bind_database(client[os.environ.get('DB_NAME', 'sls1_db')])
+
+# On-demand sampling profiler for the admin endpoint
+profiler = SamplingProfiler()
 
 # Create the main app without a prefix
-app = FastAPI(title="SLS1 Organizational Platform API")
+app = FastAPI(title="SLS1 Organizational Platform API", default_response_class=FastJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+# Read projections for the trusted response fast path (documents are written from these models)
+USER_FIELDS = model_projection(UserResponse)
+PROJECT_FIELDS = model_projection(Project)
+INVENTORY_FIELDS = model_projection(InventoryItem)
+EQUIPMENT_FIELDS = model_projection(EquipmentItem)
+LOG_FIELDS = model_projection(LogEntry)
+
+# Collections the request-scoped batch loaders read, and what they read
+LOADER_PROJECTIONS = {
+    "projects": PROJECT_FIELDS,
+    "inventory": INVENTORY_FIELDS,
+    "equipment": EQUIPMENT_FIELDS,
+}
+
+# Project fields a PATCH may change (everything else is managed by the server)
+PATCHABLE_PROJECT_FIELDS = tuple(ProjectUpdate.model_fields)
+
+# The PATCH body is parsed by hand (three media types), so its schema is declared explicitly
+PROJECT_UPDATE_SCHEMA = ProjectUpdate.model_json_schema(ref_template="#/components/schemas/{model}")
+PROJECT_UPDATE_SCHEMA.pop("$defs", None)
 
-# Helper function to serialize datetime for MongoDB
-def serialize_for_db(doc: dict) -> dict:
-    """Convert datetime objects to ISO strings for MongoDB storage"""
-    for key, value in doc.items():
-        if isinstance(value, datetime):
-            doc[key] = value.isoformat()
-    return doc
+# Maximum number of files accepted by the batch image upload endpoints
+MAX_BATCH_UPLOAD_FILES = 50
 
 
-def deserialize_from_db(doc: dict) -> dict:
-    """Convert ISO string timestamps back to datetime objects"""
-    for key, value in doc.items():
-        if isinstance(value, str) and key.endswith(('_at', '_date', 'timestamp', 'last_login')):
-            try:
-                doc[key] = datetime.fromisoformat(value)
-            except:
-                pass
-    return doc
+def get_loaders() -> Loaders:
+    """Request-scoped batch loaders: loads by id within a request become one $in query"""
+    return Loaders(db, LOADER_PROJECTIONS)
+
+
+async def lookup_items(collection: str, model, lookup: ItemLookup, loaders: Loaders) -> FastJSONResponse:
+    """Documents for many ids with one query, keyed by id"""
+    if lookup.fields is None:
+        loader = loaders[collection]
+    else:
+        unknown = sorted(set(lookup.fields) - set(model.model_fields))
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"Unknown fields: {', '.join(unknown)}"
+            )
+        loader = BatchLoader(db[collection], {"_id": 0, "id": 1, **{field: 1 for field in lookup.fields}})
+    
+    found = await loader.load_many(lookup.ids)
+    if lookup.fields is None:
+        found = {item_id: trusted_documents(model, doc) for item_id, doc in found.items()}
+    return FastJSONResponse(content={
+        "items": found,
+        "missing": [item_id for item_id in dict.fromkeys(lookup.ids) if item_id not in found],
+    })
 
 
 # ============== AUTHENTICATION ROUTES ==============
@@ -80,7 +206,7 @@ async def register_user(user_data: UserCreate, current_user: TokenData = Depends
         role=user_data.role
     )
     
-    doc = serialize_for_db(user.model_dump())
+    doc = user.model_dump()
     await db.users.insert_one(doc)
     
     # Log the action
@@ -92,7 +218,7 @@ async def register_user(user_data: UserCreate, current_user: TokenData = Depends
         entity_id=user.id,
         details={"user_name": user.name, "role": user.role.value}
     )
-    await db.logs.insert_one(serialize_for_db(log.model_dump()))
+    await db.logs.insert_one(log.model_dump())
     
     return UserResponse(**user.model_dump())
 
@@ -117,7 +243,7 @@ async def login(credentials: UserLogin):
     # Update last login
     await db.users.update_one(
         {"id": user_doc['id']},
-        {"$set": {"last_login": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"last_login": datetime.now(timezone.utc)}}
     )
     
     # Create access token
@@ -135,7 +261,7 @@ async def login(credentials: UserLogin):
 @api_router.get("/auth/me", response_model=UserResponse)
 async def get_current_user_info(current_user: TokenData = Depends(get_current_user)):
     """Get current user information"""
-    user_doc = await db.users.find_one({"id": current_user.user_id}, {"_id": 0, "password_hash": 0})
+    user_doc = await db.users.find_one({"id": current_user.user_id}, USER_FIELDS)
     
     if not user_doc:
         raise HTTPException(
@@ -143,7 +269,7 @@ async def get_current_user_info(current_user: TokenData = Depends(get_current_us
             detail="User not found"
         )
     
-    return UserResponse(**deserialize_from_db(user_doc))
+    return trusted_response(UserResponse, user_doc)
 
 
 # ============== USER MANAGEMENT ROUTES ==============
@@ -151,14 +277,14 @@ async def get_current_user_info(current_user: TokenData = Depends(get_current_us
 @api_router.get("/users", response_model=List[UserResponse])
 async def get_users(current_user: TokenData = Depends(get_current_admin_user)):
     """Get all users (Admin only)"""
-    users = await db.users.find({}, {"_id": 0, "password_hash": 0}).to_list(1000)
-    return [UserResponse(**deserialize_from_db(user)) for user in users]
+    users = await db.users.find({}, USER_FIELDS).to_list(1000)
+    return trusted_response(UserResponse, users)
 
 
 @api_router.get("/users/{user_id}", response_model=UserResponse)
 async def get_user(user_id: str, current_user: TokenData = Depends(get_current_admin_user)):
     """Get user by ID (Admin only)"""
-    user_doc = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
+    user_doc = await db.users.find_one({"id": user_id}, USER_FIELDS)
     
     if not user_doc:
         raise HTTPException(
@@ -166,7 +292,7 @@ async def get_user(user_id: str, current_user: TokenData = Depends(get_current_a
             detail="User not found"
         )
     
-    return UserResponse(**deserialize_from_db(user_doc))
+    return trusted_response(UserResponse, user_doc)
 
 
 @api_router.delete("/users/{user_id}")
@@ -188,7 +314,7 @@ async def delete_user(user_id: str, current_user: TokenData = Depends(get_curren
         entity_type="USER",
         entity_id=user_id
     )
-    await db.logs.insert_one(serialize_for_db(log.model_dump()))
+    await db.logs.insert_one(log.model_dump())
     
     return {"message": "User deleted successfully"}
 
@@ -198,14 +324,43 @@ async def delete_user(user_id: str, current_user: TokenData = Depends(get_curren
 @api_router.get("/projects", response_model=List[Project])
 async def get_projects(current_user: TokenData = Depends(get_current_user)):
     """Get all projects"""
-    projects = await db.projects.find({}, {"_id": 0}).to_list(1000)
-    return [Project(**deserialize_from_db(project)) for project in projects]
+    projects = await db.projects.find({}, PROJECT_FIELDS).to_list(1000)
+    return trusted_response(Project, projects)
+
+
+@api_router.get("/projects/summary", response_model=List[ProjectSummary])
+async def get_project_summaries(
+    project_status: Optional[ProjectStatus] = Query(None, alias="status"),
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Lightweight project rows with list aggregates (item counts, quantities by source)"""
+    match = {"status": project_status.value} if project_status else None
+    rows = await db.projects.aggregate(summary_pipeline(match)).to_list(1000)
+    return trusted_response(ProjectSummary, rows)
+
+
+@api_router.get("/projects/calendar", response_model=CalendarResponse)
+async def get_project_calendar(
+    from_date: datetime = Query(..., alias="from"),
+    to_date: datetime = Query(..., alias="to"),
+    project_status: Optional[List[ProjectStatus]] = Query(None, alias="status"),
+    group: CalendarGrouping = CalendarGrouping.MONTH,
+    tz: Optional[str] = None,
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Projects dated from <= project_date < to, grouped by month or week"""
+    try:
+        calendar = await project_calendar.projects(from_date, to_date, project_status, group, tz)
+    except InvalidCalendarQuery as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    return FastJSONResponse(content=calendar)
 
 
 @api_router.get("/projects/{project_id}", response_model=Project)
 async def get_project(project_id: str, current_user: TokenData = Depends(get_current_user)):
     """Get project by ID"""
-    project_doc = await db.projects.find_one({"id": project_id}, {"_id": 0})
+    project_doc = await db.projects.find_one({"id": project_id}, PROJECT_FIELDS)
     
     if not project_doc:
         raise HTTPException(
@@ -213,7 +368,7 @@ async def get_project(project_id: str, current_user: TokenData = Depends(get_cur
             detail="Project not found"
         )
     
-    return Project(**deserialize_from_db(project_doc))
+    return trusted_response(Project, project_doc)
 
 
 @api_router.post("/projects", response_model=Project, status_code=status.HTTP_201_CREATED)
@@ -224,8 +379,9 @@ async def create_project(project_data: ProjectCreate, current_user: TokenData =
         created_by=current_user.user_id
     )
     
-    doc = serialize_for_db(project.model_dump())
+    doc = project.model_dump()
     await db.projects.insert_one(doc)
+    change_feed.publish("projects", "insert", project.id, doc, project.version)
     
     # Log the action
     log = LogEntry(
@@ -236,18 +392,47 @@ async def create_project(project_data: ProjectCreate, current_user: TokenData =
         entity_id=project.id,
         details={"title": project.title}
     )
-    await db.logs.insert_one(serialize_for_db(log.model_dump()))
+    await db.logs.insert_one(log.model_dump())
     
     return project
 
 
-@api_router.patch("/projects/{project_id}", response_model=Project)
+@api_router.patch(
+    "/projects/{project_id}",
+    response_model=Project,
+    openapi_extra={"requestBody": {"required": True, "content": {
+        "application/json": {"schema": PROJECT_UPDATE_SCHEMA},
+        MERGE_PATCH_MEDIA_TYPE: {"schema": {"type": "object"}},
+        JSON_PATCH_MEDIA_TYPE: {"schema": {"type": "array", "items": {"type": "object"}}},
+    }}}
+)
 async def update_project(
     project_id: str,
-    project_data: ProjectUpdate,
+    request: Request,
     current_user: TokenData = Depends(get_current_user)
 ):
-    """Update project"""
+    """
+    Update project
+
+    application/json: fields to replace (ProjectUpdate)
+    application/merge-patch+json: RFC 7396 merge patch
+    application/json-patch+json: RFC 6902 operations
+    """
+    media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Request body must be valid JSON"
+        )
+    
+    if media_type not in (JSON_PATCH_MEDIA_TYPE, MERGE_PATCH_MEDIA_TYPE):
+        try:
+            project_data = ProjectUpdate.model_validate(body)
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
+    
     # Get existing project
     existing_project = await db.projects.find_one({"id": project_id}, {"_id": 0})
     if not existing_project:
@@ -256,14 +441,37 @@ async def update_project(
             detail="Project not found"
         )
     
+    if media_type in (JSON_PATCH_MEDIA_TYPE, MERGE_PATCH_MEDIA_TYPE):
+        return await patch_project(existing_project, body, media_type, current_user)
+    
     # Update only provided fields
     update_data = {k: v for k, v in project_data.model_dump(exclude_unset=True).items() if v is not None}
-    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
-    
-    await db.projects.update_one(
-        {"id": project_id},
-        {"$set": serialize_for_db(update_data)}
+    for field in LIST_FIELDS:
+        if field in update_data:
+            update_data[field] = ensure_line_ids(update_data[field])
+    update_data["updated_at"] = datetime.now(timezone.utc)
+    
+    query = {"id": project_id}
+    old_status = existing_project.get("status")
+    if "status" in update_data and update_data["status"] != old_status:
+        validate_transition(old_status, update_data["status"], current_user)
+        # The transition was validated against this status
+        query["status"] = old_status
+    
+    updated_project = await db.projects.find_one_and_update(
+        query,
+        {"$set": update_data, "$inc": {"version": 1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
     )
+    if updated_project is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="The project was changed concurrently, reload it and retry"
+        )
+    change_feed.publish("projects", "update", project_id, update_data, updated_project["version"])
+    if "status" in update_data:
+        project_lifecycle.status_changed(project_id, old_status, update_data["status"])
     
     # Log the action
     log = LogEntry(
@@ -272,13 +480,107 @@ async def update_project(
         action="UPDATE",
         entity_type="PROJECT",
         entity_id=project_id,
-        details=update_data
+        details=audit_details.diff(existing_project, update_data, title=existing_project.get("title"))
+    )
+    await db.logs.insert_one(log.model_dump())
+    
+    return Project(**updated_project)
+
+
+def validate_transition(old_status: Optional[str], new_status: ProjectStatus, current_user: TokenData):
+    try:
+        check_transition(old_status, new_status, current_user.role)
+    except InvalidTransition as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+
+async def patch_project(existing_project: dict, body, media_type: str, current_user: TokenData) -> Project:
+    """Apply a JSON Patch or merge patch as the minimal set of update operators"""
+    project_id = existing_project["id"]
+    try:
+        if media_type == JSON_PATCH_MEDIA_TYPE:
+            patched = apply_json_patch(existing_project, body)
+        elif isinstance(body, dict):
+            patched = apply_merge_patch(existing_project, body)
+        else:
+            raise PatchError("A merge patch must be a JSON object")
+    except PatchTestFailed as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except PatchError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    
+    protected = [
+        field for field in set(existing_project) | set(patched)
+        if field not in PATCHABLE_PROJECT_FIELDS and existing_project.get(field) != patched.get(field)
+    ]
+    if protected:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Fields cannot be patched: {', '.join(sorted(protected))}"
+        )
+    
+    for field in LIST_FIELDS:
+        patched[field] = ensure_line_ids(patched.get(field))
+    try:
+        validated = Project(**patched)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    
+    old_values = {field: existing_project[field] for field in PATCHABLE_PROJECT_FIELDS if field in existing_project}
+    new_values = validated.model_dump(include=set(PATCHABLE_PROJECT_FIELDS))
+    update, conditions = compile_update(old_values, new_values)
+    if not update:
+        return validated
+    
+    old_status = existing_project.get("status")
+    status_changed = validated.status != old_status
+    if status_changed:
+        validate_transition(old_status, validated.status, current_user)
+        conditions["status"] = old_status
+    
+    update.setdefault("$set", {})["updated_at"] = datetime.now(timezone.utc)
+    update["$inc"] = {"version": 1}
+    query = {"id": project_id, **conditions}
+    if media_type == JSON_PATCH_MEDIA_TYPE:
+        query.update(test_conditions(body))
+    try:
+        updated_project = await db.projects.find_one_and_update(
+            query,
+            update,
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+    except OperationFailure:
+        # e.g. a nested $set after another editor replaced the parent with null
+        updated_project = None
+    if updated_project is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="The project was changed concurrently, reload it and retry"
+        )
+    
+    changed_fields = {path.split(".", 1)[0] for operator in ("$set", "$unset", "$push") for path in update.get(operator, {})}
+    change_feed.publish(
+        "projects", "update", project_id,
+        {field: updated_project.get(field) for field in changed_fields}, updated_project["version"]
+    )
+    if status_changed:
+        project_lifecycle.status_changed(project_id, old_status, validated.status)
+    
+    log = LogEntry(
+        user_id=current_user.user_id,
+        user_name=current_user.email,
+        action="UPDATE",
+        entity_type="PROJECT",
+        entity_id=project_id,
+        details=audit_details.diff(
+            old_values, new_values,
+            title=existing_project.get("title"), format=media_type.split("/")[1].removesuffix("+json")
+        )
     )
-    await db.logs.insert_one(serialize_for_db(log.model_dump()))
+    await db.logs.insert_one(log.model_dump())
     
-    # Get updated project
-    updated_project = await db.projects.find_one({"id": project_id}, {"_id": 0})
-    return Project(**deserialize_from_db(updated_project))
+    return Project(**updated_project)
 
 
 @api_router.delete("/projects/{project_id}")
@@ -291,6 +593,9 @@ async def delete_project(project_id: str, current_user: TokenData = Depends(get_
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Project not found"
         )
+    change_feed.publish("projects", "delete", project_id)
+    await delta_sync.record_deletion("projects", project_id)
+    await project_lifecycle.release_reservations(project_id)
     
     # Log the action
     log = LogEntry(
@@ -300,24 +605,218 @@ async def delete_project(project_id: str, current_user: TokenData = Depends(get_
         entity_type="PROJECT",
         entity_id=project_id
     )
-    await db.logs.insert_one(serialize_for_db(log.model_dump()))
+    await db.logs.insert_one(log.model_dump())
     
     return {"message": "Project deleted successfully"}
 
 
+# ============== PROJECT LIST ITEM ROUTES ==============
+
+async def finish_list_change(
+    project_id: str,
+    list_name: ProjectListName,
+    updated_project: dict,
+    current_user: TokenData,
+    action: str,
+    details: dict
+) -> dict:
+    """Publish, log (only the delta) and answer a line item change"""
+    field = list_field(list_name)
+    project_list = updated_project.get(field) or {}
+    change_feed.publish(
+        "projects", "update", project_id,
+        {field: project_list, "updated_at": updated_project["updated_at"]}, updated_project["version"]
+    )
+    
+    log = LogEntry(
+        user_id=current_user.user_id,
+        user_name=current_user.email,
+        action=action,
+        entity_type="PROJECT",
+        entity_id=project_id,
+        details={"list": list_name.value, **details}
+    )
+    await db.logs.insert_one(log.model_dump())
+    
+    return {"list": list_name.value, "items": project_list.get("items", []), "version": updated_project["version"]}
+
+
+@api_router.post("/projects/{project_id}/lists/{list_name}/items", status_code=status.HTTP_201_CREATED)
+async def add_list_item(
+    project_id: str,
+    list_name: ProjectListName,
+    item_data: LineItemCreate,
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Add one line item to a project list"""
+    field = list_field(list_name)
+    item = {"line_id": new_line_id(), **item_data.model_dump(exclude={"position"})}
+    push = {"$each": [item]}
+    if item_data.position is not None:
+        push["$position"] = item_data.position
+    now = datetime.now(timezone.utc)
+    projection = {"_id": 0, field: 1, "updated_at": 1, "version": 1}
+    
+    updated_project = await db.projects.find_one_and_update(
+        {"id": project_id, field: {"$type": "object"}},
+        {"$push": {f"{field}.items": push}, "$set": {"updated_at": now}, "$inc": {"version": 1}},
+        projection=projection,
+        return_document=ReturnDocument.AFTER
+    )
+    if updated_project is None:
+        # The list has never been set: create it with this item
+        updated_project = await db.projects.find_one_and_update(
+            {"id": project_id, field: None},
+            {"$set": {field: {"items": [item]}, "updated_at": now}, "$inc": {"version": 1}},
+            projection=projection,
+            return_document=ReturnDocument.AFTER
+        )
+    if updated_project is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Project not found"
+        )
+    
+    return await finish_list_change(
+        project_id, list_name, updated_project, current_user, "ADD_LIST_ITEM", {"item": item}
+    )
+
+
+@api_router.patch("/projects/{project_id}/lists/{list_name}/items/{line_id}")
+async def update_list_item(
+    project_id: str,
+    list_name: ProjectListName,
+    line_id: str,
+    item_data: LineItemUpdate,
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Change fields (e.g. quantity) of one line item"""
+    field = list_field(list_name)
+    changes = {k: v for k, v in item_data.model_dump(exclude_unset=True).items() if v is not None}
+    if not changes:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No fields to update"
+        )
+    
+    update = {f"{field}.items.$.{name}": value for name, value in changes.items()}
+    update["updated_at"] = datetime.now(timezone.utc)
+    updated_project = await db.projects.find_one_and_update(
+        {"id": project_id, f"{field}.items.line_id": line_id},
+        {"$set": update, "$inc": {"version": 1}},
+        projection={"_id": 0, field: 1, "updated_at": 1, "version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if updated_project is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Project or line item not found"
+        )
+    
+    return await finish_list_change(
+        project_id, list_name, updated_project, current_user, "UPDATE_LIST_ITEM",
+        {"line_id": line_id, "changes": changes}
+    )
+
+
+@api_router.delete("/projects/{project_id}/lists/{list_name}/items/{line_id}")
+async def remove_list_item(
+    project_id: str,
+    list_name: ProjectListName,
+    line_id: str,
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Remove one line item from a project list"""
+    field = list_field(list_name)
+    updated_project = await db.projects.find_one_and_update(
+        {"id": project_id, f"{field}.items.line_id": line_id},
+        {
+            "$pull": {f"{field}.items": {"line_id": line_id}},
+            "$set": {"updated_at": datetime.now(timezone.utc)},
+            "$inc": {"version": 1}
+        },
+        projection={"_id": 0, field: 1, "updated_at": 1, "version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if updated_project is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Project or line item not found"
+        )
+    
+    return await finish_list_change(
+        project_id, list_name, updated_project, current_user, "REMOVE_LIST_ITEM", {"line_id": line_id}
+    )
+
+
+@api_router.put("/projects/{project_id}/lists/{list_name}/order")
+async def reorder_list_items(
+    project_id: str,
+    list_name: ProjectListName,
+    order: LineItemOrder,
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Reorder a project list (line_ids must name every item exactly once)"""
+    field = list_field(list_name)
+    project = await db.projects.find_one({"id": project_id}, {"_id": 0, field: 1})
+    if not project:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Project not found"
+        )
+    
+    items = (project.get(field) or {}).get("items") or []
+    by_line_id = {item.get("line_id"): item for item in items}
+    if len(by_line_id) != len(items) or len(order.line_ids) != len(items) or set(order.line_ids) != set(by_line_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="line_ids must list every line item of the list exactly once"
+        )
+    
+    # Only applied if the list is still exactly what was read
+    updated_project = await db.projects.find_one_and_update(
+        {"id": project_id, f"{field}.items": items},
+        {
+            "$set": {f"{field}.items": [by_line_id[line_id] for line_id in order.line_ids], "updated_at": datetime.now(timezone.utc)},
+            "$inc": {"version": 1}
+        },
+        projection={"_id": 0, field: 1, "updated_at": 1, "version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if updated_project is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="The list was changed concurrently, reload it and retry"
+        )
+    
+    return await finish_list_change(
+        project_id, list_name, updated_project, current_user, "REORDER_LIST_ITEMS", {"line_ids": order.line_ids}
+    )
+
+
 # ============== INVENTORY ROUTES ==============
 
 @api_router.get("/inventory", response_model=List[InventoryItem])
 async def get_inventory(current_user: TokenData = Depends(get_current_user)):
     """Get all inventory items"""
-    items = await db.inventory.find({}, {"_id": 0}).to_list(1000)
-    return [InventoryItem(**deserialize_from_db(item)) for item in items]
+    items = await db.inventory.find({}, INVENTORY_FIELDS).to_list(1000)
+    return trusted_response(InventoryItem, items)
+
+
+@api_router.post("/inventory/lookup", response_model=InventoryLookupResult)
+async def lookup_inventory(
+    lookup: ItemLookup,
+    loaders: Loaders = Depends(get_loaders),
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Inventory items for up to 5000 ids in one query (missing ids are listed separately)"""
+    return await lookup_items("inventory", InventoryItem, lookup, loaders)
 
 
 @api_router.get("/inventory/{item_id}", response_model=InventoryItem)
 async def get_inventory_item(item_id: str, current_user: TokenData = Depends(get_current_user)):
     """Get inventory item by ID"""
-    item_doc = await db.inventory.find_one({"id": item_id}, {"_id": 0})
+    item_doc = await db.inventory.find_one({"id": item_id}, INVENTORY_FIELDS)
     
     if not item_doc:
         raise HTTPException(
@@ -325,7 +824,7 @@ async def get_inventory_item(item_id: str, current_user: TokenData = Depends(get
             detail="Inventory item not found"
         )
     
-    return InventoryItem(**deserialize_from_db(item_doc))
+    return trusted_response(InventoryItem, item_doc)
 
 
 @api_router.post("/inventory", response_model=InventoryItem, status_code=status.HTTP_201_CREATED)
@@ -336,8 +835,9 @@ async def create_inventory_item(
     """Create new inventory item (Curator or Admin only)"""
     item = InventoryItem(**item_data.model_dump())
     
-    doc = serialize_for_db(item.model_dump())
+    doc = item.model_dump()
     await db.inventory.insert_one(doc)
+    change_feed.publish("inventory", "insert", item.id, doc, item.version)
     
     # Log the action
     log = LogEntry(
@@ -348,7 +848,7 @@ async def create_inventory_item(
         entity_id=item.id,
         details={"name": item.name, "quantity": item.total_quantity}
     )
-    await db.logs.insert_one(serialize_for_db(log.model_dump()))
+    await db.logs.insert_one(log.model_dump())
     
     return item
 
@@ -368,12 +868,28 @@ async def update_inventory_item(
         )
     
     update_data = {k: v for k, v in item_data.model_dump(exclude_unset=True).items() if v is not None}
-    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_data["updated_at"] = datetime.now(timezone.utc)
     
-    await db.inventory.update_one(
+    updated_item = await db.inventory.find_one_and_update(
         {"id": item_id},
-        {"$set": serialize_for_db(update_data)}
+        {"$set": update_data, "$inc": {"version": 1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
     )
+    if updated_item is None:
+        # Deleted since it was read
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Inventory item not found"
+        )
+    change_feed.publish("inventory", "update", item_id, update_data, updated_item["version"])
+    if snapshot_changed(existing_item, update_data):
+        snapshot_refresher.schedule("inventory", item_id)
+    if "total_quantity" in update_data:
+        await stock_ledger.adjust(
+            "inventory", item_id, existing_item.get("total_quantity") or 0, update_data["total_quantity"],
+            user_id=current_user.user_id
+        )
     
     # Log the action
     log = LogEntry(
@@ -382,12 +898,11 @@ async def update_inventory_item(
         action="UPDATE",
         entity_type="INVENTORY",
         entity_id=item_id,
-        details=update_data
+        details=audit_details.diff(existing_item, update_data, name=existing_item.get("name"))
     )
-    await db.logs.insert_one(serialize_for_db(log.model_dump()))
+    await db.logs.insert_one(log.model_dump())
     
-    updated_item = await db.inventory.find_one({"id": item_id}, {"_id": 0})
-    return InventoryItem(**deserialize_from_db(updated_item))
+    return InventoryItem(**updated_item)
 
 
 @api_router.delete("/inventory/{item_id}")
@@ -396,14 +911,20 @@ async def delete_inventory_item(
     current_user: TokenData = Depends(get_current_admin_user)
 ):
     """Delete inventory item (Admin only)"""
-    result = await db.inventory.delete_one({"id": item_id})
+    deleted_item = await db.inventory.find_one_and_delete({"id": item_id}, {"_id": 0, "images": 1})
     
-    if result.deleted_count == 0:
+    if not deleted_item:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Inventory item not found"
         )
     
+    # Remove stored images (Telegram messages are deleted in batches by the sweeper)
+    await storage_service.delete_images(deleted_item.get('images', []))
+    change_feed.publish("inventory", "delete", item_id)
+    await delta_sync.record_deletion("inventory", item_id)
+    await stock_ledger.forget("inventory", item_id)
+    
     # Log the action
     log = LogEntry(
         user_id=current_user.user_id,
@@ -412,7 +933,7 @@ async def delete_inventory_item(
         entity_type="INVENTORY",
         entity_id=item_id
     )
-    await db.logs.insert_one(serialize_for_db(log.model_dump()))
+    await db.logs.insert_one(log.model_dump())
     
     return {"message": "Inventory item deleted successfully"}
 
@@ -422,8 +943,18 @@ async def delete_inventory_item(
 @api_router.get("/equipment", response_model=List[EquipmentItem])
 async def get_equipment(current_user: TokenData = Depends(get_current_user)):
     """Get all equipment items"""
-    equipment = await db.equipment.find({}, {"_id": 0}).to_list(1000)
-    return [EquipmentItem(**deserialize_from_db(item)) for item in equipment]
+    equipment = await db.equipment.find({}, EQUIPMENT_FIELDS).to_list(1000)
+    return trusted_response(EquipmentItem, equipment)
+
+
+@api_router.post("/equipment/lookup", response_model=EquipmentLookupResult)
+async def lookup_equipment(
+    lookup: ItemLookup,
+    loaders: Loaders = Depends(get_loaders),
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Equipment items for up to 5000 ids in one query (missing ids are listed separately)"""
+    return await lookup_items("equipment", EquipmentItem, lookup, loaders)
 
 
 @api_router.get("/equipment/{item_id}", response_model=EquipmentItem)
@@ -432,7 +963,7 @@ async def get_equipment_item(
     current_user: TokenData = Depends(get_current_user)
 ):
     """Get a single equipment item"""
-    item = await db.equipment.find_one({"id": item_id}, {"_id": 0})
+    item = await db.equipment.find_one({"id": item_id}, EQUIPMENT_FIELDS)
     
     if not item:
         raise HTTPException(
@@ -440,7 +971,7 @@ async def get_equipment_item(
             detail="Equipment item not found"
         )
     
-    return EquipmentItem(**deserialize_from_db(item))
+    return trusted_response(EquipmentItem, item)
 
 
 @api_router.post("/equipment", response_model=EquipmentItem, status_code=status.HTTP_201_CREATED)
@@ -451,8 +982,9 @@ async def create_equipment_item(
     """Create a new equipment item (Curator or Admin)"""
     item = EquipmentItem(**item_data.model_dump())
     
-    doc = serialize_for_db(item.model_dump())
+    doc = item.model_dump()
     await db.equipment.insert_one(doc)
+    change_feed.publish("equipment", "insert", item.id, doc, item.version)
     
     # Log the action
     log = LogEntry(
@@ -463,7 +995,7 @@ async def create_equipment_item(
         entity_id=item.id,
         details={"name": item.name, "category": item.category}
     )
-    await db.logs.insert_one(serialize_for_db(log.model_dump()))
+    await db.logs.insert_one(log.model_dump())
     
     return item
 
@@ -485,12 +1017,29 @@ async def update_equipment_item(
     
     # Update only provided fields
     update_data = item_data.model_dump(exclude_unset=True)
+    updated_item = item
     if update_data:
-        update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
-        await db.equipment.update_one(
+        update_data["updated_at"] = datetime.now(timezone.utc)
+        updated_item = await db.equipment.find_one_and_update(
             {"id": item_id},
-            {"$set": update_data}
+            {"$set": update_data, "$inc": {"version": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
         )
+        if updated_item is None:
+            # Deleted since it was read
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Equipment item not found"
+            )
+        change_feed.publish("equipment", "update", item_id, update_data, updated_item["version"])
+        if snapshot_changed(item, update_data):
+            snapshot_refresher.schedule("equipment", item_id)
+        if update_data.get("total_quantity") is not None:
+            await stock_ledger.adjust(
+                "equipment", item_id, item.get("total_quantity") or 0, update_data["total_quantity"],
+                user_id=current_user.user_id
+            )
     
     # Log the action
     log = LogEntry(
@@ -499,12 +1048,11 @@ async def update_equipment_item(
         action="UPDATE",
         entity_type="EQUIPMENT",
         entity_id=item_id,
-        details=update_data
+        details=audit_details.diff(item, update_data, name=item.get("name"))
     )
-    await db.logs.insert_one(serialize_for_db(log.model_dump()))
+    await db.logs.insert_one(log.model_dump())
     
-    updated_item = await db.equipment.find_one({"id": item_id}, {"_id": 0})
-    return EquipmentItem(**deserialize_from_db(updated_item))
+    return EquipmentItem(**updated_item)
 
 
 @api_router.delete("/equipment/{item_id}")
@@ -513,14 +1061,20 @@ async def delete_equipment_item(
     current_user: TokenData = Depends(get_current_admin_user)
 ):
     """Delete equipment item (Admin only)"""
-    result = await db.equipment.delete_one({"id": item_id})
+    deleted_item = await db.equipment.find_one_and_delete({"id": item_id}, {"_id": 0, "images": 1})
     
-    if result.deleted_count == 0:
+    if not deleted_item:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Equipment item not found"
         )
     
+    # Remove stored images (Telegram messages are deleted in batches by the sweeper)
+    await storage_service.delete_images(deleted_item.get('images', []))
+    change_feed.publish("equipment", "delete", item_id)
+    await delta_sync.record_deletion("equipment", item_id)
+    await stock_ledger.forget("equipment", item_id)
+    
     # Log the action
     log = LogEntry(
         user_id=current_user.user_id,
@@ -529,7 +1083,7 @@ async def delete_equipment_item(
         entity_type="EQUIPMENT",
         entity_id=item_id
     )
-    await db.logs.insert_one(serialize_for_db(log.model_dump()))
+    await db.logs.insert_one(log.model_dump())
     
     return {"message": "Equipment item deleted successfully"}
 
@@ -570,23 +1124,30 @@ async def upload_equipment_image(
             detail=f"File too large. Max size: {max_size_mb}MB"
         )
     
-    # Save image
+    # Save image (remote backends return a pending local URL and upload in background)
     try:
-        image_url = await storage_service.save_image(file_content, file.filename, item_id)
-        
-        # Update item's images array
-        current_images = item.get('images', [])
-        current_images.append(image_url)
+        image_url = await upload_queue.save_image(file_content, file.filename, item_id)
         
-        await db.equipment.update_one(
+        # Append to item's images array atomically
+        updated_item = await db.equipment.find_one_and_update(
             {"id": item_id},
             {
-                "$set": {
-                    "images": current_images,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }
-            }
+                "$push": {"images": image_url},
+                "$set": {"updated_at": datetime.now(timezone.utc)},
+                "$inc": {"version": 1}
+            },
+            projection={"_id": 0, "images": 1, "updated_at": 1, "version": 1},
+            return_document=ReturnDocument.AFTER
         )
+        current_images = updated_item.get('images', []) if updated_item else [image_url]
+        if updated_item:
+            change_feed.publish(
+                "equipment", "update", item_id,
+                {"images": current_images, "updated_at": updated_item["updated_at"]}, updated_item["version"]
+            )
+            snapshot_refresher.schedule("equipment", item_id)
+        
+        await upload_queue.enqueue(image_url, item_id, "equipment", file.filename)
         
         # Log the action
         log = LogEntry(
@@ -597,7 +1158,7 @@ async def upload_equipment_image(
             entity_id=item_id,
             details={"filename": file.filename, "image_url": image_url}
         )
-        await db.logs.insert_one(serialize_for_db(log.model_dump()))
+        await db.logs.insert_one(log.model_dump())
         
         return {
             "message": "Image uploaded successfully",
@@ -639,15 +1200,22 @@ async def delete_equipment_image(
     current_images.remove(image_url)
     
     # Update database
-    await db.equipment.update_one(
+    updated_item = await db.equipment.find_one_and_update(
         {"id": item_id},
         {
-            "$set": {
-                "images": current_images,
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }
-        }
+            "$pull": {"images": image_url},
+            "$set": {"updated_at": datetime.now(timezone.utc)},
+            "$inc": {"version": 1}
+        },
+        projection={"_id": 0, "images": 1, "updated_at": 1, "version": 1},
+        return_document=ReturnDocument.AFTER
     )
+    if updated_item:
+        change_feed.publish(
+            "equipment", "update", item_id,
+            {"images": updated_item["images"], "updated_at": updated_item["updated_at"]}, updated_item["version"]
+        )
+        snapshot_refresher.schedule("equipment", item_id)
     
     # Delete physical file
     await storage_service.delete_image(image_url)
@@ -661,7 +1229,7 @@ async def delete_equipment_image(
         entity_id=item_id,
         details={"image_url": image_url}
     )
-    await db.logs.insert_one(serialize_for_db(log.model_dump()))
+    await db.logs.insert_one(log.model_dump())
     
     return {
         "message": "Image deleted successfully",
@@ -669,6 +1237,213 @@ async def delete_equipment_image(
     }
 
 
+# ============== STOCK LEDGER ROUTES ==============
+
+async def stock_levels_response(collection: str, item_id: str) -> FastJSONResponse:
+    levels = await stock_ledger.get_levels(collection, item_id)
+    if levels is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Item not found")
+    return trusted_response(StockLevels, levels)
+
+
+async def stock_history_response(collection: str, item_id: str, limit: int) -> FastJSONResponse:
+    if not await db[collection].find_one({"id": item_id}, {"_id": 1}):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Item not found")
+    movements = await stock_ledger.history(collection, item_id, limit)
+    return trusted_response(StockMovement, movements)
+
+
+async def record_stock_movement(
+    collection: str,
+    item_id: str,
+    movement_data: StockMovementCreate,
+    current_user: TokenData
+) -> StockMovementResult:
+    """Apply a movement; receive, write_off and scrap also move the item's total_quantity"""
+    if movement_data.kind == StockMovementKind.ADJUST:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Adjustments are recorded by editing total_quantity"
+        )
+    try:
+        movement, levels = await stock_ledger.record(
+            collection, item_id, movement_data.kind, movement_data.quantity,
+            project_id=movement_data.project_id, note=movement_data.note, user_id=current_user.user_id
+        )
+    except LookupError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Item not found")
+    except InsufficientStock as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    
+    on_hand_change = movement["deltas"].get("on_hand")
+    if on_hand_change:
+        now = datetime.now(timezone.utc)
+        updated_item = await db[collection].find_one_and_update(
+            {"id": item_id},
+            {"$inc": {"total_quantity": on_hand_change, "version": 1}, "$set": {"updated_at": now}},
+            projection={"_id": 0, "total_quantity": 1, "version": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if updated_item:
+            change_feed.publish(
+                collection, "update", item_id,
+                {"total_quantity": updated_item["total_quantity"], "updated_at": now}, updated_item["version"]
+            )
+    return StockMovementResult(movement=movement, levels=levels)
+
+
+@api_router.get("/inventory/{item_id}/stock", response_model=StockLevels)
+async def get_inventory_stock(item_id: str, current_user: TokenData = Depends(get_current_user)):
+    """Stock counters of an inventory item (on hand, reserved, out, damaged, available)"""
+    return await stock_levels_response("inventory", item_id)
+
+
+@api_router.get("/inventory/{item_id}/stock/movements", response_model=List[StockMovement])
+async def get_inventory_stock_movements(
+    item_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Stock movements of an inventory item, newest first"""
+    return await stock_history_response("inventory", item_id, limit)
+
+
+@api_router.post(
+    "/inventory/{item_id}/stock/movements",
+    response_model=StockMovementResult,
+    status_code=status.HTTP_201_CREATED
+)
+async def create_inventory_stock_movement(
+    item_id: str,
+    movement_data: StockMovementCreate,
+    current_user: TokenData = Depends(get_current_curator_or_admin)
+):
+    """Record a stock movement of an inventory item (Curator or Admin only)"""
+    return await record_stock_movement("inventory", item_id, movement_data, current_user)
+
+
+@api_router.get("/equipment/{item_id}/stock", response_model=StockLevels)
+async def get_equipment_stock(item_id: str, current_user: TokenData = Depends(get_current_user)):
+    """Stock counters of an equipment item (on hand, reserved, out, damaged, available)"""
+    return await stock_levels_response("equipment", item_id)
+
+
+@api_router.get("/equipment/{item_id}/stock/movements", response_model=List[StockMovement])
+async def get_equipment_stock_movements(
+    item_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Stock movements of an equipment item, newest first"""
+    return await stock_history_response("equipment", item_id, limit)
+
+
+@api_router.post(
+    "/equipment/{item_id}/stock/movements",
+    response_model=StockMovementResult,
+    status_code=status.HTTP_201_CREATED
+)
+async def create_equipment_stock_movement(
+    item_id: str,
+    movement_data: StockMovementCreate,
+    current_user: TokenData = Depends(get_current_curator_or_admin)
+):
+    """Record a stock movement of an equipment item (Curator or Admin only)"""
+    return await record_stock_movement("equipment", item_id, movement_data, current_user)
+
+
+# ============== CHANGE FEED ROUTES ==============
+
+@api_router.post("/changes/token", response_model=StreamToken)
+async def create_changes_stream_token(current_user: TokenData = Depends(get_current_user)):
+    """
+    Short-lived token for GET /api/changes?token=...
+
+    Browsers open the stream with EventSource, which cannot send an
+    Authorization header; this token opens the stream only and expires in
+    STREAM_TOKEN_EXPIRE_SECONDS, so a URL that ends up in a log is of little use.
+    """
+    return StreamToken(token=create_stream_token(current_user), expires_in=STREAM_TOKEN_EXPIRE_SECONDS)
+
+
+@api_router.get("/changes")
+async def stream_changes(
+    request: Request,
+    entities: Optional[str] = None,
+    project_id: List[str] = Query(default=[]),
+    last_event_id: Optional[str] = None,
+    current_user: TokenData = Depends(get_stream_user)
+):
+    """
+    Server-sent events with entity deltas
+
+    Authenticated by a Bearer header or by ?token= from POST /api/changes/token.
+    entities: comma-separated subset of projects,inventory,equipment (default: all)
+    project_id: repeatable; limits project events to these projects
+    Reconnects with Last-Event-ID replay the missed events or send a resync;
+    last_event_id does the same for a new EventSource opened with a fresh token.
+    """
+    try:
+        selected = parse_entities(entities)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    return StreamingResponse(
+        change_feed.sse_stream(selected, project_id, request.headers.get("last-event-id") or last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@api_router.websocket("/changes/ws")
+async def change_feed_websocket(websocket: WebSocket):
+    """
+    Entity deltas over WebSocket
+
+    The first message authenticates and subscribes (browsers cannot set headers
+    on a WebSocket, and a token in the URL would end up in access logs):
+        {"token": "<JWT>", "entities": ["projects"], "project_ids": ["..."]}
+    """
+    await websocket.accept()
+    try:
+        hello = await asyncio.wait_for(websocket.receive_json(), timeout=10)
+        decode_access_token(hello.get("token") or "")
+        selected = parse_entities(hello.get("entities"))
+        project_ids = parse_project_ids(hello.get("project_ids"))
+    except WebSocketDisconnect:
+        return
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Could not validate credentials")
+        return
+    except (asyncio.TimeoutError, AttributeError, ValueError) as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e)[:120] or "Invalid subscription")
+        return
+    
+    await change_feed.websocket_session(websocket, selected, project_ids)
+
+
+# ============== SYNC ROUTES ==============
+
+@api_router.get("/sync")
+async def sync_changes(
+    since: Optional[str] = None,
+    limit: int = Query(default=SYNC_DEFAULT_LIMIT, ge=1, le=SYNC_MAX_LIMIT),
+    current_user: TokenData = Depends(get_current_user)
+):
+    """
+    Projects, inventory and equipment changed since a sync token, with deletions
+
+    Without since (or with an expired token) returns everything with reset=true.
+    Pass the returned token next time; repeat while has_more is true.
+    """
+    try:
+        changes = await delta_sync.changes(since, limit)
+    except InvalidSyncToken as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    return FastJSONResponse(content=changes)
+
+
 # ============== LOGS ROUTES ==============
 
 @api_router.get("/logs", response_model=List[LogEntry])
@@ -679,10 +1454,10 @@ async def get_logs(
     """Get activity logs (Admin only)"""
     # Автоматически удалить логи старше 30 дней
     one_month_ago = datetime.now(timezone.utc) - timedelta(days=30)
-    await db.logs.delete_many({"timestamp": {"$lt": one_month_ago.isoformat()}})
+    await db.logs.delete_many({"timestamp": {"$lt": one_month_ago}})
     
-    logs = await db.logs.find({}, {"_id": 0}).sort("timestamp", -1).to_list(limit)
-    return [LogEntry(**deserialize_from_db(log)) for log in logs]
+    logs = await db.logs.find({}, LOG_FIELDS).sort("timestamp", -1).to_list(limit)
+    return trusted_response(LogEntry, [expand_details(log) for log in logs])
 
 
 @api_router.delete("/logs/cleanup")
@@ -691,7 +1466,7 @@ async def cleanup_old_logs(
 ):
     """Manually delete logs older than 30 days (Admin only)"""
     one_month_ago = datetime.now(timezone.utc) - timedelta(days=30)
-    result = await db.logs.delete_many({"timestamp": {"$lt": one_month_ago.isoformat()}})
+    result = await db.logs.delete_many({"timestamp": {"$lt": one_month_ago}})
     
     return {
         "message": "Old logs deleted successfully",
@@ -718,7 +1493,7 @@ async def initialize_database():
         role=UserRole.ADMIN
     )
     
-    doc = serialize_for_db(admin.model_dump())
+    doc = admin.model_dump()
     await db.users.insert_one(doc)
     
     # Create some sample inventory items
@@ -730,7 +1505,7 @@ async def initialize_database():
     ]
     
     for item in sample_items:
-        await db.inventory.insert_one(serialize_for_db(item.model_dump()))
+        await db.inventory.insert_one(item.model_dump())
     
     return {
         "message": "Database initialized successfully",
@@ -765,6 +1540,13 @@ async def load_test_data():
         await db.inventory.delete_many({})
         await db.equipment.delete_many({})
         await db.logs.delete_many({})
+        # The reloaded items reuse their ids: their stock opens again from total_quantity
+        await db.stock_levels.delete_many({})
+        await db.stock_snapshots.delete_many({})
+        await db.stock_movements.delete_many({})
+        await db.reservations.delete_many({})
+        # Deleted ids are not recorded: clients resynchronize from scratch
+        await delta_sync.reset()
         
         stats = {
             "users": 0,
@@ -781,7 +1563,7 @@ async def load_test_data():
                 password_hash=get_password_hash(password),
                 created_at=datetime.now(timezone.utc)
             )
-            await db.users.insert_one(serialize_for_db(user.model_dump()))
+            await db.users.insert_one(user.model_dump())
             stats["users"] += 1
         
         # Load projects
@@ -795,7 +1577,7 @@ async def load_test_data():
                 created_at=datetime.now(timezone.utc),
                 updated_at=datetime.now(timezone.utc)
             )
-            await db.projects.insert_one(serialize_for_db(project.model_dump()))
+            await db.projects.insert_one(project.model_dump())
             stats["projects"] += 1
         
         # Load inventory
@@ -805,7 +1587,7 @@ async def load_test_data():
                 created_at=datetime.now(timezone.utc),
                 updated_at=datetime.now(timezone.utc)
             )
-            await db.inventory.insert_one(serialize_for_db(item.model_dump()))
+            await db.inventory.insert_one(item.model_dump())
             stats["inventory"] += 1
         
         # Load equipment
@@ -815,7 +1597,7 @@ async def load_test_data():
                 created_at=datetime.now(timezone.utc),
                 updated_at=datetime.now(timezone.utc)
             )
-            await db.equipment.insert_one(serialize_for_db(item.model_dump()))
+            await db.equipment.insert_one(item.model_dump())
             stats["equipment"] += 1
         
         return {
@@ -874,23 +1656,30 @@ async def upload_inventory_image(
             detail=f"File too large. Max size: {max_size_mb}MB"
         )
     
-    # Save image
+    # Save image (remote backends return a pending local URL and upload in background)
     try:
-        image_url = await storage_service.save_image(file_content, file.filename, item_id)
+        image_url = await upload_queue.save_image(file_content, file.filename, item_id)
         
-        # Update item's images array
-        current_images = item.get('images', [])
-        current_images.append(image_url)
-        
-        await db.inventory.update_one(
+        # Append to item's images array atomically
+        updated_item = await db.inventory.find_one_and_update(
             {"id": item_id},
             {
-                "$set": {
-                    "images": current_images,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }
-            }
+                "$push": {"images": image_url},
+                "$set": {"updated_at": datetime.now(timezone.utc)},
+                "$inc": {"version": 1}
+            },
+            projection={"_id": 0, "images": 1, "updated_at": 1, "version": 1},
+            return_document=ReturnDocument.AFTER
         )
+        current_images = updated_item.get('images', []) if updated_item else [image_url]
+        if updated_item:
+            change_feed.publish(
+                "inventory", "update", item_id,
+                {"images": current_images, "updated_at": updated_item["updated_at"]}, updated_item["version"]
+            )
+            snapshot_refresher.schedule("inventory", item_id)
+        
+        await upload_queue.enqueue(image_url, item_id, "inventory", file.filename)
         
         # Log the action
         log = LogEntry(
@@ -901,7 +1690,7 @@ async def upload_inventory_image(
             entity_id=item_id,
             details={"filename": file.filename, "image_url": image_url}
         )
-        await db.logs.insert_one(serialize_for_db(log.model_dump()))
+        await db.logs.insert_one(log.model_dump())
         
         return {
             "message": "Image uploaded successfully",
@@ -917,6 +1706,130 @@ async def upload_inventory_image(
         )
 
 
+async def upload_images_batch(
+    collection: str,
+    entity_type: str,
+    files: List[UploadFile],
+    item_ids: List[str],
+    current_user: TokenData
+) -> dict:
+    """Validate and store several images for one or more items in a single call"""
+    if len(files) > MAX_BATCH_UPLOAD_FILES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Too many files. Max per request: {MAX_BATCH_UPLOAD_FILES}"
+        )
+    
+    # One item id applies to every file, otherwise ids map to files by position
+    if len(item_ids) == 1:
+        item_ids = item_ids * len(files)
+    if len(item_ids) != len(files):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="item_ids must contain one id or one id per file"
+        )
+    
+    unique_ids = set(item_ids)
+    found = await db[collection].count_documents({"id": {"$in": list(unique_ids)}})
+    if found != len(unique_ids):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="One or more items not found"
+        )
+    
+    allowed_extensions = storage_service.config['local_storage']['allowed_extensions']
+    max_size_mb = storage_service.config['local_storage']['max_file_size_mb']
+    batch = []
+    for file, item_id in zip(files, item_ids):
+        file_ext = file.filename.split('.')[-1].lower()
+        if file_ext not in allowed_extensions:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"File type not allowed: {file.filename}. Allowed: {', '.join(allowed_extensions)}"
+            )
+        file_content = await file.read()
+        if len(file_content) / (1024 * 1024) > max_size_mb:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"File too large: {file.filename}. Max size: {max_size_mb}MB"
+            )
+        batch.append((file_content, file.filename, item_id))
+    
+    # Telegram groups up to 10 photos per sendMediaGroup call
+    try:
+        image_urls = await upload_queue.save_images(batch)
+    except Exception as e:
+        logger.error(f"Error uploading images: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to upload images"
+        )
+    
+    uploaded = {}
+    for (_, filename, item_id), image_url in zip(batch, image_urls):
+        uploaded.setdefault(item_id, []).append({"filename": filename, "image_url": image_url})
+    
+    now = datetime.now(timezone.utc)
+    for item_id, images in uploaded.items():
+        updated_item = await db[collection].find_one_and_update(
+            {"id": item_id},
+            {
+                "$push": {"images": {"$each": [image["image_url"] for image in images]}},
+                "$set": {"updated_at": now},
+                "$inc": {"version": 1}
+            },
+            projection={"_id": 0, "images": 1, "updated_at": 1, "version": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if updated_item:
+            change_feed.publish(
+                collection, "update", item_id,
+                {"images": updated_item["images"], "updated_at": now}, updated_item["version"]
+            )
+            snapshot_refresher.schedule(collection, item_id)
+        for image in images:
+            await upload_queue.enqueue(image["image_url"], item_id, collection, image["filename"])
+    
+    logs = [
+        LogEntry(
+            user_id=current_user.user_id,
+            user_name=current_user.email,
+            action="UPLOAD_IMAGE",
+            entity_type=entity_type,
+            entity_id=item_id,
+            details={"filenames": [image["filename"] for image in images], "image_urls": [image["image_url"] for image in images]}
+        ).model_dump()
+        for item_id, images in uploaded.items()
+    ]
+    await db.logs.insert_many(logs)
+    
+    return {
+        "message": "Images uploaded successfully",
+        "uploaded": uploaded,
+        "total_uploaded": len(image_urls)
+    }
+
+
+@api_router.post("/inventory/images/batch")
+async def upload_inventory_images_batch(
+    files: List[UploadFile] = File(...),
+    item_ids: List[str] = Form(...),
+    current_user: TokenData = Depends(get_current_curator_or_admin)
+):
+    """Upload several images for one or more inventory items"""
+    return await upload_images_batch("inventory", "INVENTORY", files, item_ids, current_user)
+
+
+@api_router.post("/equipment/images/batch")
+async def upload_equipment_images_batch(
+    files: List[UploadFile] = File(...),
+    item_ids: List[str] = Form(...),
+    current_user: TokenData = Depends(get_current_curator_or_admin)
+):
+    """Upload several images for one or more equipment items"""
+    return await upload_images_batch("equipment", "EQUIPMENT", files, item_ids, current_user)
+
+
 @api_router.delete("/inventory/{item_id}/images")
 async def delete_inventory_image(
     item_id: str,
@@ -943,15 +1856,22 @@ async def delete_inventory_image(
     current_images.remove(image_url)
     
     # Update database
-    await db.inventory.update_one(
+    updated_item = await db.inventory.find_one_and_update(
         {"id": item_id},
         {
-            "$set": {
-                "images": current_images,
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }
-        }
+            "$pull": {"images": image_url},
+            "$set": {"updated_at": datetime.now(timezone.utc)},
+            "$inc": {"version": 1}
+        },
+        projection={"_id": 0, "images": 1, "updated_at": 1, "version": 1},
+        return_document=ReturnDocument.AFTER
     )
+    if updated_item:
+        change_feed.publish(
+            "inventory", "update", item_id,
+            {"images": updated_item["images"], "updated_at": updated_item["updated_at"]}, updated_item["version"]
+        )
+        snapshot_refresher.schedule("inventory", item_id)
     
     # Delete physical file
     await storage_service.delete_image(image_url)
@@ -965,7 +1885,7 @@ async def delete_inventory_image(
         entity_id=item_id,
         details={"image_url": image_url}
     )
-    await db.logs.insert_one(serialize_for_db(log.model_dump()))
+    await db.logs.insert_one(log.model_dump())
     
     return {
         "message": "Image deleted successfully",
@@ -987,6 +1907,22 @@ async def get_image(item_id: str, filename: str):
     return FileResponse(file_path)
 
 
+@api_router.get("/files/{backend}/{key:path}")
+async def get_stored_file(backend: str, key: str):
+    """Stream an image stored in GridFS or S3-compatible storage"""
+    stream = await storage_service.open_stream(f"/api/files/{backend}/{key}")
+    
+    if not stream:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Image not found"
+        )
+    
+    chunks, content_type, size = stream
+    headers = {"Content-Length": str(size)} if size is not None else {}
+    return StreamingResponse(chunks, media_type=content_type, headers=headers)
+
+
 @api_router.get("/telegram/image/{file_id}")
 async def get_telegram_image(file_id: str):
     """
@@ -1001,6 +1937,8 @@ async def get_telegram_image(file_id: str):
         )
     
     try:
+        # Accept full references ("{file_id}:{message_id}") as well as bare file_ids
+        file_id = file_id.split(':', 1)[0]
         file_url = await storage_service.get_telegram_file_url(file_id)
         if not file_url:
             raise HTTPException(
@@ -1019,6 +1957,140 @@ async def get_telegram_image(file_id: str):
         )
 
 
+@api_router.get("/admin/upload-queue")
+async def get_upload_queue_stats(current_user: TokenData = Depends(get_current_admin_user)):
+    """Get background upload queue job counts by status (Admin only)"""
+    return {
+        "enabled": upload_queue.enabled,
+        "jobs": await upload_queue.stats()
+    }
+
+
+@api_router.post("/admin/storage/reconcile")
+async def reconcile_storage(
+    action: str = "report",
+    max_batches: Optional[int] = None,
+    current_user: TokenData = Depends(get_current_admin_user)
+):
+    """Find orphaned upload files and report, delete or quarantine them (Admin only)"""
+    if action not in ("report", "delete", "quarantine"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="action must be one of: report, delete, quarantine"
+        )
+    
+    if storage_reconciler.running:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Storage reconciliation is already running"
+        )
+    
+    report = await storage_reconciler.run(action=action, max_batches=max_batches)
+    
+    if action != "report":
+        log = LogEntry(
+            user_id=current_user.user_id,
+            user_name=current_user.email,
+            action="RECONCILE_STORAGE",
+            entity_type="STORAGE",
+            entity_id=action,
+            details={k: report[k] for k in ("orphaned_files", "processed_files", "reclaimed_bytes")}
+        )
+        await db.logs.insert_one(log.model_dump())
+    
+    return report
+
+
+@api_router.get("/admin/slow-queries")
+async def get_slow_queries(
+    limit: int = 100,
+    collection_scans_only: bool = False,
+    current_user: TokenData = Depends(get_current_admin_user)
+):
+    """Get recent slow MongoDB commands, newest first (Admin only)"""
+    entries = slow_query_log.recent(limit=limit, collection_scans_only=collection_scans_only)
+    return {
+        "threshold_ms": slow_query_log.threshold_ms,
+        "explain_enabled": slow_query_log.explain_enabled,
+        "collection_scans": sum(1 for entry in slow_query_log.entries if entry["collection_scan"]),
+        # Commands may contain BSON types (ObjectId, Regex) that the default encoder rejects
+        "entries": json.loads(json_util.dumps(entries))
+    }
+
+
+@api_router.delete("/admin/slow-queries")
+async def clear_slow_queries(current_user: TokenData = Depends(get_current_admin_user)):
+    """Clear the slow query log (Admin only)"""
+    slow_query_log.clear()
+    return {"message": "Slow query log cleared"}
+
+
+@api_router.get("/admin/loop-stalls")
+async def get_loop_stalls(limit: int = 50, current_user: TokenData = Depends(get_current_admin_user)):
+    """Get recent event loop stalls with the blocking stack, newest first (Admin only)"""
+    return {
+        "enabled": loop_watchdog.enabled,
+        "threshold_ms": loop_watchdog.threshold_ms,
+        "stalls": loop_watchdog.recent(limit=limit)
+    }
+
+
+@api_router.delete("/admin/loop-stalls")
+async def clear_loop_stalls(current_user: TokenData = Depends(get_current_admin_user)):
+    """Clear the event loop stall log (Admin only)"""
+    loop_watchdog.clear()
+    return {"message": "Loop stall log cleared"}
+
+
+@api_router.get("/admin/profile")
+async def profile_process(
+    seconds: float = 10,
+    format: str = "speedscope",
+    interval_ms: float = 5,
+    include_idle: bool = False,
+    current_user: TokenData = Depends(get_current_admin_user)
+):
+    """Sample all threads and asyncio tasks and return a profile (Admin only)
+
+    format=speedscope returns a file for https://www.speedscope.app,
+    format=collapsed returns folded stacks for flamegraph.pl / inferno.
+    """
+    if format not in ("speedscope", "collapsed"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="format must be one of: speedscope, collapsed"
+        )
+    
+    if not 0 < seconds <= profiler.max_seconds:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"seconds must be between 0 and {profiler.max_seconds:g}"
+        )
+    
+    if not 1 <= interval_ms <= 100:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="interval_ms must be between 1 and 100"
+        )
+    
+    try:
+        result = await profiler.profile(seconds, interval=interval_ms / 1000, include_idle=include_idle)
+    except ProfilerBusyError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A profile is already running"
+        )
+    
+    name = f"sls1-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}"
+    if format == "collapsed":
+        return Response(content=to_collapsed(result), media_type="text/plain")
+    return Response(
+        content=json.dumps(to_speedscope(result, name=name)),
+        media_type="application/json",
+        headers={"Content-Disposition": f'attachment; filename="{name}.speedscope.json"'}
+    )
+
+
 # ============== GENERAL ROUTES ==============
 
 @api_router.get("/")
@@ -1041,6 +2113,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(CompressionMiddleware)
+
+# Outermost middleware, so latency covers CORS handling and compression as well
+app.add_middleware(MetricsMiddleware)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics"""
+    body, content_type = metrics_response()
+    return Response(content=body, media_type=content_type)
+
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -1048,6 +2133,55 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+background_tasks = []
+
+
+async def migrate_datetimes():
+    """Convert timestamps stored as ISO strings by earlier versions (no-op once done)"""
+    try:
+        await DatetimeMigration(db).run()
+    except Exception as e:
+        logger.error(f"Datetime migration failed: {e}")
+
+
+async def backfill_line_ids():
+    """Give line items stored before line ids existed an id (no-op once done)"""
+    try:
+        await assign_missing_line_ids(db)
+    except Exception as e:
+        logger.error(f"Line id backfill failed: {e}")
+
+
+@app.on_event("startup")
+async def start_background_workers():
+    background_tasks.append(asyncio.create_task(migrate_datetimes()))
+    background_tasks.append(asyncio.create_task(backfill_line_ids()))
+    await upload_queue.start()
+    if deletion_sweeper:
+        await deletion_sweeper.start()
+    await loop_watchdog.start()
+    await slow_query_log.start(client)
+    await change_feed.start(db)
+    await delta_sync.start()
+    await project_calendar.start()
+    await stock_ledger.start()
+    await project_lifecycle.start()
+    await snapshot_refresher.start()
+
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await snapshot_refresher.stop()
+    await project_lifecycle.stop()
+    await stock_ledger.stop()
+    await change_feed.stop()
+    await slow_query_log.stop()
+    await loop_watchdog.stop()
+    await upload_queue.stop()
+    if deletion_sweeper:
+        await deletion_sweeper.stop()
     client.close()
\ No newline at end of file
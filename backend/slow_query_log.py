@@ -0,0 +1,207 @@
+"""
+Slow-query log for MongoDB commands
+
+A pymongo CommandListener records every command slower than a threshold into
+a fixed-size ring buffer. Slow reads are explained in the background
+(queryPlanner verbosity) and flagged when the winning plan is a collection
+scan, so missing indexes show up immediately on the admin endpoint.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Commands that can be explained and whose plan says how documents were found
+EXPLAINABLE_COMMANDS = frozenset({
+    "find", "aggregate", "count", "distinct", "update", "delete", "findAndModify",
+})
+
+# Driver bookkeeping fields that are noise in the log and invalid inside explain
+_DRIVER_FIELDS = ("lsid", "$clusterTime", "$db", "txnNumber", "$readPreference", "signature")
+
+# Fields carrying whole documents; only their size is kept in the log
+_PAYLOAD_FIELDS = ("documents",)
+
+
+def _summarize(command: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of a command without driver fields and bulky payloads"""
+    summary = {}
+    for key, value in command.items():
+        if key in _DRIVER_FIELDS:
+            continue
+        if key in _PAYLOAD_FIELDS and isinstance(value, list):
+            summary[key] = f"<{len(value)} documents>"
+        elif key == "updates" and isinstance(value, list):
+            summary[key] = [{"q": update.get("q"), "multi": update.get("multi", False)} for update in value]
+        else:
+            summary[key] = value
+    return summary
+
+
+def _plan_stages(plan: Dict[str, Any]) -> List[str]:
+    """Flatten the stage names of a query plan tree"""
+    stages = []
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, dict):
+            continue
+        if "stage" in node:
+            stages.append(node["stage"])
+        for key in ("inputStage", "queryPlan"):
+            if key in node:
+                stack.append(node[key])
+        stack.extend(node.get("inputStages", []))
+    return stages
+
+
+def _winning_plan(explain: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Extract the winning plan from find/aggregate explain output"""
+    planner = explain.get("queryPlanner")
+    if planner is None:
+        # Aggregations report the plan inside the first $cursor stage
+        for stage in explain.get("stages", []):
+            if "$cursor" in stage:
+                planner = stage["$cursor"].get("queryPlanner")
+                break
+    return planner.get("winningPlan") if planner else None
+
+
+class SlowQueryLog(monitoring.CommandListener):
+    """Ring buffer of slow MongoDB commands with optional explain plans"""
+
+    def __init__(
+        self,
+        threshold_ms: Optional[float] = None,
+        size: Optional[int] = None,
+        explain: Optional[bool] = None,
+    ):
+        """
+        Args:
+            threshold_ms: Commands at least this slow are recorded (SLOW_QUERY_THRESHOLD_MS, default 100)
+            size: Ring buffer capacity (SLOW_QUERY_LOG_SIZE, default 200)
+            explain: Explain slow reads in the background (SLOW_QUERY_EXPLAIN, default on)
+        """
+        self.threshold_ms = threshold_ms if threshold_ms is not None else float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100))
+        self.explain_enabled = explain if explain is not None else os.environ.get('SLOW_QUERY_EXPLAIN', '1') not in ('0', 'false', 'no')
+        self.entries: Deque[Dict[str, Any]] = deque(maxlen=size or int(os.environ.get('SLOW_QUERY_LOG_SIZE', 200)))
+
+        self._lock = threading.Lock()
+        # (request_id, operation_id) -> (database, command) from started(); only the started event has the command
+        self._pending: Dict[Tuple[int, int], Tuple[str, Dict[str, Any]]] = {}
+
+        self._client = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._explain_queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # ---- CommandListener (called from the driver's threads) ----
+
+    def started(self, event):
+        with self._lock:
+            self._pending[(event.request_id, event.operation_id)] = (event.database_name, event.command)
+
+    def succeeded(self, event):
+        self._finish(event, None)
+
+    def failed(self, event):
+        self._finish(event, str(event.failure.get("errmsg", event.failure)))
+
+    def _finish(self, event, error: Optional[str]):
+        with self._lock:
+            database, command = self._pending.pop((event.request_id, event.operation_id), (event.database_name, None))
+
+        duration_ms = event.duration_micros / 1000
+        if duration_ms < self.threshold_ms or command is None:
+            return
+
+        name = event.command_name
+        collection = command.get("collection") if name == "getMore" else command.get(name)
+        entry = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "database": database,
+            "collection": collection if isinstance(collection, str) else None,
+            "command_name": name,
+            "duration_ms": round(duration_ms, 3),
+            "command": _summarize(command),
+            "error": error,
+            "plan": None,
+            "collection_scan": None,
+        }
+        self.entries.append(entry)
+        logger.warning(f"Slow MongoDB {name} on {entry['collection']}: {entry['duration_ms']} ms")
+
+        if self.explain_enabled and error is None and name in EXPLAINABLE_COMMANDS and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._enqueue_explain, entry, database, command)
+
+    # ---- Background explain ----
+
+    def _enqueue_explain(self, entry, database, command):
+        try:
+            self._explain_queue.put_nowait((entry, database, command))
+        except asyncio.QueueFull:
+            # Explains are best effort; drop them under a burst of slow queries
+            pass
+
+    async def start(self, client):
+        """Start explaining slow commands in the background"""
+        if self._task is not None:
+            return
+        self._client = client
+        self._loop = asyncio.get_running_loop()
+        self._explain_queue = asyncio.Queue(maxsize=50)
+        self._task = asyncio.create_task(self._explain_worker())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self._loop = None
+
+    async def _explain_worker(self):
+        while True:
+            entry, database, command = await self._explain_queue.get()
+            try:
+                await self.explain(entry, database, command)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                entry["plan"] = {"error": str(e)}
+
+    async def explain(self, entry: Dict[str, Any], database: str, command: Dict[str, Any]):
+        """Explain a command and annotate its log entry with the plan stages"""
+        explainable = {k: v for k, v in command.items() if k not in _DRIVER_FIELDS}
+        result = await self._client[database].command(
+            {"explain": explainable, "verbosity": "queryPlanner"}
+        )
+        plan = _winning_plan(result)
+        stages = _plan_stages(plan) if plan else []
+        entry["plan"] = {"stages": stages}
+        entry["collection_scan"] = "COLLSCAN" in stages
+        if entry["collection_scan"]:
+            logger.warning(
+                f"Collection scan on {entry['collection']} ({entry['command_name']}, "
+                f"{entry['duration_ms']} ms) - missing index?"
+            )
+
+    # ---- Reading ----
+
+    def recent(self, limit: int = 100, collection_scans_only: bool = False) -> List[Dict[str, Any]]:
+        """Newest entries first"""
+        entries = list(self.entries)
+        entries.reverse()
+        if collection_scans_only:
+            entries = [entry for entry in entries if entry["collection_scan"]]
+        return entries[:limit]
+
+    def clear(self):
+        self.entries.clear()
@@ -0,0 +1,185 @@
+"""
+Fan-out refresh of the item snapshots embedded in project lists
+
+Line items copy name and category of the inventory or equipment item they
+were picked from, so a project renders from one document. When an item's
+name, category or first image changes, the refresher rewrites those copies
+in every project list referencing it (found through indexes on
+<list>.items.id), in the background, so the item PATCH does not wait for it.
+
+Each copy is updated by index ($set "final_list.items.3.name"), conditional
+on that position still holding the item; if a list was reordered meanwhile
+the project is read again and retried. A burst of edits of one item is
+coalesced into one refresh that writes the latest values. A refresh lost to
+a restart is caught up by the reconciliation run on startup, which only
+writes copies that differ.
+
+Snapshot fields: name, category and image (the item's first image URL).
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from pymongo import ReturnDocument
+
+from line_items import LIST_FIELDS
+from models import LineItemSource
+
+logger = logging.getLogger(__name__)
+
+# Collections whose items are referenced by line items, by line item source
+SOURCE_COLLECTIONS = {
+    LineItemSource.INVENTORY.value: "inventory",
+    LineItemSource.EQUIPMENT.value: "equipment",
+}
+
+# Attempts per project when its lists keep changing under the refresh
+MAX_ATTEMPTS = 3
+
+
+def item_snapshot(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Values a line item copies from its inventory/equipment item"""
+    images = item.get("images") or []
+    return {"name": item.get("name"), "category": item.get("category"), "image": images[0] if images else None}
+
+
+def snapshot_changed(old: Dict[str, Any], update: Dict[str, Any]) -> bool:
+    """Whether writing update over the item old changes its snapshot"""
+    return item_snapshot(old) != item_snapshot({**old, **update})
+
+
+class SnapshotRefresher:
+    """Background worker keeping line item snapshots in step with their items"""
+
+    def __init__(self, db, change_feed=None):
+        self.db = db
+        self.change_feed = change_feed
+        self._queue: "asyncio.Queue[Tuple[str, str]]" = asyncio.Queue()
+        self._pending: Set[Tuple[str, str]] = set()
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        """Create the indexes, start the worker and reconcile in the background"""
+        for field in LIST_FIELDS:
+            await self.db.projects.create_index(f"{field}.items.id")
+        self._tasks = [
+            asyncio.create_task(self._worker()),
+            asyncio.create_task(self._reconcile()),
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def schedule(self, collection: str, item_id: str):
+        """Queue a refresh of the copies of an item (no-op if one is already queued)"""
+        key = (collection, item_id)
+        if key not in self._pending:
+            self._pending.add(key)
+            self._queue.put_nowait(key)
+
+    async def _worker(self):
+        while True:
+            key = await self._queue.get()
+            # Edits arriving from now on need another pass
+            self._pending.discard(key)
+            try:
+                await self.refresh(*key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Snapshot refresh of {key[0]} {key[1]} failed: {e}")
+
+    async def _reconcile(self):
+        """Refresh every item once (the updates skip copies that are already fresh)"""
+        try:
+            updated = 0
+            for source, collection in SOURCE_COLLECTIONS.items():
+                async for item in self.db[collection].find({}, {"_id": 0, "id": 1, "name": 1, "category": 1, "images": 1}):
+                    updated += await self._fan_out(source, item)
+            if updated:
+                logger.info(f"Refreshed stale item snapshots in {updated} projects")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Snapshot reconciliation failed: {e}")
+
+    async def refresh(self, collection: str, item_id: str) -> int:
+        """Rewrite the copies of one item; returns the number of projects updated"""
+        source = next(source for source, name in SOURCE_COLLECTIONS.items() if name == collection)
+        item = await self.db[collection].find_one(
+            {"id": item_id}, {"_id": 0, "id": 1, "name": 1, "category": 1, "images": 1}
+        )
+        if item is None:
+            return 0
+        return await self._fan_out(source, item)
+
+    async def _fan_out(self, source: str, item: Dict[str, Any]) -> int:
+        snapshot = item_snapshot(item)
+        stale = {
+            "id": item["id"],
+            "source": source,
+            "$or": [{key: {"$ne": value}} for key, value in snapshot.items()],
+        }
+        query = {"$or": [{f"{field}.items": {"$elemMatch": stale}} for field in LIST_FIELDS]}
+        projection = {"_id": 0, "id": 1, **{f"{field}.items": 1 for field in LIST_FIELDS}}
+
+        updated = 0
+        async for project in self.db.projects.find(query, projection):
+            for _ in range(MAX_ATTEMPTS):
+                result = await self._update_project(project, source, item["id"], snapshot)
+                if result is not None:
+                    updated += result
+                    break
+                project = await self.db.projects.find_one({"id": project["id"]}, projection)
+                if project is None:
+                    break
+            else:
+                logger.warning(f"Project {project['id']} kept changing, snapshot of {item['id']} not refreshed")
+        return updated
+
+    async def _update_project(self, project: Dict[str, Any], source: str, item_id: str,
+                              snapshot: Dict[str, Any]) -> Optional[int]:
+        """
+        Update the stale copies in one project by index
+
+        Returns 1 if updated, 0 if nothing was stale, None if a list changed meanwhile.
+        """
+        query: Dict[str, Any] = {"id": project["id"]}
+        changes: Dict[str, Any] = {}
+        for field in LIST_FIELDS:
+            project_list = project.get(field)
+            items = project_list.get("items") if isinstance(project_list, dict) else None
+            if not isinstance(items, list):
+                continue
+            for index, line in enumerate(items):
+                if not isinstance(line, dict) or line.get("id") != item_id or line.get("source") != source:
+                    continue
+                query[f"{field}.items.{index}.id"] = item_id
+                for key, value in snapshot.items():
+                    if line.get(key) != value:
+                        changes[f"{field}.items.{index}.{key}"] = value
+        if not changes:
+            return 0
+
+        now = datetime.now(timezone.utc)
+        updated_project = await self.db.projects.find_one_and_update(
+            query,
+            {"$set": {**changes, "updated_at": now}, "$inc": {"version": 1}},
+            projection={"_id": 0, "version": 1, **{field: 1 for field in LIST_FIELDS}},
+            return_document=ReturnDocument.AFTER
+        )
+        if updated_project is None:
+            return None
+        if self.change_feed:
+            changed_fields = {path.split(".", 1)[0] for path in changes}
+            self.change_feed.publish(
+                "projects", "update", project["id"],
+                {**{field: updated_project.get(field) for field in changed_fields}, "updated_at": now},
+                updated_project["version"]
+            )
+        return 1
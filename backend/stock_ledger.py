@@ -0,0 +1,342 @@
+"""
+Stock ledger for inventory and equipment
+
+Every change of an item's stock is a movement appended to stock_movements
+(receive, reserve, issue to a project, return, damage, ...). Its effect on
+the counters of the item in stock_levels is applied with one atomic $inc:
+
+    on_hand    units owned
+    reserved   units promised to upcoming projects
+    out        units at projects
+    damaged    units waiting for repair
+    available  on_hand - reserved - out - damaged
+
+so availability is a single-document read, and a movement that would take a
+counter below zero (reserving more than is available, returning more than is
+out) is rejected by the update's filter instead of by a read-then-write race.
+
+Reserve, release and issue movements of a project also move the project's
+share of "reserved" (projects.<project id> in the level document), so an
+issue consumes the project's reservation and releasing it later only gives
+back what the project still holds.
+
+The counter update also pushes the movement into the level document's
+"recent" array, in the same atomic write. The movement is then inserted into
+stock_movements; if the process dies in between, compaction compares the
+movements with the level document's sequence number and restores the missing
+ones, the newest included, from "recent".
+
+Compaction (every STOCK_COMPACT_HOURS, default 24) folds movements older than
+STOCK_COMPACT_AFTER_DAYS (7) into snapshots in stock_snapshots: counters as of
+a sequence number. The movements stay for audit, unless
+STOCK_MOVEMENT_RETENTION_DAYS (default 0: forever) removes folded ones.
+The counters at any point in time are the snapshot before it plus the
+movements after that snapshot.
+
+Levels are created on first use from the item's total_quantity (the opening
+snapshot, seq 0). Editing total_quantity afterwards records an "adjust"
+movement; receive, write_off and scrap keep total_quantity equal to on_hand.
+Deleting an item drops its levels and snapshots; its movements stay for audit.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+from models import StockLevels, StockMovement, StockMovementKind
+from responses import model_projection
+
+logger = logging.getLogger(__name__)
+
+# Effect of one unit of each movement on the counters
+MOVEMENT_DELTAS: Dict[StockMovementKind, Dict[str, int]] = {
+    StockMovementKind.RECEIVE: {"on_hand": 1, "available": 1},
+    StockMovementKind.WRITE_OFF: {"on_hand": -1, "available": -1},
+    StockMovementKind.RESERVE: {"reserved": 1, "available": -1},
+    StockMovementKind.RELEASE: {"reserved": -1, "available": 1},
+    StockMovementKind.ISSUE: {"reserved": -1, "out": 1},
+    StockMovementKind.RETURN: {"out": -1, "available": 1},
+    StockMovementKind.DAMAGE: {"out": -1, "damaged": 1},
+    StockMovementKind.REPAIR: {"damaged": -1, "available": 1},
+    StockMovementKind.SCRAP: {"damaged": -1, "on_hand": -1},
+    StockMovementKind.ADJUST: {"on_hand": 1, "available": 1},
+}
+
+COUNTERS = ("on_hand", "reserved", "out", "damaged", "available")
+
+# Effect of one unit on the reserved share of the movement's project
+PROJECT_DELTAS: Dict[StockMovementKind, int] = {
+    StockMovementKind.RESERVE: 1,
+    StockMovementKind.RELEASE: -1,
+    StockMovementKind.ISSUE: -1,
+}
+
+# Movements kept in the level document to restore one whose insert was lost
+RECENT_MOVEMENTS = 50
+
+LEVEL_FIELDS = model_projection(StockLevels)
+
+
+class InsufficientStock(ValueError):
+    """The movement would take a counter below zero"""
+
+
+def _key(collection: str, item_id: str) -> Dict[str, str]:
+    return {"collection": collection, "item_id": item_id}
+
+
+class StockLedger:
+    """Movements, counters and snapshots of inventory and equipment stock"""
+
+    def __init__(self, db):
+        self.db = db
+        self.levels = db.stock_levels
+        self.movements = db.stock_movements
+        self.snapshots = db.stock_snapshots
+        self.compact_interval = float(os.environ.get('STOCK_COMPACT_HOURS', 24)) * 3600
+        self.compact_after = timedelta(days=float(os.environ.get('STOCK_COMPACT_AFTER_DAYS', 7)))
+        self.retention = timedelta(days=float(os.environ.get('STOCK_MOVEMENT_RETENTION_DAYS', 0)))
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Create indexes and start periodic compaction"""
+        await self.levels.create_index([("collection", 1), ("item_id", 1)], unique=True)
+        await self.movements.create_index([("collection", 1), ("item_id", 1), ("seq", 1)], unique=True)
+        await self.snapshots.create_index([("collection", 1), ("item_id", 1), ("seq", 1)], unique=True)
+        if self.compact_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._compact_periodically())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def get_levels(self, collection: str, item_id: str, opening: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        Current counters of an item, created from its total_quantity on first use
+
+        Returns None if the item does not exist.
+        """
+        key = _key(collection, item_id)
+        levels = await self.levels.find_one(key, LEVEL_FIELDS)
+        if levels is not None:
+            return levels
+
+        if opening is None:
+            item = await self.db[collection].find_one({"id": item_id}, {"_id": 0, "total_quantity": 1})
+            if item is None:
+                return None
+            opening = item.get("total_quantity") or 0
+        counters = StockLevels(**key, on_hand=opening, available=opening).model_dump()
+        await self.levels.update_one(key, {"$setOnInsert": {**counters, "recent": []}}, upsert=True)
+        # The opening balance compaction folds movements onto
+        await self.snapshots.update_one(
+            {**key, "seq": 0},
+            {"$setOnInsert": {
+                **key, "seq": 0, "levels": {name: counters[name] for name in COUNTERS},
+                "movements": 0, "at": datetime.now(timezone.utc)
+            }},
+            upsert=True
+        )
+        return await self.levels.find_one(key, LEVEL_FIELDS)
+
+    async def record(
+        self,
+        collection: str,
+        item_id: str,
+        kind: StockMovementKind,
+        quantity: int,
+        project_id: Optional[str] = None,
+        note: Optional[str] = None,
+        user_id: Optional[str] = None,
+        enforce: bool = True,
+        opening: Optional[int] = None,
+        on_hand: Optional[int] = None
+    ) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Append a movement and apply it to the counters
+
+        enforce=False lets counters go negative (reservations made by the project
+        lifecycle are recorded even when the item is overbooked).
+        on_hand makes the quantity the difference to the current on_hand,
+        taken again on every retry (quantity is then ignored).
+
+        Returns:
+            (movement, levels after the movement); movement is None when
+            on_hand is already equal
+
+        Raises:
+            LookupError: the item does not exist
+            InsufficientStock: enforce and a counter would drop below zero
+        """
+        if await self.get_levels(collection, item_id, opening) is None:
+            raise LookupError(f"{collection} item {item_id} not found")
+
+        key = _key(collection, item_id)
+        project_share = bool(project_id) and kind in PROJECT_DELTAS \
+            and "." not in project_id and not project_id.startswith("$")
+
+        while True:
+            current = await self.levels.find_one(key, LEVEL_FIELDS)
+            if current is None:
+                # Deleted meanwhile
+                raise LookupError(f"{collection} item {item_id} not found")
+            if on_hand is not None:
+                quantity = on_hand - current["on_hand"]
+                if not quantity:
+                    return None, current
+            deltas = {name: unit * quantity for name, unit in MOVEMENT_DELTAS[kind].items()}
+            guards = {name: {"$gte": -delta} for name, delta in deltas.items() if enforce and delta < 0}
+            increments = dict(deltas)
+            if project_share:
+                increments[f"projects.{project_id}"] = PROJECT_DELTAS[kind] * quantity
+            short = [name for name, delta in deltas.items() if name in guards and current.get(name, 0) < -delta]
+            if short:
+                raise InsufficientStock(
+                    f"Not enough stock for {kind.value} of {quantity}: "
+                    + ", ".join(f"{name} is {current.get(name, 0)}" for name in short)
+                )
+            movement = StockMovement(
+                **key, seq=current["seq"] + 1, kind=kind, quantity=quantity, deltas=deltas,
+                project_id=project_id, note=note, user_id=user_id
+            ).model_dump()
+            # Conditional on seq: counters and the movement in "recent" change in one write
+            levels = await self.levels.find_one_and_update(
+                {**key, "seq": current["seq"], **guards},
+                {
+                    "$inc": {**increments, "seq": 1},
+                    "$set": {"updated_at": movement["at"]},
+                    "$push": {"recent": {"$each": [movement], "$slice": -RECENT_MOVEMENTS}},
+                },
+                projection=LEVEL_FIELDS,
+                return_document=ReturnDocument.AFTER
+            )
+            if levels is not None:
+                break
+            # Another movement got in first: retry on the new counters
+
+        # Compaction may have restored it from "recent" already
+        await self.movements.update_one(
+            {**key, "seq": movement["seq"]}, {"$setOnInsert": dict(movement)}, upsert=True
+        )
+        return movement, levels
+
+    async def reserved_for(self, collection: str, item_id: str, project_id: str) -> int:
+        """Units of an item still reserved for a project (reserved minus released and issued)"""
+        levels = await self.levels.find_one(_key(collection, item_id), {"_id": 0, "projects": 1})
+        return max(((levels or {}).get("projects") or {}).get(project_id, 0), 0)
+
+    async def adjust(self, collection: str, item_id: str, old_total: int, new_total: int,
+                     user_id: Optional[str] = None):
+        """
+        Record a hand edit of total_quantity
+
+        The movement brings on_hand to new_total, computed on the counters it
+        is applied to (old_total only opens levels that do not exist yet), so
+        concurrent edits cannot make them drift apart.
+        """
+        levels = await self.get_levels(collection, item_id, opening=old_total)
+        if levels is not None:
+            await self.record(
+                collection, item_id, StockMovementKind.ADJUST, 0, on_hand=new_total,
+                user_id=user_id, enforce=False
+            )
+
+    async def forget(self, collection: str, item_id: str):
+        """Drop the counters and snapshots of a deleted item"""
+        key = _key(collection, item_id)
+        await self.levels.delete_one(key)
+        await self.snapshots.delete_many(key)
+
+    async def history(self, collection: str, item_id: str, limit: int = 100):
+        """Movements of an item, newest first"""
+        return await (
+            self.movements.find(_key(collection, item_id), model_projection(StockMovement))
+            .sort("seq", -1)
+            .limit(limit)
+            .to_list(limit)
+        )
+
+    # ---------- compaction ----------
+
+    async def _compact_periodically(self):
+        while True:
+            try:
+                await self.compact()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Stock ledger compaction failed: {e}")
+            await asyncio.sleep(self.compact_interval)
+
+    async def compact(self) -> int:
+        """Fold old movements into snapshots; returns the number of items compacted"""
+        now = datetime.now(timezone.utc)
+        compacted = 0
+        async for levels in self.levels.find({}, {"_id": 0, "collection": 1, "item_id": 1}):
+            compacted += await self._compact_item(levels["collection"], levels["item_id"], now)
+        if compacted:
+            logger.info(f"Compacted stock movements of {compacted} items")
+        return compacted
+
+    async def _compact_item(self, collection: str, item_id: str, now: datetime) -> int:
+        key = _key(collection, item_id)
+        latest = await self.snapshots.find(key, {"_id": 0}).sort("seq", -1).limit(1).to_list(1)
+        if not latest:
+            return 0
+        counters = dict(latest[0]["levels"])
+        seq = latest[0]["seq"]
+        await self._restore_missing(key, seq)
+        folded = 0
+
+        cursor = self.movements.find(
+            {**key, "seq": {"$gt": seq}, "at": {"$lt": now - self.compact_after}}, {"_id": 0}
+        ).sort("seq", 1)
+        async for movement in cursor:
+            if movement["seq"] != seq + 1:
+                logger.warning(f"Stock movements {seq + 1}..{movement['seq'] - 1} of {collection} {item_id} are missing")
+                break
+            for name, delta in movement["deltas"].items():
+                counters[name] = counters.get(name, 0) + delta
+            seq = movement["seq"]
+            folded += 1
+        if not folded:
+            return 0
+
+        await self.snapshots.update_one(
+            {**key, "seq": seq},
+            {"$setOnInsert": {**key, "seq": seq, "levels": counters, "movements": folded, "at": now}},
+            upsert=True
+        )
+        if self.retention:
+            await self.movements.delete_many({**key, "seq": {"$lte": seq}, "at": {"$lt": now - self.retention}})
+        return 1
+
+    async def _restore_missing(self, key: Dict[str, str], folded: int):
+        """
+        Insert the movements after seq folded that the counters include but
+        stock_movements lacks, from the level document's recent array
+        """
+        levels = await self.levels.find_one(key, {"_id": 0, "seq": 1, "recent": 1})
+        if levels is None:
+            return
+        stored = {
+            movement["seq"] async for movement in
+            self.movements.find({**key, "seq": {"$gt": folded}}, {"_id": 0, "seq": 1})
+        }
+        missing = [seq for seq in range(folded + 1, levels["seq"] + 1) if seq not in stored]
+        if not missing:
+            return
+        recent = {movement["seq"]: movement for movement in levels.get("recent", [])}
+        restored = [seq for seq in missing if seq in recent]
+        for seq in restored:
+            await self.movements.update_one(
+                {**key, "seq": seq}, {"$setOnInsert": recent[seq]}, upsert=True
+            )
+        if restored:
+            logger.warning(f"Restored stock movements {restored} of {key['collection']} {key['item_id']}")
@@ -0,0 +1,509 @@
+"""
+Storage Backends - Подключаемые драйверы хранилища фотографий
+
+Каждый драйвер реализует интерфейс StorageBackend и регистрируется в
+реестре STORAGE_BACKENDS под именем режима (storage_mode в конфиге):
+- local    - файлы на диске сервера (UPLOAD_DIR)
+- telegram - Telegram Bot (неограниченное облачное хранилище)
+- gridfs   - GridFS в той же базе MongoDB (реплика-сет без общего диска)
+- s3       - S3-совместимое хранилище (AWS S3, MinIO и т.п.)
+"""
+
+import asyncio
+import io
+import logging
+import mimetypes
+import os
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple, Type
+
+from telegram_storage import (
+    TelegramStorage, TelegramDeletionSweeper, MAX_MEDIA_GROUP, parse_telegram_ref
+)
+
+logger = logging.getLogger(__name__)
+
+# Размер блока при потоковой отдаче файлов
+STREAM_CHUNK_SIZE = 256 * 1024
+
+# Попытки записи локального файла, если его папку удалили между mkdir и open
+SAVE_ATTEMPTS = 3
+
+# Реестр драйверов: имя режима -> класс
+STORAGE_BACKENDS: Dict[str, Type['StorageBackend']] = {}
+
+
+def register_backend(name: str) -> Callable[[Type['StorageBackend']], Type['StorageBackend']]:
+    """Декоратор регистрации драйвера хранилища под именем режима"""
+    def decorator(cls: Type['StorageBackend']) -> Type['StorageBackend']:
+        cls.name = name
+        STORAGE_BACKENDS[name] = cls
+        return cls
+    return decorator
+
+
+def create_backend(name: str, config: dict) -> 'StorageBackend':
+    """
+    Создать драйвер по имени режима
+
+    Args:
+        name: Имя режима (storage_mode)
+        config: Полная конфигурация хранилища
+
+    Raises:
+        ValueError: Режим не зарегистрирован
+    """
+    try:
+        backend_cls = STORAGE_BACKENDS[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown storage mode: {name}. Available: {', '.join(sorted(STORAGE_BACKENDS))}"
+        )
+    return backend_cls(config)
+
+
+class StorageBackend(ABC):
+    """Интерфейс драйвера хранилища"""
+
+    name = ''
+
+    # Хранятся ли файлы вне сервера
+    is_remote = True
+
+    # Загружать ли через очередь: файл ждёт на локальном диске экземпляра,
+    # принявшего запрос, поэтому очередь годится только для хранилищ, запись
+    # в которые медленная или ограничена лимитами (Telegram)
+    use_upload_queue = True
+
+    def __init__(self, config: dict):
+        self.config = config
+
+    def bind_database(self, db):
+        """Передать базу данных Motor драйверам, которым она нужна"""
+
+    @abstractmethod
+    def owns(self, image_url: str) -> bool:
+        """Принадлежит ли ссылка этому драйверу"""
+
+    @abstractmethod
+    async def save(self, file_content: bytes, filename: str, item_id: str) -> str:
+        """
+        Сохранить подготовленное (уже оптимизированное) изображение
+
+        Returns:
+            Ссылка на изображение, которая сохраняется в БД
+        """
+
+    async def save_batch(self, files: List[Tuple[bytes, str, str]]) -> List[str]:
+        """
+        Сохранить несколько изображений
+
+        Args:
+            files: Список (содержимое файла, имя файла, ID элемента)
+
+        Returns:
+            Ссылки в порядке переданных файлов
+        """
+        return [await self.save(*file) for file in files]
+
+    @abstractmethod
+    async def delete(self, image_url: str) -> bool:
+        """Удалить изображение по ссылке"""
+
+    async def delete_many(self, image_urls: List[str]) -> int:
+        """Удалить несколько изображений, вернуть количество удалённых"""
+        deleted = 0
+        for image_url in image_urls:
+            if await self.delete(image_url):
+                deleted += 1
+        return deleted
+
+    async def open_stream(self, image_url: str) -> Optional[Tuple[AsyncIterator[bytes], str, Optional[int]]]:
+        """
+        Открыть изображение для потоковой отдачи через API
+
+        Returns:
+            (итератор блоков, content-type, размер) или None, если файла нет
+        """
+        return None
+
+    async def list_item_images(self, item_id: str) -> List[str]:
+        """Получить ссылки на изображения элемента (если драйвер это умеет)"""
+        return []
+
+
+@register_backend('local')
+class LocalBackend(StorageBackend):
+    """Файлы на диске: /api/uploads/{item_id}/{filename}"""
+
+    is_remote = False
+
+    def __init__(self, config: dict):
+        super().__init__(config)
+        self.upload_dir = Path(config['local_storage']['upload_dir'])
+        self.upload_dir.mkdir(exist_ok=True, parents=True)
+
+    def path_for(self, image_url: str) -> Optional[Path]:
+        """Получить путь к файлу по URL или None, если URL не локальный"""
+        parts = image_url.split('/')
+        if len(parts) == 5 and parts[1] == 'api' and parts[2] == 'uploads':
+            return self.upload_dir / parts[3] / parts[4]
+        return None
+
+    def owns(self, image_url: str) -> bool:
+        return self.path_for(image_url) is not None
+
+    async def save(self, file_content: bytes, filename: str, item_id: str) -> str:
+        item_dir = self.upload_dir / item_id
+
+        # Генерировать уникальное имя файла
+        ext = Path(filename).suffix.lower()
+        unique_filename = f"{uuid.uuid4()}{ext}"
+        file_path = item_dir / unique_filename
+
+        # Создать папку для элемента и сохранить файл. Сборщик мусора может
+        # удалить пустую папку между mkdir и open: тогда создать её снова
+        for attempt in range(SAVE_ATTEMPTS):
+            item_dir.mkdir(exist_ok=True, parents=True)
+            try:
+                with open(file_path, 'wb') as f:
+                    f.write(file_content)
+                break
+            except FileNotFoundError:
+                if attempt == SAVE_ATTEMPTS - 1:
+                    raise
+
+        # Вернуть относительный путь
+        return f"/api/uploads/{item_id}/{unique_filename}"
+
+    async def delete(self, image_url: str) -> bool:
+        try:
+            file_path = self.path_for(image_url)
+            if file_path and file_path.exists():
+                file_path.unlink()
+                return True
+            return False
+        except Exception as e:
+            logger.error(f"Error deleting file: {e}")
+            return False
+
+    async def list_item_images(self, item_id: str) -> List[str]:
+        item_dir = self.upload_dir / item_id
+        if not item_dir.exists():
+            return []
+
+        images = []
+        for file_path in item_dir.iterdir():
+            if file_path.is_file():
+                images.append(f"/api/uploads/{item_id}/{file_path.name}")
+
+        return sorted(images)
+
+
+@register_backend('telegram')
+class TelegramBackend(StorageBackend):
+    """Telegram Bot: telegram:{file_id}:{message_id}"""
+
+    def __init__(self, config: dict):
+        super().__init__(config)
+        telegram_config = config.get('telegram_storage', {})
+        bot_token = os.environ.get('TELEGRAM_BOT_TOKEN', telegram_config.get('bot_token', ''))
+        chat_id = os.environ.get('TELEGRAM_CHAT_ID', telegram_config.get('chat_id', ''))
+
+        if not (bot_token and chat_id):
+            raise ValueError(
+                "Telegram storage enabled but credentials not provided. "
+                "Set TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID environment variables."
+            )
+
+        self.telegram = TelegramStorage(bot_token, chat_id)
+        self.deletion_sweeper: Optional[TelegramDeletionSweeper] = None
+
+    def bind_database(self, db):
+        telegram_config = self.config.get('telegram_storage', {})
+        self.deletion_sweeper = TelegramDeletionSweeper(
+            self.telegram, db.telegram_deletions,
+            telegram_config.get('deletion_interval_seconds', 2),
+            telegram_config.get('deletion_poll_seconds', 10)
+        )
+
+    def owns(self, image_url: str) -> bool:
+        return image_url.startswith('telegram:')
+
+    async def save(self, file_content: bytes, filename: str, item_id: str) -> str:
+        # Загрузить в Telegram с подписью
+        caption = f"Item: {item_id} | File: {filename}"
+        file_id, message_id = await self.telegram.send_photo(file_content, caption)
+
+        # Формат: telegram:{file_id}:{message_id} - message_id нужен для удаления
+        return f"telegram:{file_id}:{message_id}"
+
+    async def save_batch(self, files: List[Tuple[bytes, str, str]]) -> List[str]:
+        # Группировать по MAX_MEDIA_GROUP фото в один вызов sendMediaGroup
+        urls = []
+        for start in range(0, len(files), MAX_MEDIA_GROUP):
+            chunk = files[start:start + MAX_MEDIA_GROUP]
+            uploaded = await self.telegram.send_media_group([
+                (content, f"Item: {item_id} | File: {filename}")
+                for content, filename, item_id in chunk
+            ])
+            urls.extend(f"telegram:{file_id}:{message_id}" for file_id, message_id in uploaded)
+        return urls
+
+    async def delete(self, image_url: str) -> bool:
+        return await self.delete_many([image_url]) == 1
+
+    async def delete_many(self, image_urls: List[str]) -> int:
+        """
+        Удалить сообщения с фото
+
+        Note:
+            Telegram API не позволяет удалить файл без message_id.
+            Фото в старом формате ("telegram:{file_id}") остаются в чате.
+        """
+        refs = []
+        for image_url in image_urls:
+            file_id, message_id = parse_telegram_ref(image_url)
+            if not file_id:
+                continue
+            if message_id is None:
+                logger.warning(f"Telegram file {file_id} has no message_id, it remains in chat")
+                continue
+            refs.append((file_id, message_id))
+
+        if not refs:
+            return 0
+
+        try:
+            if self.deletion_sweeper:
+                # Sweeper удалит сообщения пачками через deleteMessages
+                await self.deletion_sweeper.enqueue([message_id for _, message_id in refs])
+                return len(refs)
+
+            deleted = 0
+            for file_id, message_id in refs:
+                if await self.telegram.delete_photo(file_id, message_id):
+                    deleted += 1
+            return deleted
+        except Exception as e:
+            logger.error(f"Error deleting Telegram files: {e}")
+            return 0
+
+
+@register_backend('gridfs')
+class GridFSBackend(StorageBackend):
+    """GridFS в базе MongoDB: /api/files/gridfs/{file_id}"""
+
+    URL_PREFIX = '/api/files/gridfs/'
+
+    # Запись в общую базу: файл сразу виден всем экземплярам API
+    use_upload_queue = False
+
+    def __init__(self, config: dict):
+        super().__init__(config)
+        gridfs_config = config.get('gridfs_storage', {})
+        self.bucket_name = gridfs_config.get('bucket_name', 'images')
+        self.chunk_size = gridfs_config.get('chunk_size_bytes', 255 * 1024)
+        self.bucket = None
+
+    def bind_database(self, db):
+        from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+        self.bucket = AsyncIOMotorGridFSBucket(
+            db, bucket_name=self.bucket_name, chunk_size_bytes=self.chunk_size
+        )
+
+    def _require_bucket(self):
+        if self.bucket is None:
+            raise ValueError("GridFS storage not bound to a database")
+        return self.bucket
+
+    def _file_id(self, image_url: str):
+        from bson import ObjectId
+        from bson.errors import InvalidId
+
+        if not self.owns(image_url):
+            return None
+        try:
+            return ObjectId(image_url[len(self.URL_PREFIX):])
+        except InvalidId:
+            return None
+
+    def owns(self, image_url: str) -> bool:
+        return image_url.startswith(self.URL_PREFIX)
+
+    async def save(self, file_content: bytes, filename: str, item_id: str) -> str:
+        bucket = self._require_bucket()
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+        # GridIn читает файловый объект блоками размера chunk_size
+        # (BytesIO поверх bytes не копирует содержимое; memoryview GridIn не принимает)
+        grid_in = bucket.open_upload_stream(
+            filename,
+            metadata={"item_id": item_id, "content_type": content_type}
+        )
+        await grid_in.write(io.BytesIO(file_content))
+        await grid_in.close()
+
+        return f"{self.URL_PREFIX}{grid_in._id}"
+
+    async def delete(self, image_url: str) -> bool:
+        from gridfs.errors import NoFile
+
+        file_id = self._file_id(image_url)
+        if file_id is None:
+            return False
+        try:
+            await self._require_bucket().delete(file_id)
+            return True
+        except NoFile:
+            return False
+
+    async def open_stream(self, image_url: str):
+        from gridfs.errors import NoFile
+
+        file_id = self._file_id(image_url)
+        if file_id is None:
+            return None
+        try:
+            grid_out = await self._require_bucket().open_download_stream(file_id)
+        except NoFile:
+            return None
+
+        async def chunks():
+            while True:
+                chunk = await grid_out.readchunk()
+                if not chunk:
+                    break
+                yield chunk
+
+        metadata = grid_out.metadata or {}
+        return chunks(), metadata.get('content_type', 'application/octet-stream'), grid_out.length
+
+    async def list_item_images(self, item_id: str) -> List[str]:
+        cursor = self._require_bucket().find({"metadata.item_id": item_id})
+        return [f"{self.URL_PREFIX}{grid_out._id}" async for grid_out in cursor]
+
+
+@register_backend('s3')
+class S3Backend(StorageBackend):
+    """
+    S3-совместимое хранилище: /api/files/s3/{key}
+
+    Требует пакет boto3. Большие файлы загружаются multipart-частями
+    (multipart_threshold_mb / multipart_chunksize_mb), отдача идёт потоком.
+    Вызовы boto3 блокирующие, поэтому выполняются в пуле потоков.
+    """
+
+    URL_PREFIX = '/api/files/s3/'
+
+    # Запись в общий бакет: файл сразу виден всем экземплярам API
+    use_upload_queue = False
+
+    def __init__(self, config: dict):
+        super().__init__(config)
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+        except ImportError:
+            raise ValueError("S3 storage requires the boto3 package: pip install boto3")
+
+        s3_config = config.get('s3_storage', {})
+        self.bucket = os.environ.get('S3_BUCKET', s3_config.get('bucket', ''))
+        if not self.bucket:
+            raise ValueError("S3 storage enabled but bucket not provided. Set S3_BUCKET environment variable.")
+
+        self.prefix = s3_config.get('prefix', 'images/')
+        self.client = boto3.client(
+            's3',
+            endpoint_url=os.environ.get('S3_ENDPOINT_URL', s3_config.get('endpoint_url')) or None,
+            region_name=os.environ.get('S3_REGION', s3_config.get('region')) or None,
+        )
+        mb = 1024 * 1024
+        self.transfer_config = TransferConfig(
+            multipart_threshold=s3_config.get('multipart_threshold_mb', 8) * mb,
+            multipart_chunksize=s3_config.get('multipart_chunksize_mb', 8) * mb,
+        )
+
+    def _key(self, image_url: str) -> Optional[str]:
+        if not self.owns(image_url):
+            return None
+        key = image_url[len(self.URL_PREFIX):]
+        # Не выпускать запросы за пределы префикса
+        if not key.startswith(self.prefix) or '..' in key.split('/'):
+            return None
+        return key
+
+    def owns(self, image_url: str) -> bool:
+        return image_url.startswith(self.URL_PREFIX)
+
+    async def save(self, file_content: bytes, filename: str, item_id: str) -> str:
+        ext = Path(filename).suffix.lower()
+        key = f"{self.prefix}{item_id}/{uuid.uuid4()}{ext}"
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+        await asyncio.to_thread(
+            self.client.upload_fileobj,
+            io.BytesIO(file_content),
+            self.bucket,
+            key,
+            ExtraArgs={"ContentType": content_type, "Metadata": {"item_id": item_id}},
+            Config=self.transfer_config,
+        )
+        return f"{self.URL_PREFIX}{key}"
+
+    async def delete(self, image_url: str) -> bool:
+        return await self.delete_many([image_url]) == 1
+
+    async def delete_many(self, image_urls: List[str]) -> int:
+        keys = [key for key in (self._key(url) for url in image_urls) if key]
+        deleted = 0
+        # DeleteObjects принимает до 1000 ключей за запрос
+        for start in range(0, len(keys), 1000):
+            chunk = keys[start:start + 1000]
+            try:
+                response = await asyncio.to_thread(
+                    self.client.delete_objects,
+                    Bucket=self.bucket,
+                    Delete={"Objects": [{"Key": key} for key in chunk], "Quiet": False},
+                )
+                deleted += len(response.get('Deleted', []))
+            except Exception as e:
+                logger.error(f"Error deleting S3 objects: {e}")
+        return deleted
+
+    async def open_stream(self, image_url: str):
+        key = self._key(image_url)
+        if key is None:
+            return None
+        try:
+            response = await asyncio.to_thread(self.client.get_object, Bucket=self.bucket, Key=key)
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+        body = response['Body']
+
+        async def chunks():
+            try:
+                while True:
+                    chunk = await asyncio.to_thread(body.read, STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                body.close()
+
+        return chunks(), response.get('ContentType', 'application/octet-stream'), response.get('ContentLength')
+
+    async def list_item_images(self, item_id: str) -> List[str]:
+        paginator = self.client.get_paginator('list_objects_v2')
+
+        def list_keys():
+            keys = []
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{self.prefix}{item_id}/"):
+                keys.extend(obj['Key'] for obj in page.get('Contents', []))
+            return keys
+
+        return [f"{self.URL_PREFIX}{key}" for key in sorted(await asyncio.to_thread(list_keys))]
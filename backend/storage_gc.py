@@ -0,0 +1,217 @@
+"""
+Storage GC - Сборка осиротевших файлов в локальном хранилище
+
+Файлы в UPLOAD_DIR/{item_id}/ становятся "сиротами", если элемент удалён,
+ссылку убрали из images, или запись в БД не удалась после save_image.
+Задача сверки:
+1. Потоком читает массивы images из MongoDB (и ожидающие задания очереди)
+2. Обходит дерево загрузок через os.scandir
+3. Пачками перепроверяет кандидатов в БД и удаляет их или переносит в карантин
+4. Возвращает отчёт с количеством освобождённых байт
+
+Безопасна при одновременных загрузках: файлы моложе grace-периода не
+трогаются, а каждая пачка перепроверяется в БД непосредственно перед удалением.
+Пустую папку элемента загрузка может получить уже удалённой (mkdir старой
+папки не меняет её mtime) - LocalBackend.save тогда создаёт её заново.
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from upload_queue import IMAGE_COLLECTIONS
+
+logger = logging.getLogger(__name__)
+
+
+class StorageReconciler:
+    """Сверка локального дерева загрузок с базой данных"""
+
+    def __init__(self, db, storage):
+        """
+        Args:
+            db: База данных Motor
+            storage: Экземпляр StorageService
+        """
+        self.db = db
+        self.storage = storage
+        self.upload_dir = Path(storage.upload_dir)
+
+        gc_config = storage.config.get('storage_gc', {})
+        self.grace_seconds = gc_config.get('grace_period_minutes', 60) * 60
+        self.batch_size = gc_config.get('batch_size', 500)
+        quarantine_dir = gc_config.get('quarantine_dir')
+        self.quarantine_dir = Path(quarantine_dir) if quarantine_dir else self.upload_dir.parent / 'uploads_quarantine'
+
+        # Одновременно выполняется только одна сверка
+        self._lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def run(self, action: str = 'report', max_batches: Optional[int] = None) -> Dict:
+        """
+        Выполнить сверку
+
+        Args:
+            action: report - только отчёт, delete - удалить, quarantine - перенести в карантин
+            max_batches: Ограничить количество обработанных пачек (None - без ограничения)
+
+        Returns:
+            Отчёт: просмотрено файлов, найдено сирот, обработано, освобождено байт
+        """
+        if action not in ('report', 'delete', 'quarantine'):
+            raise ValueError(f"Unknown reconcile action: {action}")
+
+        async with self._lock:
+            started = time.monotonic()
+            referenced = await self._referenced_paths()
+            report = {
+                "action": action,
+                "scanned_files": 0,
+                "orphaned_files": 0,
+                "processed_files": 0,
+                "reclaimed_bytes": 0,
+                "removed_directories": 0,
+                "batches": 0,
+                "errors": [],
+            }
+
+            batch: List[os.DirEntry] = []
+            for item_dir in await asyncio.to_thread(self._scan_dirs):
+                for entry in await asyncio.to_thread(self._scan_files, item_dir):
+                    report["scanned_files"] += 1
+                    if self._relative(entry) in referenced or not self._is_settled(entry):
+                        continue
+                    batch.append(entry)
+                    if len(batch) >= self.batch_size:
+                        await self._process_batch(batch, action, report)
+                        batch = []
+                        if max_batches is not None and report["batches"] >= max_batches:
+                            break
+                if max_batches is not None and report["batches"] >= max_batches:
+                    break
+            else:
+                if batch:
+                    await self._process_batch(batch, action, report)
+
+            if action != 'report':
+                report["removed_directories"] = await asyncio.to_thread(self._remove_empty_dirs)
+
+            report["duration_seconds"] = round(time.monotonic() - started, 3)
+            logger.info(
+                f"Storage reconcile ({action}): {report['orphaned_files']} orphans, "
+                f"{report['reclaimed_bytes']} bytes reclaimed"
+            )
+            return report
+
+    async def _referenced_paths(self) -> Set[str]:
+        """Потоком прочитать все ссылки на локальные файлы из БД"""
+        referenced = set()
+        for collection in IMAGE_COLLECTIONS:
+            cursor = self.db[collection].find({"images.0": {"$exists": True}}, {"_id": 0, "images": 1})
+            async for doc in cursor:
+                for image_url in doc.get("images", []):
+                    if self.storage.local_path(image_url):
+                        referenced.add(image_url)
+
+        # Файлы, ожидающие загрузки во внешнее хранилище
+        cursor = self.db.upload_jobs.find({"status": {"$in": ["pending", "processing"]}}, {"_id": 0, "image_url": 1})
+        async for job in cursor:
+            referenced.add(job["image_url"])
+        return referenced
+
+    def _scan_dirs(self) -> List[os.DirEntry]:
+        """Папки элементов в UPLOAD_DIR"""
+        if not self.upload_dir.exists():
+            return []
+        with os.scandir(self.upload_dir) as entries:
+            return [entry for entry in entries if entry.is_dir(follow_symlinks=False)]
+
+    def _scan_files(self, item_dir: os.DirEntry) -> List[os.DirEntry]:
+        """Файлы в папке элемента"""
+        try:
+            with os.scandir(item_dir.path) as entries:
+                return [entry for entry in entries if entry.is_file(follow_symlinks=False)]
+        except FileNotFoundError:
+            return []
+
+    def _relative(self, entry: os.DirEntry) -> str:
+        """Локальный URL файла: /api/uploads/{item_id}/{filename}"""
+        return f"/api/uploads/{Path(entry.path).parent.name}/{entry.name}"
+
+    def _is_settled(self, entry: os.DirEntry) -> bool:
+        """Файл или папка старше grace-периода (не может быть загрузкой в процессе)"""
+        try:
+            return time.time() - entry.stat(follow_symlinks=False).st_mtime >= self.grace_seconds
+        except FileNotFoundError:
+            return False
+
+    async def _still_referenced(self, urls: List[str]) -> Set[str]:
+        """Перепроверить пачку в БД непосредственно перед удалением"""
+        found = set()
+        candidates = set(urls)
+        for collection in IMAGE_COLLECTIONS:
+            cursor = self.db[collection].find({"images": {"$in": urls}}, {"_id": 0, "images": 1})
+            async for doc in cursor:
+                found.update(url for url in doc.get("images", []) if url in candidates)
+        cursor = self.db.upload_jobs.find(
+            {"image_url": {"$in": urls}, "status": {"$in": ["pending", "processing"]}},
+            {"_id": 0, "image_url": 1}
+        )
+        async for job in cursor:
+            found.add(job["image_url"])
+        return found
+
+    async def _process_batch(self, batch: List[os.DirEntry], action: str, report: Dict):
+        """Обработать пачку кандидатов"""
+        report["batches"] += 1
+        urls = [self._relative(entry) for entry in batch]
+        referenced = await self._still_referenced(urls) if action != 'report' else set()
+
+        for entry, url in zip(batch, urls):
+            if url in referenced:
+                continue
+            report["orphaned_files"] += 1
+            try:
+                size = entry.stat(follow_symlinks=False).st_size
+                if action == 'delete':
+                    await asyncio.to_thread(os.unlink, entry.path)
+                elif action == 'quarantine':
+                    await asyncio.to_thread(self._quarantine, entry)
+                else:
+                    report["reclaimed_bytes"] += size
+                    continue
+                report["processed_files"] += 1
+                report["reclaimed_bytes"] += size
+            except FileNotFoundError:
+                # Файл уже удалён параллельным запросом
+                continue
+            except OSError as e:
+                report["errors"].append(f"{url}: {e}")
+
+    def _quarantine(self, entry: os.DirEntry):
+        """Перенести файл в карантин, сохранив структуру папок"""
+        target = self.quarantine_dir / Path(entry.path).parent.name / entry.name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(entry.path, target)
+
+    def _remove_empty_dirs(self) -> int:
+        """Удалить пустые папки элементов"""
+        removed = 0
+        for item_dir in self._scan_dirs():
+            # Свежая папка может принадлежать загрузке, которая ещё не записала файл
+            if not self._is_settled(item_dir):
+                continue
+            try:
+                os.rmdir(item_dir.path)
+                removed += 1
+            except OSError:
+                # Не пустая или уже удалена
+                continue
+        return removed
@@ -1,21 +1,19 @@
 """
 Storage Service - Абстрактный слой для работы с хранилищем фотографий
-Поддерживает:
+Драйверы хранилища подключаются через реестр (см. storage_backends.py):
 - Локальное хранилище
 - Telegram Bot (неограниченное облачное хранилище)
-- Google Sheets (будущая интеграция)
+- GridFS (в той же базе MongoDB)
+- S3-совместимое хранилище (AWS S3, MinIO)
 """
 
-import os
 import json
-import shutil
 from pathlib import Path
-from typing import List, Optional, Dict
-from datetime import datetime
-import uuid
+from typing import List, Optional, Dict, Tuple, AsyncIterator
 from PIL import Image
 import io
-from telegram_storage import TelegramStorage
+from storage_backends import StorageBackend, LocalBackend, TelegramBackend, create_backend
+from metrics import IMAGE_PIPELINE_DURATION, observe
 
 # Загрузка конфигурации
 CONFIG_PATH = Path(__file__).parent / 'google_sheets_config.json'
@@ -34,21 +32,57 @@ class StorageService:
         self.mode = STORAGE_MODE
         self.upload_dir = UPLOAD_DIR
         self.config = CONFIG
-        self.telegram_storage = None
         
-        # Инициализировать Telegram хранилище если включено
-        if self.mode == 'telegram':
-            telegram_config = CONFIG.get('telegram_storage', {})
-            bot_token = os.environ.get('TELEGRAM_BOT_TOKEN', telegram_config.get('bot_token', ''))
-            chat_id = os.environ.get('TELEGRAM_CHAT_ID', telegram_config.get('chat_id', ''))
-            
-            if bot_token and chat_id:
-                self.telegram_storage = TelegramStorage(bot_token, chat_id)
-            else:
-                raise ValueError(
-                    "Telegram storage enabled but credentials not provided. "
-                    "Set TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID environment variables."
-                )
+        # Локальный драйвер нужен всегда: очередь загрузок хранит в нём
+        # ожидающие файлы, а в БД могут оставаться старые локальные ссылки
+        self.local = LocalBackend(CONFIG)
+        self.backend: StorageBackend = self.local if self.mode == 'local' else create_backend(self.mode, CONFIG)
+    
+    def bind_database(self, db):
+        """Передать базу данных драйверам (GridFS, очередь удаления Telegram)"""
+        self.backend.bind_database(db)
+    
+    @property
+    def is_remote(self) -> bool:
+        """Хранятся ли фотографии во внешнем сервисе"""
+        return self.backend.is_remote
+    
+    @property
+    def use_upload_queue(self) -> bool:
+        """Загружать ли во внешнее хранилище через фоновую очередь (см. StorageBackend.use_upload_queue)"""
+        return self.backend.is_remote and self.backend.use_upload_queue
+    
+    @property
+    def telegram_storage(self):
+        """Клиент Telegram, если используется режим telegram"""
+        return self.backend.telegram if isinstance(self.backend, TelegramBackend) else None
+    
+    @property
+    def deletion_sweeper(self):
+        """Пакетный удалятель сообщений Telegram (после bind_database)"""
+        return getattr(self.backend, 'deletion_sweeper', None)
+    
+    def _backend_for(self, image_url: str) -> Optional[StorageBackend]:
+        """Найти драйвер, которому принадлежит ссылка"""
+        for backend in (self.local, self.backend):
+            if backend.owns(image_url):
+                return backend
+        return None
+    
+    def _prepare(self, file_content: bytes) -> bytes:
+        """Оптимизировать изображение, если это включено для текущего режима"""
+        if self.mode == 'local':
+            enabled = self.config['local_storage']['image_optimization']['enabled']
+        elif self.mode == 'telegram':
+            enabled = self.config.get('telegram_storage', {}).get('optimize_images', True)
+        else:
+            enabled = self.config.get(f'{self.mode}_storage', {}).get(
+                'optimize_images', self.config['local_storage']['image_optimization']['enabled']
+            )
+        if not enabled:
+            return file_content
+        with observe(IMAGE_PIPELINE_DURATION, stage="optimize"):
+            return self._optimize_image(file_content)
         
     async def save_image(self, file_content: bytes, filename: str, item_id: str) -> str:
         """
@@ -62,40 +96,33 @@ class StorageService:
         Returns:
             URL или путь к сохраненному изображению
         """
-        if self.mode == 'local':
-            return await self._save_local(file_content, filename, item_id)
-        elif self.mode == 'telegram':
-            return await self._save_telegram(file_content, filename, item_id)
-        elif self.mode == 'google_sheets':
-            return await self._save_google_drive(file_content, filename, item_id)
-        else:
-            raise ValueError(f"Unknown storage mode: {self.mode}")
+        file_content = self._prepare(file_content)
+        with observe(IMAGE_PIPELINE_DURATION, stage=f"store_{self.backend.name}"):
+            return await self.backend.save(file_content, filename, item_id)
     
-    async def _save_local(self, file_content: bytes, filename: str, item_id: str) -> str:
-        """Сохранить файл локально"""
-        # Создать папку для элемента
-        item_dir = self.upload_dir / item_id
-        item_dir.mkdir(exist_ok=True, parents=True)
-        
-        # Генерировать уникальное имя файла
-        ext = Path(filename).suffix.lower()
-        unique_filename = f"{uuid.uuid4()}{ext}"
-        file_path = item_dir / unique_filename
-        
-        # Оптимизировать изображение если включено
-        if self.config['local_storage']['image_optimization']['enabled']:
-            file_content = self._optimize_image(file_content)
+    async def save_images(self, files: List[Tuple[bytes, str, str]]) -> List[str]:
+        """
+        Сохранить несколько изображений
         
-        # Сохранить файл
-        with open(file_path, 'wb') as f:
-            f.write(file_content)
+        Драйвер может загрузить их одним запросом (Telegram группирует
+        до 10 фото в один вызов sendMediaGroup).
         
-        # Вернуть относительный путь
-        return f"/api/uploads/{item_id}/{unique_filename}"
+        Args:
+            files: Список (содержимое файла, имя файла, ID элемента)
+            
+        Returns:
+            URL изображений в порядке переданных файлов
+        """
+        prepared = [(self._prepare(content), filename, item_id) for content, filename, item_id in files]
+        with observe(IMAGE_PIPELINE_DURATION, stage=f"store_{self.backend.name}"):
+            return await self.backend.save_batch(prepared)
     
-    async def _save_telegram(self, file_content: bytes, filename: str, item_id: str) -> str:
+    async def stage_image(self, file_content: bytes, filename: str, item_id: str) -> str:
         """
-        Сохранить файл в Telegram
+        Сохранить оптимизированное изображение локально до отправки во внешнее хранилище
+        
+        Используется очередью загрузок: запрос сразу получает локальный
+        (ожидающий) URL, а фоновый воркер позже заменяет его на удалённый.
         
         Args:
             file_content: Содержимое файла
@@ -103,40 +130,53 @@ class StorageService:
             item_id: ID элемента инвентаря
             
         Returns:
-            JSON строка с данными: {"file_id": "...", "item_id": "...", "filename": "..."}
+            Локальный URL вида /api/uploads/{item_id}/{filename}
         """
-        if not self.telegram_storage:
-            raise ValueError("Telegram storage not initialized")
-        
-        # Оптимизировать изображение
-        if self.config.get('telegram_storage', {}).get('optimize_images', True):
-            file_content = self._optimize_image(file_content)
+        file_content = self._prepare(file_content)
+        with observe(IMAGE_PIPELINE_DURATION, stage="stage_local"):
+            return await self.local.save(file_content, filename, item_id)
+    
+    async def upload_remote(self, file_content: bytes, filename: str, item_id: str) -> str:
+        """
+        Загрузить уже оптимизированное изображение во внешнее хранилище
         
-        # Загрузить в Telegram с подписью
-        caption = f"Item: {item_id} | File: {filename}"
-        file_id = await self.telegram_storage.upload_photo(file_content, caption)
+        Ошибки не перехватываются, чтобы очередь загрузок могла решить,
+        повторять ли попытку.
         
-        if not file_id:
-            raise Exception("Failed to upload photo to Telegram")
+        Returns:
+            Ссылка на изображение во внешнем хранилище
+        """
+        if not self.is_remote:
+            raise ValueError(f"Storage mode '{self.mode}' has no remote backend")
+        with observe(IMAGE_PIPELINE_DURATION, stage=f"store_{self.backend.name}"):
+            return await self.backend.save(file_content, filename, item_id)
+    
+    async def upload_remote_batch(self, files: List[Tuple[bytes, str, str]]) -> List[str]:
+        """
+        Загрузить несколько подготовленных изображений во внешнее хранилище
         
-        # Вернуть данные в формате JSON (сохраним в БД)
-        # Формат: telegram:{file_id}
-        return f"telegram:{file_id}"
+        Args:
+            files: Список (содержимое файла, имя файла, ID элемента)
+            
+        Returns:
+            Ссылки на изображения в порядке переданных файлов
+        """
+        if not self.is_remote:
+            raise ValueError(f"Storage mode '{self.mode}' has no remote backend")
+        with observe(IMAGE_PIPELINE_DURATION, stage=f"store_{self.backend.name}"):
+            return await self.backend.save_batch(files)
     
-    async def _save_google_drive(self, file_content: bytes, filename: str, item_id: str) -> str:
+    def local_path(self, image_url: str) -> Optional[Path]:
         """
-        Сохранить файл в Google Drive (будущая реализация)
+        Получить путь к локальному файлу по URL
         
-        TODO: Реализовать после настройки Google Drive API
-        - Аутентификация через service account
-        - Загрузка файла в указанную папку
-        - Получение публичной ссылки
-        - Сохранение ссылки в Google Sheets
+        Args:
+            image_url: URL вида /api/uploads/{item_id}/{filename}
+            
+        Returns:
+            Путь к файлу или None, если URL не локальный
         """
-        raise NotImplementedError(
-            "Google Drive integration not implemented yet. "
-            "See GOOGLE_SHEETS_INTEGRATION.md for setup instructions."
-        )
+        return self.local.path_for(image_url)
     
     def _optimize_image(self, file_content: bytes) -> bytes:
         """Оптимизировать изображение (сжатие и изменение размера)"""
@@ -186,71 +226,47 @@ class StorageService:
         Returns:
             True если удаление успешно
         """
-        if self.mode == 'local':
-            return await self._delete_local(image_url)
-        elif self.mode == 'telegram':
-            return await self._delete_telegram(image_url)
-        elif self.mode == 'google_sheets':
-            return await self._delete_google_drive(image_url)
-        else:
+        # Локальные файлы (в т.ч. ожидающие загрузки в очереди) удаляются в любом режиме
+        backend = self._backend_for(image_url)
+        if not backend:
             return False
+        return await backend.delete(image_url)
     
-    async def _delete_local(self, image_url: str) -> bool:
-        """Удалить локальный файл"""
-        try:
-            # Извлечь путь из URL
-            # /api/uploads/{item_id}/{filename}
-            parts = image_url.split('/')
-            if len(parts) >= 4 and parts[1] == 'api' and parts[2] == 'uploads':
-                item_id = parts[3]
-                filename = parts[4]
-                file_path = self.upload_dir / item_id / filename
-                
-                if file_path.exists():
-                    file_path.unlink()
-                    return True
-            return False
-        except Exception as e:
-            print(f"Error deleting file: {e}")
-            return False
-    
-    async def _delete_telegram(self, image_url: str) -> bool:
+    async def delete_images(self, image_urls: List[str]) -> int:
         """
-        Удалить файл из Telegram
+        Удалить несколько изображений
+        
+        Ссылки группируются по драйверам, чтобы каждый удалил свою часть
+        пачкой (Telegram - через deleteMessages, S3 - через DeleteObjects).
         
         Args:
-            image_url: Строка вида "telegram:{file_id}"
+            image_urls: Список URL изображений
             
         Returns:
-            True если удаление успешно
-            
-        Note:
-            Telegram API не позволяет удалить файл без message_id.
-            Метод помечает файл как удалённый, но он остаётся в чате.
+            Количество удалённых (или поставленных в очередь) изображений
         """
-        try:
-            if not image_url.startswith('telegram:'):
-                return False
-            
-            file_id = image_url.replace('telegram:', '')
-            
-            # Примечание: для полного удаления нужен message_id
-            # Которого у нас нет после загрузки
-            # Можно сохранять message_id в БД при загрузке
-            print(f"Note: Telegram file {file_id} marked as deleted, but remains in chat")
-            return True
-            
-        except Exception as e:
-            print(f"Error deleting Telegram file: {e}")
-            return False
+        grouped: Dict[int, Tuple[StorageBackend, List[str]]] = {}
+        for image_url in image_urls:
+            backend = self._backend_for(image_url)
+            if backend:
+                grouped.setdefault(id(backend), (backend, []))[1].append(image_url)
+        
+        deleted = 0
+        for backend, urls in grouped.values():
+            deleted += await backend.delete_many(urls)
+        return deleted
     
-    async def _delete_google_drive(self, image_url: str) -> bool:
+    async def open_stream(self, image_url: str) -> Optional[Tuple[AsyncIterator[bytes], str, Optional[int]]]:
         """
-        Удалить файл из Google Drive (будущая реализация)
+        Открыть изображение для потоковой отдачи (GridFS, S3)
         
-        TODO: Реализовать после настройки Google Drive API
+        Returns:
+            (итератор блоков, content-type, размер) или None
         """
-        raise NotImplementedError("Google Drive integration not implemented yet")
+        backend = self._backend_for(image_url)
+        if not backend:
+            return None
+        return await backend.open_stream(image_url)
     
     async def get_item_images(self, item_id: str) -> List[str]:
         """
@@ -262,16 +278,9 @@ class StorageService:
         Returns:
             Список URL изображений
         """
-        if self.mode == 'local':
-            return await self._get_local_images(item_id)
-        elif self.mode == 'telegram':
-            # Для Telegram изображения хранятся в БД как telegram:{file_id}
-            # Этот метод используется редко, т.к. фронтенд получает URLs из БД
-            return []
-        elif self.mode == 'google_sheets':
-            return await self._get_google_sheets_images(item_id)
-        else:
-            return []
+        # Для Telegram изображения хранятся только в БД как telegram:{file_id}:{message_id},
+        # поэтому драйвер вернёт пустой список - фронтенд получает URLs из БД
+        return await self.backend.list_item_images(item_id)
     
     async def get_telegram_file_url(self, file_id: str) -> Optional[str]:
         """
@@ -287,30 +296,6 @@ class StorageService:
             return None
         
         return await self.telegram_storage.get_file_url(file_id)
-    
-    async def _get_local_images(self, item_id: str) -> List[str]:
-        """Получить локальные изображения"""
-        item_dir = self.upload_dir / item_id
-        if not item_dir.exists():
-            return []
-        
-        images = []
-        for file_path in item_dir.iterdir():
-            if file_path.is_file():
-                images.append(f"/api/uploads/{item_id}/{file_path.name}")
-        
-        return sorted(images)
-    
-    async def _get_google_sheets_images(self, item_id: str) -> List[str]:
-        """
-        Получить изображения из Google Sheets (будущая реализация)
-        
-        TODO: Реализовать после настройки Google Sheets API
-        - Запросить строки из таблицы "Фотографии"
-        - Отфильтровать по item_id
-        - Вернуть список URL
-        """
-        raise NotImplementedError("Google Sheets integration not implemented yet")
 
 
 # Глобальный экземпляр сервиса
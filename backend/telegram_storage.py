@@ -5,14 +5,64 @@ Telegram Storage Service - Хранение фотографий через Tele
 
 import os
 import io
+import json
 import uuid
+import asyncio
 import logging
 import aiohttp
-from typing import Optional
+from datetime import datetime, timezone
+from typing import Optional, List, Tuple
 from pathlib import Path
 
+from metrics import TELEGRAM_REQUEST_DURATION, observe
+
 logger = logging.getLogger(__name__)
 
+# Максимальное количество сообщений в одном вызове deleteMessages
+MAX_DELETE_BATCH = 100
+
+# Максимальное количество фото в одной медиагруппе (sendMediaGroup)
+MAX_MEDIA_GROUP = 10
+
+
+def parse_telegram_ref(image_url: str) -> Tuple[Optional[str], Optional[int]]:
+    """
+    Разобрать ссылку на фото в Telegram
+    
+    Args:
+        image_url: Строка вида "telegram:{file_id}:{message_id}"
+            или "telegram:{file_id}" (старый формат, без message_id)
+            
+    Returns:
+        (file_id, message_id); (None, None) если это не ссылка Telegram
+    """
+    if not image_url.startswith('telegram:'):
+        return None, None
+    
+    file_id, _, message_id = image_url[len('telegram:'):].partition(':')
+    return file_id, int(message_id) if message_id.isdigit() else None
+
+
+class TelegramAPIError(Exception):
+    """Ошибка Telegram Bot API"""
+    
+    def __init__(self, description: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        """
+        Args:
+            description: Описание ошибки от Telegram
+            status: HTTP статус / error_code
+            retry_after: Через сколько секунд можно повторить запрос (для 429)
+        """
+        super().__init__(f"Telegram API error {status}: {description}")
+        self.description = description
+        self.status = status
+        self.retry_after = retry_after
+    
+    @property
+    def is_retryable(self) -> bool:
+        """Имеет ли смысл повторить запрос позже"""
+        return self.retry_after is not None or self.status is None or self.status == 429 or self.status >= 500
+
 
 class TelegramStorage:
     """Сервис для работы с Telegram Bot API для хранения изображений"""
@@ -27,7 +77,9 @@ class TelegramStorage:
         """
         self.bot_token = bot_token
         self.chat_id = chat_id
-        self.api_url = f"https://api.telegram.org/bot{bot_token}"
+        # TELEGRAM_API_URL позволяет направить запросы на локальный Bot API сервер
+        self.api_base = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+        self.api_url = f"{self.api_base}/bot{bot_token}"
         
     async def upload_photo(self, file_content: bytes, caption: str = "") -> Optional[str]:
         """
@@ -41,35 +93,138 @@ class TelegramStorage:
             file_id фотографии в Telegram или None при ошибке
         """
         try:
-            url = f"{self.api_url}/sendPhoto"
+            file_id, _ = await self.send_photo(file_content, caption)
+            return file_id
+        except Exception as e:
+            logger.error(f"Error uploading photo to Telegram: {e}")
+            return None
+    
+    async def send_photo(self, file_content: bytes, caption: str = "") -> Tuple[str, int]:
+        """
+        Загрузить фото в Telegram, пробрасывая ошибки вызывающему коду
+        
+        В отличие от upload_photo, не скрывает ошибки: очередь загрузок
+        использует TelegramAPIError.retry_after, чтобы соблюдать лимиты API.
+        
+        Args:
+            file_content: Содержимое файла
+            caption: Подпись к фото (опционально)
             
-            # Создать multipart форму
-            form_data = aiohttp.FormData()
-            form_data.add_field('chat_id', self.chat_id)
-            form_data.add_field('photo', file_content, filename='photo.jpg', content_type='image/jpeg')
-            if caption:
-                form_data.add_field('caption', caption)
+        Returns:
+            (file_id, message_id) - message_id нужен для последующего удаления
             
-            # Отправить запрос
+        Raises:
+            TelegramAPIError: Telegram вернул ошибку (в т.ч. 429 Too Many Requests)
+            aiohttp.ClientError: Сетевая ошибка
+        """
+        url = f"{self.api_url}/sendPhoto"
+        
+        # Создать multipart форму
+        form_data = aiohttp.FormData()
+        form_data.add_field('chat_id', self.chat_id)
+        form_data.add_field('photo', file_content, filename='photo.jpg', content_type='image/jpeg')
+        if caption:
+            form_data.add_field('caption', caption)
+        
+        # Отправить запрос
+        with observe(TELEGRAM_REQUEST_DURATION, method="sendPhoto"):
             async with aiohttp.ClientSession() as session:
                 async with session.post(url, data=form_data) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if result.get('ok'):
-                            # Получить file_id самого большого размера фото
-                            photos = result['result']['photo']
-                            largest_photo = max(photos, key=lambda p: p['file_size'])
-                            file_id = largest_photo['file_id']
-                            logger.info(f"Photo uploaded to Telegram: {file_id}")
-                            return file_id
-                    
-                    error_text = await response.text()
-                    logger.error(f"Failed to upload photo to Telegram: {error_text}")
-                    return None
-                    
-        except Exception as e:
-            logger.error(f"Error uploading photo to Telegram: {e}")
-            return None
+                    result = await self._parse_response(response)
+        
+        # Получить file_id самого большого размера фото
+        photos = result['result']['photo']
+        largest_photo = max(photos, key=lambda p: p.get('file_size', 0))
+        file_id = largest_photo['file_id']
+        message_id = result['result']['message_id']
+        logger.info(f"Photo uploaded to Telegram: {file_id} (message {message_id})")
+        return file_id, message_id
+    
+    async def send_media_group(self, photos: List[Tuple[bytes, str]]) -> List[Tuple[str, int]]:
+        """
+        Загрузить до MAX_MEDIA_GROUP фото одним запросом (sendMediaGroup)
+        
+        Один вызов вместо десяти расходует лимит запросов к чату один раз.
+        
+        Args:
+            photos: Список (содержимое файла, подпись)
+            
+        Returns:
+            Список (file_id, message_id) в порядке переданных фото
+            
+        Raises:
+            TelegramAPIError: Telegram вернул ошибку (в т.ч. 429 Too Many Requests)
+            aiohttp.ClientError: Сетевая ошибка
+        """
+        if len(photos) > MAX_MEDIA_GROUP:
+            raise ValueError(f"sendMediaGroup accepts at most {MAX_MEDIA_GROUP} photos")
+        
+        # Telegram требует минимум 2 элемента в медиагруппе
+        if len(photos) == 1:
+            return [await self.send_photo(*photos[0])]
+        if not photos:
+            return []
+        
+        url = f"{self.api_url}/sendMediaGroup"
+        
+        form_data = aiohttp.FormData()
+        form_data.add_field('chat_id', self.chat_id)
+        media = []
+        for index, (file_content, caption) in enumerate(photos):
+            name = f"photo{index}"
+            entry = {'type': 'photo', 'media': f"attach://{name}"}
+            if caption:
+                entry['caption'] = caption
+            media.append(entry)
+            form_data.add_field(name, file_content, filename=f'{name}.jpg', content_type='image/jpeg')
+        form_data.add_field('media', json.dumps(media))
+        
+        with observe(TELEGRAM_REQUEST_DURATION, method="sendMediaGroup"):
+            async with aiohttp.ClientSession() as session:
+                async with session.post(url, data=form_data) as response:
+                    result = await self._parse_response(response)
+        
+        uploaded = []
+        for message in result['result']:
+            largest_photo = max(message['photo'], key=lambda p: p.get('file_size', 0))
+            uploaded.append((largest_photo['file_id'], message['message_id']))
+        
+        if len(uploaded) != len(photos):
+            # Фото уже отправлены: повтор пачки оставил бы дубликаты. Удалить то, что
+            # пришло, и не повторять пачку (очередь загрузит фото по одному)
+            try:
+                await self.delete_messages([message_id for _, message_id in uploaded])
+            except Exception as e:
+                logger.warning(f"Could not delete messages of an incomplete media group: {e}")
+            raise TelegramAPIError(
+                f"sendMediaGroup returned {len(uploaded)} messages for {len(photos)} photos",
+                status=response.status
+            )
+        
+        logger.info(f"Media group of {len(uploaded)} photos uploaded to Telegram")
+        return uploaded
+    
+    async def _parse_response(self, response: aiohttp.ClientResponse) -> dict:
+        """
+        Разобрать ответ Bot API
+        
+        Raises:
+            TelegramAPIError: Ответ не содержит ok=true
+        """
+        try:
+            result = await response.json(content_type=None)
+        except ValueError:
+            raise TelegramAPIError(await response.text(), status=response.status)
+        
+        if response.status == 200 and result.get('ok'):
+            return result
+        
+        parameters = result.get('parameters') or {}
+        raise TelegramAPIError(
+            result.get('description', 'Unknown Telegram API error'),
+            status=result.get('error_code', response.status),
+            retry_after=parameters.get('retry_after'),
+        )
     
     async def get_file_url(self, file_id: str) -> Optional[str]:
         """
@@ -91,7 +246,7 @@ class TelegramStorage:
                         result = await response.json()
                         if result.get('ok'):
                             file_path = result['result']['file_path']
-                            file_url = f"https://api.telegram.org/file/bot{self.bot_token}/{file_path}"
+                            file_url = f"{self.api_base}/file/bot{self.bot_token}/{file_path}"
                             return file_url
                     
                     logger.error(f"Failed to get file URL from Telegram: {await response.text()}")
@@ -143,6 +298,39 @@ class TelegramStorage:
             logger.error(f"Error deleting photo from Telegram: {e}")
             return False
     
+    async def delete_messages(self, message_ids: List[int]) -> bool:
+        """
+        Удалить несколько сообщений одним запросом (deleteMessages)
+        
+        Args:
+            message_ids: ID сообщений, не более MAX_DELETE_BATCH за вызов
+            
+        Returns:
+            True если запрос выполнен. Сообщения, которые нельзя удалить,
+            Telegram пропускает без ошибки
+            
+        Raises:
+            TelegramAPIError: Telegram вернул ошибку (в т.ч. 429 Too Many Requests)
+        """
+        if not message_ids:
+            return True
+        if len(message_ids) > MAX_DELETE_BATCH:
+            raise ValueError(f"deleteMessages accepts at most {MAX_DELETE_BATCH} message ids")
+        
+        url = f"{self.api_url}/deleteMessages"
+        params = {
+            'chat_id': self.chat_id,
+            'message_ids': message_ids
+        }
+        
+        with observe(TELEGRAM_REQUEST_DURATION, method="deleteMessages"):
+            async with aiohttp.ClientSession() as session:
+                async with session.post(url, json=params) as response:
+                    await self._parse_response(response)
+        
+        logger.info(f"Deleted {len(message_ids)} messages from Telegram")
+        return True
+    
     async def test_connection(self) -> bool:
         """
         Проверить подключение к Telegram Bot API
@@ -168,3 +356,103 @@ class TelegramStorage:
         except Exception as e:
             logger.error(f"Error testing Telegram connection: {e}")
             return False
+
+
+class TelegramDeletionSweeper:
+    """
+    Пакетное удаление сообщений с фото из канала Telegram
+    
+    ID сообщений сохраняются в коллекцию MongoDB, а фоновая задача удаляет
+    их пачками по MAX_DELETE_BATCH через deleteMessages, соблюдая retry_after
+    при ответах 429. Удаление сотен фото - несколько запросов вместо сотен.
+    """
+    
+    def __init__(self, storage: TelegramStorage, collection, interval_seconds: float = 2.0,
+                 poll_interval_seconds: float = 10.0):
+        """
+        Args:
+            storage: Экземпляр TelegramStorage
+            collection: Коллекция Motor для очереди удаления
+            interval_seconds: Пауза между пачками
+            poll_interval_seconds: Как часто проверять очередь без сигнала (записи других экземпляров)
+        """
+        self.storage = storage
+        self.collection = collection
+        self.interval = interval_seconds
+        self.poll_interval = poll_interval_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+    
+    async def enqueue(self, message_ids: List[int]):
+        """Поставить сообщения в очередь на удаление"""
+        if not message_ids:
+            return
+        now = datetime.now(timezone.utc)
+        await self.collection.insert_many(
+            [{"message_id": message_id, "created_at": now} for message_id in message_ids]
+        )
+        self._wakeup.set()
+    
+    async def start(self):
+        """Запустить фоновую задачу"""
+        if self._task is None:
+            await self.collection.create_index("created_at")
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Остановить фоновую задачу (очередь сохраняется в БД)"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+    
+    async def sweep_batch(self) -> int:
+        """
+        Удалить одну пачку сообщений
+        
+        Returns:
+            Количество обработанных сообщений (0 - очередь пуста)
+            
+        Raises:
+            TelegramAPIError: Повторяемая ошибка, пачка остаётся в очереди
+        """
+        docs = await self.collection.find({}, {"_id": 1, "message_id": 1}) \
+            .sort("created_at", 1).limit(MAX_DELETE_BATCH).to_list(MAX_DELETE_BATCH)
+        if not docs:
+            return 0
+        
+        message_ids = sorted({doc["message_id"] for doc in docs})
+        try:
+            await self.storage.delete_messages(message_ids)
+        except TelegramAPIError as e:
+            if e.is_retryable:
+                raise
+            # Неустранимая ошибка (например, нет прав) - не зацикливаться на пачке
+            logger.error(f"Dropping {len(message_ids)} Telegram deletions: {e}")
+        
+        await self.collection.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        return len(docs)
+    
+    async def _run(self):
+        """Цикл фоновой задачи"""
+        while True:
+            try:
+                # Сбросить до чтения очереди: enqueue во время sweep_batch не потеряется
+                self._wakeup.clear()
+                processed = await self.sweep_batch()
+                if processed:
+                    await asyncio.sleep(self.interval)
+                    continue
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except TelegramAPIError as e:
+                delay = e.retry_after or self.interval * 5
+                logger.warning(f"Telegram deletion rate limited, retrying in {delay}s: {e}")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                logger.error(f"Telegram deletion sweeper error: {e}")
+                await asyncio.sleep(self.interval * 5)
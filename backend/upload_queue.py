@@ -0,0 +1,383 @@
+"""
+Upload Queue - Фоновая очередь загрузки фотографий во внешнее хранилище
+
+Запрос на загрузку сохраняет оптимизированное изображение локально и сразу
+возвращает локальный (ожидающий) URL. Задание записывается в MongoDB
+(коллекция upload_jobs), а фоновые воркеры отправляют файл во внешнее
+хранилище (Telegram) с экспоненциальной задержкой между попытками,
+соблюдая retry_after из ответов 429. После успешной загрузки URL в массиве
+images элемента атомарно заменяется на удалённый.
+"""
+
+import asyncio
+import logging
+import random
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import List, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+from telegram_storage import TelegramAPIError, MAX_MEDIA_GROUP
+
+logger = logging.getLogger(__name__)
+
+# Коллекции, элементы которых могут содержать фотографии
+IMAGE_COLLECTIONS = ('inventory', 'equipment')
+
+
+class UploadQueue:
+    """Очередь фоновой загрузки изображений с повторными попытками"""
+
+    def __init__(self, db, storage, change_feed=None, snapshots=None):
+        """
+        Args:
+            db: База данных Motor
+            storage: Экземпляр StorageService
+            change_feed: ChangeFeed, которому сообщается о замене URL (необязательно)
+            snapshots: SnapshotRefresher, обновляющий копии первого фото в списках проектов (необязательно)
+        """
+        self.db = db
+        self.jobs = db.upload_jobs
+        self.storage = storage
+        self.change_feed = change_feed
+        self.snapshots = snapshots
+
+        queue_config = storage.config.get('upload_queue', {})
+        # GridFS и S3 пишутся сразу: ожидающий файл на диске одного экземпляра
+        # не нашёл бы воркер другого
+        self.enabled = storage.use_upload_queue and queue_config.get('enabled', False)
+        self.workers = queue_config.get('workers', 2)
+        self.max_attempts = queue_config.get('max_attempts', 8)
+        self.base_delay = queue_config.get('base_delay_seconds', 2)
+        self.max_delay = queue_config.get('max_delay_seconds', 600)
+        self.poll_interval = queue_config.get('poll_interval_seconds', 2)
+        self.lease_seconds = queue_config.get('lease_seconds', 300)
+        self.batch_size = min(queue_config.get('batch_size', MAX_MEDIA_GROUP), MAX_MEDIA_GROUP)
+
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+
+    async def save_image(self, file_content: bytes, filename: str, item_id: str) -> str:
+        """
+        Сохранить изображение: локально (если очередь включена) или сразу в хранилище
+
+        Returns:
+            URL изображения (ожидающий локальный URL при включённой очереди)
+        """
+        if not self.enabled:
+            return await self.storage.save_image(file_content, filename, item_id)
+        return await self.storage.stage_image(file_content, filename, item_id)
+
+    async def save_images(self, files: List[Tuple[bytes, str, str]]) -> List[str]:
+        """
+        Сохранить несколько изображений (см. save_image)
+
+        Args:
+            files: Список (содержимое файла, имя файла, ID элемента)
+
+        Returns:
+            URL изображений в порядке переданных файлов
+        """
+        if not self.enabled:
+            return await self.storage.save_images(files)
+        return [await self.storage.stage_image(*file) for file in files]
+
+    async def enqueue(self, image_url: str, item_id: str, collection: str, filename: str) -> Optional[str]:
+        """
+        Поставить загрузку в очередь
+
+        Вызывается после того, как URL записан в массив images элемента,
+        чтобы воркер гарантированно нашёл его при замене.
+
+        Returns:
+            ID задания или None, если очередь выключена или URL уже удалённый
+        """
+        if not self.enabled or not self.storage.local_path(image_url):
+            return None
+
+        now = datetime.now(timezone.utc)
+        job = {
+            "id": str(uuid.uuid4()),
+            "item_id": item_id,
+            "collection": collection,
+            "image_url": image_url,
+            "filename": filename,
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "lease_until": None,
+            "lease_id": None,
+            "last_error": None,
+            "remote_url": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        await self.jobs.insert_one(job)
+        self._wakeup.set()
+        return job["id"]
+
+    async def start(self):
+        """Создать индексы и запустить воркеры"""
+        if not self.enabled or self._tasks:
+            return
+
+        await self.jobs.create_index("id", unique=True)
+        await self.jobs.create_index([("status", 1), ("next_attempt_at", 1)])
+
+        for n in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(n)))
+        logger.info(f"Upload queue started with {self.workers} workers")
+
+    async def stop(self):
+        """Остановить воркеры (незавершённые задания будут подхвачены после рестарта)"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def stats(self) -> dict:
+        """Количество заданий по статусам"""
+        pipeline = [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+        result = await self.jobs.aggregate(pipeline).to_list(None)
+        return {row["_id"]: row["count"] for row in result}
+
+    async def _worker(self, n: int):
+        """Цикл воркера: забрать пачку заданий, обработать, повторить"""
+        while True:
+            try:
+                jobs = await self._claim_batch()
+                if not jobs:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._process_batch(jobs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Upload worker {n} error: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _claim(self) -> Optional[dict]:
+        """
+        Атомарно забрать готовое задание
+
+        Задания в статусе processing с истёкшей арендой (воркер упал)
+        также подхватываются повторно.
+        """
+        now = datetime.now(timezone.utc)
+        return await self.jobs.find_one_and_update(
+            {
+                "$or": [
+                    {"status": "pending", "next_attempt_at": {"$lte": now}},
+                    {"status": "processing", "lease_until": {"$lte": now}},
+                ]
+            },
+            {
+                "$set": {
+                    "status": "processing",
+                    "lease_until": now + timedelta(seconds=self.lease_seconds),
+                    # Владелец аренды: только он может завершить задание
+                    "lease_id": str(uuid.uuid4()),
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("next_attempt_at", 1)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _claim_batch(self) -> List[dict]:
+        """Забрать до batch_size заданий, чтобы загрузить их одной медиагруппой"""
+        jobs = []
+        while len(jobs) < self.batch_size:
+            job = await self._claim()
+            if job is None:
+                break
+            jobs.append(job)
+        return jobs
+
+    async def _process_batch(self, jobs: List[dict]):
+        """Загрузить файлы пачки одним запросом и заменить URL в элементах"""
+        ready = []
+        files = []
+        for job in jobs:
+            if job.get("remote_url"):
+                # Уже загружено в прошлой попытке, осталось заменить URL
+                await self._complete(job, job["remote_url"])
+                continue
+
+            file_path = self.storage.local_path(job["image_url"])
+            if not file_path or not file_path.exists():
+                # Изображение удалили до загрузки
+                await self._finish(job, "cancelled", error="Local file no longer exists")
+                continue
+
+            file_content = await asyncio.to_thread(file_path.read_bytes)
+            ready.append(job)
+            files.append((file_content, job["filename"], job["item_id"]))
+
+        if not ready:
+            return
+
+        try:
+            remote_urls = await self.storage.upload_remote_batch(files)
+        except TelegramAPIError as e:
+            if not e.is_retryable and len(ready) > 1:
+                # Одно отклонённое фото не должно провалить всю пачку
+                logger.warning(f"Batch of {len(ready)} uploads rejected, uploading one by one: {e}")
+                await self._process_one_by_one(ready, files)
+                return
+            for job in ready:
+                if e.is_retryable:
+                    await self._retry(job, str(e), retry_after=e.retry_after)
+                else:
+                    await self._finish(job, "failed", error=str(e))
+            return
+        except Exception as e:
+            for job in ready:
+                await self._retry(job, str(e))
+            return
+
+        for job, remote_url in zip(ready, remote_urls):
+            await self._uploaded(job, remote_url)
+
+    async def _process_one_by_one(self, jobs: List[dict], files: List[Tuple[bytes, str, str]]):
+        """Загрузить файлы отклонённой пачки по одному: ошибку получит только плохое фото"""
+        for index, (job, file) in enumerate(zip(jobs, files)):
+            try:
+                remote_url, = await self.storage.upload_remote_batch([file])
+            except TelegramAPIError as e:
+                if not e.is_retryable:
+                    await self._finish(job, "failed", error=str(e))
+                    continue
+                # Лимит запросов: остальные задания тоже отложить
+                for rest in jobs[index:]:
+                    await self._retry(rest, str(e), retry_after=e.retry_after)
+                return
+            except Exception as e:
+                for rest in jobs[index:]:
+                    await self._retry(rest, str(e))
+                return
+            await self._uploaded(job, remote_url)
+
+    async def _uploaded(self, job: dict, remote_url: str):
+        """Запомнить удалённый URL и завершить задание"""
+        # Запомнить результат, чтобы не загружать файл повторно при сбое замены
+        await self.jobs.update_one({"id": job["id"]}, {"$set": {"remote_url": remote_url}})
+        await self._complete(job, remote_url)
+
+    async def _complete(self, job: dict, remote_url: str):
+        """Заменить ожидающий URL на удалённый и завершить задание"""
+        swapped = await self._swap_url(job, remote_url)
+        if not swapped:
+            # Изображение удалили из элемента, пока шла загрузка
+            await self.storage.delete_image(remote_url)
+            await self._finish(job, "cancelled", error="Image removed from item before upload finished")
+            return
+
+        await self.storage.delete_image(job["image_url"])
+        await self._finish(job, "done", remote_url=remote_url)
+        logger.info(f"Uploaded {job['image_url']} -> {remote_url}")
+
+    async def _swap_url(self, job: dict, remote_url: str) -> bool:
+        """Атомарно заменить ожидающий URL на удалённый в массиве images"""
+        if job["collection"] not in IMAGE_COLLECTIONS:
+            return False
+
+        updated_item = await self.db[job["collection"]].find_one_and_update(
+            {"id": job["item_id"], "images": job["image_url"]},
+            {
+                "$set": {
+                    "images.$": remote_url,
+                    "updated_at": datetime.now(timezone.utc)
+                },
+                "$inc": {"version": 1}
+            },
+            projection={"_id": 0, "images": 1, "updated_at": 1, "version": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if updated_item is None:
+            return False
+
+        # Клиенты должны перейти на удалённый URL до удаления локального файла
+        if self.change_feed:
+            self.change_feed.publish(
+                job["collection"], "update", job["item_id"],
+                {"images": updated_item["images"], "updated_at": updated_item["updated_at"]}, updated_item["version"]
+            )
+        if self.snapshots and updated_item["images"][:1] == [remote_url]:
+            self.snapshots.schedule(job["collection"], job["item_id"])
+        return True
+
+    async def _retry(self, job: dict, error: str, retry_after: Optional[float] = None):
+        """Запланировать повторную попытку с экспоненциальной задержкой"""
+        attempts = job["attempts"]
+        if attempts >= self.max_attempts:
+            # Изображение остаётся доступным по локальному URL
+            await self._finish(job, "failed", error=error)
+            logger.error(f"Upload job {job['id']} failed after {attempts} attempts: {error}")
+            return
+
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        delay = delay * random.uniform(0.5, 1.0)
+        if retry_after is not None:
+            delay = max(delay, float(retry_after))
+
+        next_attempt = datetime.now(timezone.utc) + timedelta(seconds=delay)
+        result = await self.jobs.update_one(
+            self._leased(job),
+            {
+                "$set": {
+                    "status": "pending",
+                    "next_attempt_at": next_attempt,
+                    "lease_until": None,
+                    "lease_id": None,
+                    "last_error": error,
+                    "updated_at": datetime.now(timezone.utc),
+                }
+            }
+        )
+        if not result.matched_count:
+            self._lease_lost(job)
+            return
+        logger.warning(f"Upload job {job['id']} attempt {attempts} failed, retrying in {delay:.1f}s: {error}")
+
+    async def _finish(self, job: dict, status: str, error: Optional[str] = None, remote_url: Optional[str] = None):
+        """Завершить задание с итоговым статусом"""
+        update = {
+            "status": status,
+            "lease_until": None,
+            "lease_id": None,
+            "updated_at": datetime.now(timezone.utc),
+        }
+        if error:
+            update["last_error"] = error
+        if remote_url:
+            update["remote_url"] = remote_url
+        result = await self.jobs.update_one(self._leased(job), {"$set": update})
+        if not result.matched_count:
+            self._lease_lost(job)
+
+    @staticmethod
+    def _leased(job: dict) -> dict:
+        """
+        Фильтр задания, пока аренда принадлежит этому воркеру
+
+        Воркер, чья аренда истекла, не должен перезаписать статус задания,
+        которое другой воркер уже забрал повторно.
+        """
+        return {
+            "id": job["id"],
+            "status": "processing",
+            "lease_id": job.get("lease_id"),
+            "lease_until": job.get("lease_until"),
+        }
+
+    @staticmethod
+    def _lease_lost(job: dict):
+        logger.warning(f"Upload job {job['id']} was claimed again after its lease expired, result dropped")
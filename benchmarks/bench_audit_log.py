@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Benchmark: size of audit log entries, full payloads vs structural diffs
+
+Replays a synthetic week of project edits and encodes the UPDATE log entry of
+every edit three ways:
+
+- payload:  details = the update payload (what update_project stored before)
+- diff:     details = structural_diff() of the stored project and the payload
+- diff+zlib: the same, compressed when larger than --compress-min-bytes
+
+Edits follow what the frontend sends: a list change (quantity, new item,
+removed item, reordering) PATCHes the whole list, the other edits change
+status or a full_details key. Sizes are BSON bytes, as stored in db.logs.
+
+Usage:
+    python benchmarks/bench_audit_log.py [--projects 30] [--items 60] [--edits-per-day 400]
+"""
+
+import argparse
+import copy
+import random
+import sys
+import time
+from pathlib import Path
+
+import bson
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from audit_diff import AuditDetails, structural_diff  # noqa: E402
+from line_items import new_line_id  # noqa: E402
+from models import LogEntry, ProjectStatus  # noqa: E402
+
+LIST_EDITS = ("quantity", "add_item", "remove_item", "reorder")
+
+
+def make_project(n: int, items: int, rng: random.Random) -> dict:
+    def item(i):
+        return {
+            "line_id": new_line_id(), "id": f"inv-{n}-{i}", "name": f"Ваза стеклянная {i}",
+            "category": "Вазы", "quantity": rng.randint(1, 20), "source": "inventory", "notes": None,
+        }
+    return {
+        "id": f"project-{n}",
+        "title": f"Проект {n}",
+        "status": ProjectStatus.CREATED.value,
+        "full_details": {"venue": f"Площадка {n}", "guest_count": 150, "contact": "+7 900 000-00-00"},
+        "preliminary_list": {"items": [item(i) for i in range(items)]},
+        "final_list": {"items": [item(i) for i in range(items // 2)]},
+        "dismantling_list": {"items": []},
+    }
+
+
+def edit(project: dict, rng: random.Random) -> dict:
+    """Apply one random edit to project in place and return the PATCH payload"""
+    kind = rng.choices(LIST_EDITS + ("status", "details"), weights=(40, 20, 10, 5, 10, 15))[0]
+    if kind == "status":
+        return {"status": rng.choice(list(ProjectStatus)).value}
+    if kind == "details":
+        full_details = dict(project["full_details"], guest_count=rng.randint(50, 400))
+        return {"full_details": full_details}
+
+    field = rng.choice(("preliminary_list", "final_list"))
+    items = copy.deepcopy(project[field]["items"])
+    if kind == "quantity" and items:
+        rng.choice(items)["quantity"] = rng.randint(1, 20)
+    elif kind == "remove_item" and items:
+        items.pop(rng.randrange(len(items)))
+    elif kind == "reorder" and len(items) > 1:
+        i, j = rng.sample(range(len(items)), 2)
+        items[i], items[j] = items[j], items[i]
+    else:
+        items.insert(rng.randrange(len(items) + 1), {
+            "line_id": new_line_id(), "id": None, "name": f"Позиция {rng.randint(1, 999)}",
+            "category": "Текстиль", "quantity": rng.randint(1, 20), "source": "manual", "notes": None,
+        })
+    return {field: {"items": items}}
+
+
+def log_size(details: dict) -> int:
+    return len(bson.encode(LogEntry(
+        user_id="user", user_name="curator@example.com", action="UPDATE",
+        entity_type="PROJECT", entity_id="project", details=details,
+    ).model_dump()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--projects", type=int, default=30)
+    parser.add_argument("--items", type=int, default=60)
+    parser.add_argument("--edits-per-day", type=int, default=400)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--compress-min-bytes", type=int, default=512)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    projects = [make_project(n, args.items, rng) for n in range(args.projects)]
+    compressing = AuditDetails()
+    compressing.compress_min_bytes = args.compress_min_bytes
+
+    totals = {"payload": 0, "diff": 0, "diff+zlib": 0}
+    largest = dict.fromkeys(totals, 0)
+    diff_time = 0.0
+    edits = args.days * args.edits_per_day
+    for _ in range(edits):
+        project = rng.choice(projects)
+        payload = edit(project, rng)
+
+        start = time.perf_counter()
+        changes = structural_diff(project, payload)
+        diff_time += time.perf_counter() - start
+
+        details = {"title": project["title"], "changes": changes}
+        sizes = {
+            "payload": log_size(payload),
+            "diff": log_size(details),
+            "diff+zlib": log_size(compressing.pack(details)),
+        }
+        for name, size in sizes.items():
+            totals[name] += size
+            largest[name] = max(largest[name], size)
+        project.update(payload)
+
+    print(f"{edits} edits ({args.days} days x {args.edits_per_day}) of {args.projects} projects, "
+          f"{args.items}/{args.items // 2} items in the preliminary/final lists")
+    print(f"{'details':<10} {'total MiB':>10} {'avg bytes':>10} {'max bytes':>10} {'vs payload':>11}")
+    for name, total in totals.items():
+        print(f"{name:<10} {total / 2**20:>10.2f} {total / edits:>10.0f} {largest[name]:>10} "
+              f"{totals['payload'] / total:>10.1f}x")
+    print(f"\nstructural_diff: {diff_time / edits * 1e6:.0f} us per edit")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Benchmark: bandwidth vs CPU trade-off of response compression
+
+Compresses typical API responses (the 1000-project list, a 500-item
+inventory list, a single project) with gzip and brotli at several levels and
+reports size, ratio, compression and decompression CPU time, and the time to
+transfer the body over a slow (10 Mbit/s, mobile) and a fast (100 Mbit/s)
+link. A small end-to-end check runs the real CompressionMiddleware on the
+project list to confirm the negotiated encoding and the overhead per request.
+
+Usage:
+    python benchmarks/bench_compression.py [--projects 1000] [--items 500]
+"""
+
+import argparse
+import asyncio
+import gzip
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+import orjson
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from bench_json_response import make_documents, call  # noqa: E402
+from compression import CompressionMiddleware, brotli  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from models import InventoryItem, Project  # noqa: E402
+from responses import FastJSONResponse, trusted_response  # noqa: E402
+
+LINKS = (("10 Mbit/s", 10e6 / 8), ("100 Mbit/s", 100e6 / 8))
+
+
+def codecs() -> List[Tuple[str, Callable[[bytes], bytes], Callable[[bytes], bytes]]]:
+    result = [("identity", lambda data: data, lambda data: data)]
+    for level in (1, 6, 9):
+        result.append((f"gzip-{level}", lambda data, level=level: gzip.compress(data, level, mtime=0), gzip.decompress))
+    if brotli is not None:
+        for quality in (1, 4, 6, 11):
+            result.append((f"br-{quality}", lambda data, quality=quality: brotli.compress(data, quality=quality),
+                           brotli.decompress))
+    return result
+
+
+def timed(func: Callable, data: bytes, min_time: float = 0.2) -> Tuple[float, bytes]:
+    """Average seconds per call and the last result"""
+    loops = 0
+    start = time.process_time()
+    while True:
+        result = func(data)
+        loops += 1
+        elapsed = time.process_time() - start
+        if elapsed >= min_time:
+            return elapsed / loops, result
+
+
+def payloads(projects: int, items: int) -> List[Tuple[str, bytes]]:
+    project_docs = make_documents(projects)
+    inventory = [
+        InventoryItem(
+            category="Вазы", name=f"Ваза стеклянная {n}", total_quantity=n % 100,
+            visual_marker="Синяя наклейка", description="Прозрачная стеклянная ваза, высота 60 см, " * 3,
+            images=[f"/api/uploads/inv-{n}/photo.jpg"],
+        ).model_dump()
+        for n in range(items)
+    ]
+    dumps = lambda value: orjson.dumps(value, option=orjson.OPT_UTC_Z)  # noqa: E731
+    return [
+        (f"{projects} projects", dumps(project_docs)),
+        (f"{items} inventory items", dumps(inventory)),
+        ("single project", dumps(project_docs[0])),
+    ]
+
+
+async def middleware_overhead(docs, requests: int = 20):
+    results = {}
+    for accept in (None, "gzip", "br"):
+        app = FastAPI(default_response_class=FastJSONResponse)
+
+        @app.get("/api/projects")
+        async def get_projects():
+            return trusted_response(Project, docs)
+
+        handler = CompressionMiddleware(app) if accept else app
+        headers = [(b"accept-encoding", accept.encode())] if accept else []
+        body = await call(handler, headers=headers)
+        start = time.process_time()
+        for _ in range(requests):
+            await call(handler, headers=headers)
+        results[accept or "none"] = ((time.process_time() - start) / requests, len(body))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--projects", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=500)
+    args = parser.parse_args()
+
+    for name, data in payloads(args.projects, args.items):
+        print(f"\n{name}: {len(data) / 1024:.1f} KiB")
+        header = f"{'codec':<10} {'size KiB':>9} {'ratio':>6} {'compress ms':>12} {'decompress ms':>14}"
+        header += "".join(f" {'total @ ' + link:>18}" for link, _ in LINKS)
+        print(header)
+        for codec, compress, decompress in codecs():
+            compress_time, compressed = timed(compress, data)
+            decompress_time, restored = timed(decompress, compressed)
+            assert restored == data
+            line = (f"{codec:<10} {len(compressed) / 1024:>9.1f} {len(data) / len(compressed):>6.1f} "
+                    f"{compress_time * 1000:>12.2f} {decompress_time * 1000:>14.2f}")
+            for _, bytes_per_second in LINKS:
+                # Server CPU + wire time + client CPU for one response
+                total = compress_time + len(compressed) / bytes_per_second + decompress_time
+                line += f" {total * 1000:>15.1f} ms"
+            print(line)
+
+    print(f"\nCompressionMiddleware on GET /api/projects ({args.projects} projects, defaults):")
+    for encoding, (cpu, size) in asyncio.run(middleware_overhead(make_documents(args.projects))).items():
+        print(f"  accept-encoding {encoding:<5} {cpu * 1000:8.1f} ms CPU/request  {size / 1024:8.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Benchmark: CPU cost of returning a 1000-project list
+
+Compares three ways to answer GET /api/projects with documents already read
+from MongoDB (decoded with the app's codec, held in memory so the database is
+not part of the measurement):
+
+- models:   Project(**doc) per document, response_model validation, stdlib json
+- orjson:   the same, rendered by FastJSONResponse
+- trusted:  trusted_response() - documents straight to orjson, no re-validation
+
+The ASGI app is called directly (no sockets) and CPU time is measured with
+time.process_time().
+
+Usage:
+    python benchmarks/bench_json_response.py [--projects 1000] [--requests 30]
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List
+
+import bson
+from bson.codec_options import CodecOptions
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from fastapi import FastAPI  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from models import Project, ProjectStatus  # noqa: E402
+from responses import FastJSONResponse, model_projection, trusted_response  # noqa: E402
+
+
+def make_documents(count: int, list_size: int = 25) -> List[dict]:
+    codec = CodecOptions(tz_aware=True, tzinfo=timezone.utc)
+    fields = model_projection(Project)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    statuses = list(ProjectStatus)
+    docs = []
+    for n in range(count):
+        items = [
+            {"id": f"inv-{n}-{i}", "name": f"Предмет {i}", "category": "Вазы", "quantity": i % 20 + 1, "source": "inventory"}
+            for i in range(list_size)
+        ]
+        project = Project(
+            title=f"Проект {n}",
+            lead_decorator=f"Декоратор {n % 10}",
+            project_date=start + timedelta(days=n % 365),
+            status=statuses[n % len(statuses)],
+            full_details={"venue": f"Площадка {n % 30}", "guest_count": 100 + n % 200},
+            preliminary_list={"items": items},
+            final_list={"items": items[: list_size // 2]},
+            dismantling_list={"items": []},
+        )
+        # Round trip through BSON so values have exactly the types Motor returns
+        doc = bson.decode(bson.encode(project.model_dump()), codec)
+        docs.append({key: value for key, value in doc.items() if key in fields})
+    return docs
+
+
+def build_app(mode: str, docs: List[dict]) -> FastAPI:
+    app = FastAPI(default_response_class=JSONResponse if mode == "models" else FastJSONResponse)
+
+    @app.get("/api/projects", response_model=List[Project])
+    async def get_projects():
+        if mode == "trusted":
+            return trusted_response(Project, docs)
+        return [Project(**doc) for doc in docs]
+
+    return app
+
+
+async def call(app, headers=None) -> bytes:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": "/api/projects", "raw_path": b"/api/projects",
+        "root_path": "", "query_string": b"", "headers": headers or [], "server": ("test", 80),
+        "client": ("127.0.0.1", 1234),
+    }
+    body = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return b"".join(body)
+
+
+async def run(app, requests: int):
+    body = await call(app)  # warm up
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for _ in range(requests):
+        await call(app)
+    return (time.process_time() - cpu_start) / requests, (time.perf_counter() - wall_start) / requests, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--projects", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=30)
+    args = parser.parse_args()
+
+    docs = make_documents(args.projects)
+    results = {}
+    for mode in ("models", "orjson", "trusted"):
+        results[mode] = asyncio.run(run(build_app(mode, docs), args.requests))
+
+    # All three must return the same data
+    reference = json.loads(results["models"][2])
+    for mode in ("orjson", "trusted"):
+        assert json.loads(results[mode][2]) == reference, f"{mode} response differs from models"
+
+    baseline_cpu = results["models"][0]
+    print(f"projects per response: {args.projects}, response size: {len(results['trusted'][2]) / 1024:.0f} KiB")
+    print(f"{'mode':<10} {'cpu ms/req':>11} {'wall ms/req':>12} {'cpu vs models':>14}")
+    for mode, (cpu, wall, _) in results.items():
+        print(f"{mode:<10} {cpu * 1000:>11.1f} {wall * 1000:>12.1f} {(cpu / baseline_cpu - 1) * 100:>+13.1f}%")
+
+
+if __name__ == "__main__":
+    main()
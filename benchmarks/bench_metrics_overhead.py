@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-request overhead of MetricsMiddleware
+
+Runs the same trivial FastAPI route with and without the middleware by calling
+the ASGI app directly (no sockets), so the difference is the middleware cost.
+
+Usage:
+    python benchmarks/bench_metrics_overhead.py [--requests 20000]
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from fastapi import FastAPI  # noqa: E402
+
+from metrics import MetricsMiddleware  # noqa: E402
+
+
+def build_app(with_metrics: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/api/items/{item_id}")
+    async def get_item(item_id: str):
+        return {"id": item_id}
+
+    if with_metrics:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+
+async def call(app, path: str):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "root_path": "", "query_string": b"", "headers": [], "server": ("test", 80),
+        "client": ("127.0.0.1", 1234),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def run(app, requests: int) -> float:
+    # Warm up routing and middleware stack construction
+    for i in range(200):
+        await call(app, f"/api/items/{i}")
+
+    start = time.perf_counter()
+    for i in range(requests):
+        await call(app, f"/api/items/{i}")
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    baseline = asyncio.run(run(build_app(False), args.requests))
+    instrumented = asyncio.run(run(build_app(True), args.requests))
+    overhead = instrumented - baseline
+
+    print(f"requests per run:   {args.requests}")
+    print(f"baseline:           {baseline * 1e6:8.1f} µs/request")
+    print(f"with metrics:       {instrumented * 1e6:8.1f} µs/request")
+    print(f"overhead:           {overhead * 1e6:8.1f} µs/request ({overhead / baseline * 100:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
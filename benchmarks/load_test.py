@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Load test: throughput and latency percentiles of the API under a mixed workload
+
+Boots the FastAPI app in-process against mongomock-motor (default) or a local
+mongod, seeds a dataset of configurable size and drives a weighted mix of
+operations (login, list, get, PATCH project lists, image upload) from an
+async closed-loop load generator. Requests go through httpx's ASGI transport,
+so the numbers cover the app and the database driver, not the network stack.
+
+The JSON report holds throughput and p50/p95/p99 latency per operation. With
+--baseline the report is compared to a stored one and the script exits with
+status 1 if any operation regressed beyond --max-regression, so CI can gate on it.
+
+Usage:
+    python benchmarks/load_test.py [--mongo mock|mongodb://localhost:27017]
+        [--projects 200] [--items 500] [--concurrency 16] [--duration 20]
+        [--mix login=1,list_projects=4,get_project=6,patch_project_list=3,...]
+        [--output report.json] [--baseline benchmarks/baselines/load_test.json]
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND_DIR))
+
+ADMIN_EMAIL = "admin@sls1.com"
+ADMIN_PASSWORD = "admin123"
+
+DEFAULT_MIX = {
+    "login": 1,
+    "list_projects": 4,
+    "get_project": 6,
+    "list_inventory": 3,
+    "list_equipment": 2,
+    "patch_project_list": 3,
+    "upload_image": 1,
+}
+
+# Metrics compared against the baseline: lower is better for latency, higher for throughput
+COMPARED_LATENCIES = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}, expected one of {', '.join(DEFAULT_MIX)}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def load_server(mongo: str, db_name: str, upload_dir: Path):
+    """Import the app bound to the requested database and a throwaway upload directory"""
+    os.environ["MONGO_URL"] = "mongodb://localhost:27017" if mongo == "mock" else mongo
+    os.environ["DB_NAME"] = db_name
+    # Keep watchdog output out of the numbers; it is measured separately
+    os.environ.setdefault("LOOP_WATCHDOG", "0")
+    os.environ.setdefault("SLOW_QUERY_EXPLAIN", "0")
+
+    import server
+
+    if mongo == "mock":
+        from mongomock_motor import AsyncMongoMockClient
+        database = AsyncMongoMockClient()[db_name]
+        # Recreate every module-level service that captured the real database at import time
+        server.bind_database(database)
+
+    server.storage_service.upload_dir = upload_dir
+    server.storage_service.local.upload_dir = upload_dir
+    return server
+
+
+async def seed(server, projects: int, items: int, list_size: int, rng: random.Random) -> Dict[str, List[str]]:
+    """Insert a reproducible dataset and return the ids workers pick from"""
+    from models import User, UserRole, Project, ProjectStatus, InventoryItem, EquipmentItem
+    from auth import get_password_hash
+
+    db = server.db
+    for collection in ("users", "projects", "inventory", "equipment", "logs", "upload_jobs"):
+        await db[collection].delete_many({})
+
+    admin = User(email=ADMIN_EMAIL, name="Bench Admin", role=UserRole.ADMIN,
+                 password_hash=get_password_hash(ADMIN_PASSWORD))
+    await db.users.insert_one(admin.model_dump())
+
+    categories = ["Вазы", "Текстиль", "Свечи", "Подсвечники", "Арки", "Свет", "Звук"]
+    inventory = [
+        InventoryItem(category=rng.choice(categories), name=f"Предмет {n}", total_quantity=rng.randint(1, 200),
+                      description="Описание " * rng.randint(1, 20))
+        for n in range(items)
+    ]
+    equipment = [
+        EquipmentItem(category=rng.choice(categories), name=f"Оборудование {n}", total_quantity=rng.randint(1, 50))
+        for n in range(max(1, items // 2))
+    ]
+    if inventory:
+        await db.inventory.insert_many([item.model_dump() for item in inventory])
+    await db.equipment.insert_many([item.model_dump() for item in equipment])
+
+    def line_items():
+        return {"items": [
+            {"id": item.id, "name": item.name, "category": item.category,
+             "quantity": rng.randint(1, 20), "source": "inventory"}
+            for item in rng.sample(inventory, min(list_size, len(inventory)))
+        ]}
+
+    statuses = list(ProjectStatus)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    docs = []
+    for n in range(projects):
+        project = Project(
+            title=f"Проект {n}",
+            lead_decorator=f"Декоратор {n % 10}",
+            project_date=start + timedelta(days=rng.randint(0, 365)),
+            status=rng.choice(statuses),
+            full_details={"venue": f"Площадка {n % 30}", "guest_count": rng.randint(20, 300)},
+            preliminary_list=line_items(),
+            final_list=line_items(),
+            dismantling_list={"items": []},
+        )
+        docs.append(project.model_dump())
+    if docs:
+        await db.projects.insert_many(docs)
+
+    return {
+        "projects": [doc["id"] for doc in docs],
+        "inventory": [item.id for item in inventory],
+        "equipment": [item.id for item in equipment],
+    }
+
+
+def build_operations(client, ids: Dict[str, List[str]], headers: Dict[str, str], list_size: int,
+                     image: bytes) -> Dict[str, Callable]:
+    """Each operation takes an rng and returns an awaitable httpx response"""
+
+    def login(rng):
+        return client.post("/api/auth/login", json={"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD})
+
+    def list_projects(rng):
+        return client.get("/api/projects", headers=headers)
+
+    def get_project(rng):
+        return client.get(f"/api/projects/{rng.choice(ids['projects'])}", headers=headers)
+
+    def list_inventory(rng):
+        return client.get("/api/inventory", headers=headers)
+
+    def list_equipment(rng):
+        return client.get("/api/equipment", headers=headers)
+
+    def patch_project_list(rng):
+        # The frontend sends the whole list on every edit
+        items = [
+            {"id": item_id, "name": f"Предмет {n}", "category": "Вазы", "quantity": rng.randint(1, 20),
+             "source": "inventory"}
+            for n, item_id in enumerate(rng.sample(ids["inventory"], min(list_size, len(ids["inventory"]))))
+        ]
+        return client.patch(f"/api/projects/{rng.choice(ids['projects'])}",
+                            json={"final_list": {"items": items}}, headers=headers)
+
+    def upload_image(rng):
+        return client.post(f"/api/inventory/{rng.choice(ids['inventory'])}/images",
+                           files={"file": ("bench.jpg", image, "image/jpeg")}, headers=headers)
+
+    return {
+        "login": login,
+        "list_projects": list_projects,
+        "get_project": get_project,
+        "list_inventory": list_inventory,
+        "list_equipment": list_equipment,
+        "patch_project_list": patch_project_list,
+        "upload_image": upload_image,
+    }
+
+
+def make_image(size=(1600, 1200)) -> bytes:
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.effect_noise(size, 64).convert("RGB").save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+async def drive(operations: Dict[str, Callable], mix: Dict[str, int], concurrency: int,
+                duration: float, warmup: float, seed_value: int) -> Dict:
+    """Closed-loop load: each worker sends its next request as soon as the previous one completes"""
+    names = [name for name in mix if mix[name] > 0]
+    weights = [mix[name] for name in names]
+    latencies: Dict[str, List[float]] = {name: [] for name in names}
+    errors: Dict[str, int] = {name: 0 for name in names}
+    measuring = False
+
+    async def worker(n: int, deadline: float):
+        rng = random.Random(seed_value * 1000 + n)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                response = await operations[name](rng)
+                ok = response.status_code < 400
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - start
+            if measuring:
+                latencies[name].append(elapsed)
+                if not ok:
+                    errors[name] += 1
+
+    if warmup > 0:
+        await asyncio.gather(*(worker(n, time.perf_counter() + warmup) for n in range(concurrency)))
+
+    measuring = True
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n, started + duration) for n in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    operations_report = {}
+    for name in names:
+        values = sorted(latencies[name])
+        operations_report[name] = {
+            "count": len(values),
+            "errors": errors[name],
+            "throughput_rps": round(len(values) / elapsed, 2),
+            "mean_ms": round(statistics.fmean(values) * 1000, 3) if values else 0.0,
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+        }
+
+    all_values = sorted(value for values in latencies.values() for value in values)
+    total = {
+        "count": len(all_values),
+        "errors": sum(errors.values()),
+        "throughput_rps": round(len(all_values) / elapsed, 2),
+        "p50_ms": round(percentile(all_values, 50) * 1000, 3),
+        "p95_ms": round(percentile(all_values, 95) * 1000, 3),
+        "p99_ms": round(percentile(all_values, 99) * 1000, 3),
+    }
+    return {"elapsed_seconds": round(elapsed, 3), "operations": operations_report, "total": total}
+
+
+def compare(report: Dict, baseline: Dict, max_regression: float, min_count: int) -> List[str]:
+    """Regressions beyond the allowed ratio, as human-readable lines
+
+    Operations with fewer than min_count samples in either run are shown but
+    not gated: their tail percentiles are a handful of requests and mostly noise.
+    """
+    regressions = []
+    rows = [("total", report["total"], baseline.get("total", {}))]
+    rows += [(name, stats, baseline.get("operations", {}).get(name, {})) for name, stats in report["operations"].items()]
+
+    print(f"\n{'operation':<20} {'metric':<15} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, current, previous in rows:
+        if not previous:
+            continue
+        for metric in COMPARED_LATENCIES + ("throughput_rps",):
+            before, after = previous.get(metric), current.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            # Throughput regresses when it drops, latency when it grows
+            regressed = -change > max_regression if metric == "throughput_rps" else change > max_regression
+            gated = min(current.get("count", 0), previous.get("count", 0)) >= min_count
+            regressed = regressed and gated
+            marker = "  <-- regression" if regressed else ("" if gated else "  (too few samples)")
+            print(f"{name:<20} {metric:<15} {before:>10.2f} {after:>10.2f} {change * 100:>+7.1f}%{marker}")
+            if regressed:
+                regressions.append(f"{name} {metric}: {before} -> {after} ({change * 100:+.1f}%)")
+    return regressions
+
+
+async def run(args) -> Dict:
+    upload_dir = Path(tempfile.mkdtemp(prefix="sls1-bench-uploads-"))
+    server = load_server(args.mongo, args.db_name, upload_dir)
+    rng = random.Random(args.seed)
+
+    import httpx
+
+    async with server.app.router.lifespan_context(server.app):
+        ids = await seed(server, args.projects, args.items, args.list_size, rng)
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.post("/api/auth/login", json={"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD})
+            response.raise_for_status()
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+            operations = build_operations(client, ids, headers, args.list_size, make_image())
+            result = await drive(operations, args.mix, args.concurrency, args.duration, args.warmup, args.seed)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "run_id": str(uuid.uuid4()),
+            "mongo": "mongomock" if args.mongo == "mock" else "mongod",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "dataset": {"projects": args.projects, "items": args.items, "list_size": args.list_size},
+            "concurrency": args.concurrency,
+            "duration_seconds": args.duration,
+            "mix": args.mix,
+        },
+        **result,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mongo", default="mock", help="'mock' for mongomock-motor or a MongoDB URL")
+    parser.add_argument("--db-name", default="sls1_bench")
+    parser.add_argument("--projects", type=int, default=200)
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--list-size", type=int, default=25, help="Line items per project list")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="Unmeasured seconds before the run")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="Operation weights, e.g. login=1,get_project=5")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--baseline", help="Compare against a stored report")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed relative regression (0.2 = 20%%)")
+    parser.add_argument("--min-count", type=int, default=50, help="Samples an operation needs to be gated on")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+
+    print(f"{'operation':<20} {'count':>7} {'err':>5} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, stats in list(report["operations"].items()) + [("total", report["total"])]:
+        print(f"{name:<20} {stats['count']:>7} {stats['errors']:>5} {stats['throughput_rps']:>9.1f} "
+              f"{stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+        print(f"\nReport written to {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare(report, baseline, args.max_regression, args.min_count)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.max_regression * 100:.0f}%:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks: per-document cost of serialization and model hot paths
+
+Covers the work every list/get request does once per document (BSON
+encode/decode with the app's tz-aware codec, Project/InventoryItem
+construction, model_dump), LogEntry construction done by every write, and
+_optimize_image at several image sizes.
+
+Each benchmark is calibrated pyperf-style: the loop count is raised until one
+run takes at least --min-time, then the timing is repeated --repeat times and
+mean/stdev/min per call are reported. With --save the results are appended to
+benchmarks/results/micro_history.jsonl together with the git commit, so the
+per-document cost can be tracked over time; --compare prints the change
+against the last saved entry.
+
+Usage:
+    python benchmarks/micro_benchmarks.py [--filter decode] [--repeat 7]
+        [--save] [--compare] [--history benchmarks/results/micro_history.jsonl]
+"""
+
+import argparse
+import io
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import bson
+from bson.codec_options import CodecOptions
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / 'backend'))
+
+from models import Project, ProjectStatus, InventoryItem, LogEntry  # noqa: E402
+from storage_service import storage_service  # noqa: E402
+
+# Same decoding as the Motor client in server.py
+CODEC_OPTIONS = CodecOptions(tz_aware=True, tzinfo=timezone.utc)
+
+DEFAULT_HISTORY = ROOT_DIR / 'benchmarks' / 'results' / 'micro_history.jsonl'
+
+# Image sizes for _optimize_image: small, full HD, 12 MP phone photo
+IMAGE_SIZES = ((640, 480), (1920, 1080), (4032, 3024))
+
+
+def sample_project(list_size: int = 25) -> Project:
+    items = [
+        {"id": f"inv-{n:03d}", "name": f"Предмет {n}", "category": "Вазы", "quantity": n % 20 + 1, "source": "inventory"}
+        for n in range(list_size)
+    ]
+    return Project(
+        title="Свадьба в усадьбе",
+        lead_decorator="Мария Декораторова",
+        project_date=datetime(2025, 8, 15, 14, 0, tzinfo=timezone.utc),
+        status=ProjectStatus.CREATED,
+        full_details={"venue": "Усадьба Архангельское", "guest_count": 120, "theme": "Классическая свадьба"},
+        preliminary_list={"items": items},
+        final_list={"items": items[: list_size // 2]},
+        dismantling_list={"items": []},
+        created_by="admin-001",
+    )
+
+
+def sample_item() -> InventoryItem:
+    return InventoryItem(
+        category="Вазы",
+        name="Ваза стеклянная большая",
+        total_quantity=25,
+        visual_marker="Синяя наклейка",
+        description="Прозрачная стеклянная ваза, высота 60 см",
+        images=["/api/uploads/inv-001/a.jpg", "/api/uploads/inv-001/b.jpg"],
+    )
+
+
+def sample_image(size: Tuple[int, int]) -> bytes:
+    from PIL import Image
+    buffer = io.BytesIO()
+    # Noise does not compress, so the encoder works as hard as on a real photo
+    Image.effect_noise(size, 64).convert("RGB").save(buffer, "JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def build_benchmarks() -> Dict[str, Callable[[], object]]:
+    project = sample_project()
+    item = sample_item()
+    project_doc = project.model_dump()
+    project_bson = bson.encode(project_doc)
+    item_bson = bson.encode(item.model_dump())
+    stored_project = bson.decode(project_bson, CODEC_OPTIONS)
+    stored_item = bson.decode(item_bson, CODEC_OPTIONS)
+    stored_page = [project_bson] * 100
+
+    benchmarks = {
+        "bson.encode[project]": lambda: bson.encode(project_doc),
+        "bson.decode[project]": lambda: bson.decode(project_bson, CODEC_OPTIONS),
+        "bson.decode[inventory]": lambda: bson.decode(item_bson, CODEC_OPTIONS),
+        "Project(**doc)": lambda: Project(**stored_project),
+        "InventoryItem(**doc)": lambda: InventoryItem(**stored_item),
+        "Project.model_dump": project.model_dump,
+        "Project.model_dump(json)": lambda: project.model_dump(mode="json"),
+        "InventoryItem.model_dump": item.model_dump,
+        "LogEntry()": lambda: LogEntry(
+            user_id="admin-001", user_name="admin@sls1.com", action="UPDATE_PROJECT",
+            entity_type="project", entity_id=project.id, details={"title": project.title},
+        ),
+        # What GET /api/projects does per page of 100 documents, from raw BSON to models
+        "list_projects[100 docs, decode+model]": lambda: [Project(**bson.decode(doc, CODEC_OPTIONS)) for doc in stored_page],
+    }
+
+    for width, height in IMAGE_SIZES:
+        image = sample_image((width, height))
+        benchmarks[f"_optimize_image[{width}x{height}]"] = (lambda data=image: storage_service._optimize_image(data))
+
+    return benchmarks
+
+
+def calibrate(func: Callable, min_time: float) -> int:
+    """Smallest power-of-two loop count whose run takes at least min_time"""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        if time.perf_counter() - start >= min_time or loops >= 1 << 22:
+            return loops
+        loops *= 2
+
+
+def measure(func: Callable, repeat: int, min_time: float) -> Dict[str, float]:
+    """Per-call timings in nanoseconds over `repeat` calibrated runs"""
+    loops = calibrate(func, min_time)
+    runs: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        runs.append((time.perf_counter() - start) / loops * 1e9)
+    return {
+        "mean_ns": round(statistics.fmean(runs), 1),
+        "stdev_ns": round(statistics.stdev(runs), 1) if len(runs) > 1 else 0.0,
+        "min_ns": round(min(runs), 1),
+        "loops": loops,
+    }
+
+
+def format_ns(value: float) -> str:
+    for unit, scale in (("s", 1e9), ("ms", 1e6), ("µs", 1e3)):
+        if value >= scale:
+            return f"{value / scale:.2f} {unit}"
+    return f"{value:.0f} ns"
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def last_entry(history: Path) -> Dict:
+    if not history.exists():
+        return {}
+    lines = [line for line in history.read_text(encoding="utf-8").splitlines() if line.strip()]
+    return json.loads(lines[-1]) if lines else {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--filter", help="Run only benchmarks whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--min-time", type=float, default=0.1, help="Minimum seconds per calibrated run")
+    parser.add_argument("--history", type=Path, default=DEFAULT_HISTORY)
+    parser.add_argument("--save", action="store_true", help="Append the results to the history file")
+    parser.add_argument("--compare", action="store_true", help="Compare with the last saved results")
+    args = parser.parse_args()
+
+    previous = last_entry(args.history).get("results", {}) if args.compare else {}
+    results = {}
+
+    print(f"{'benchmark':<40} {'mean':>12} {'± stdev':>12} {'min':>12}" + (f" {'change':>9}" if previous else ""))
+    for name, func in build_benchmarks().items():
+        if args.filter and args.filter not in name:
+            continue
+        stats = results[name] = measure(func, args.repeat, args.min_time)
+        line = f"{name:<40} {format_ns(stats['mean_ns']):>12} {format_ns(stats['stdev_ns']):>12} {format_ns(stats['min_ns']):>12}"
+        if name in previous:
+            change = (stats["mean_ns"] - previous[name]["mean_ns"]) / previous[name]["mean_ns"]
+            line += f" {change * 100:>+8.1f}%"
+        print(line)
+
+    if args.save:
+        entry = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results,
+        }
+        args.history.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.history, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        print(f"\nResults appended to {args.history}")
+
+
+if __name__ == "__main__":
+    main()
@@ -96,6 +96,12 @@ export const projectsAPI = {
     return response.data;
   },
 
+  // Rows for the projects page: no lists, only their counts
+  getSummary: async () => {
+    const response = await api.get('/projects/summary');
+    return response.data;
+  },
+
   getById: async (id) => {
     const response = await api.get(`/projects/${id}`);
     return response.data;
@@ -125,6 +131,12 @@ export const inventoryAPI = {
     return response.data;
   },
 
+  // Items for many ids in one request: { items: { [id]: item }, missing: [ids] }
+  lookup: async (ids, fields) => {
+    const response = await api.post('/inventory/lookup', { ids, fields });
+    return response.data;
+  },
+
   getById: async (id) => {
     const response = await api.get(`/inventory/${id}`);
     return response.data;
@@ -160,6 +172,21 @@ export const inventoryAPI = {
     return response.data;
   },
 
+  // formData: "files" (one or more) and "item_ids" (one id or one per file)
+  uploadImages: async (formData) => {
+    const response = await axios.post(
+      `${API_URL}/inventory/images/batch`,
+      formData,
+      {
+        headers: {
+          'Content-Type': 'multipart/form-data',
+          'Authorization': `Bearer ${localStorage.getItem('token')}`,
+        },
+      }
+    );
+    return response.data;
+  },
+
   deleteImage: async (itemId, imageUrl) => {
     const response = await api.delete(`/inventory/${itemId}/images`, {
       params: { image_url: imageUrl },
@@ -176,6 +203,12 @@ export const equipmentAPI = {
     return response.data;
   },
 
+  // Items for many ids in one request: { items: { [id]: item }, missing: [ids] }
+  lookup: async (ids, fields) => {
+    const response = await api.post('/equipment/lookup', { ids, fields });
+    return response.data;
+  },
+
   getById: async (id) => {
     const response = await api.get(`/equipment/${id}`);
     return response.data;
@@ -211,6 +244,21 @@ export const equipmentAPI = {
     return response.data;
   },
 
+  // formData: "files" (one or more) and "item_ids" (one id or one per file)
+  uploadImages: async (formData) => {
+    const response = await axios.post(
+      `${API_URL}/equipment/images/batch`,
+      formData,
+      {
+        headers: {
+          'Content-Type': 'multipart/form-data',
+          'Authorization': `Bearer ${localStorage.getItem('token')}`,
+        },
+      }
+    );
+    return response.data;
+  },
+
   deleteImage: async (itemId, imageUrl) => {
     const response = await api.delete(`/equipment/${itemId}/images`, {
       params: { image_url: imageUrl },
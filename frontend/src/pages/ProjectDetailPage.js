@@ -44,8 +44,6 @@ export default function ProjectDetailPage() {
 
   useEffect(() => {
     loadProject();
-    loadInventory();
-    loadEquipment();
   }, [id]);
 
   const loadProject = async () => {
@@ -83,6 +81,9 @@ export default function ProjectDetailPage() {
   };
 
   const openAddDialog = (listType) => {
+    // Списки позиций показываются из сохранённых в проекте копий, каталоги нужны только для выбора
+    if (inventory.length === 0) loadInventory();
+    if (equipment.length === 0) loadEquipment();
     setCurrentList(listType);
     setDialogOpen(true);
     resetForm();
@@ -33,7 +33,7 @@ export default function ProjectsPage() {
 
   const loadProjects = async () => {
     try {
-      const data = await projectsAPI.getAll();
+      const data = await projectsAPI.getSummary();
       setProjects(data);
     } catch (error) {
       toast({
@@ -0,0 +1,57 @@
+import sys
+from pathlib import Path
+
+import mongomock.collection
+
+# moto (S3 tests) uses the "responses" HTTP mocking package, which backend/responses.py
+# shadows: load moto first, then let the backend module take the name
+try:
+    from moto import mock_aws  # noqa: F401
+except ImportError:
+    pass
+sys.modules.pop("responses", None)
+
+# Backend modules are imported flat (as server.py does)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# mongomock gaps the backend relies on
+
+_update_positional = mongomock.collection.Collection._update_document_fields_positional
+
+
+def _update_positional_scalars(self, existing_document, v, spec, updater, subdocument):
+    """
+    mongomock applies "field.$" only to arrays of documents; MongoDB also
+    matches arrays of scalars ({"images": url} + {"$set": {"images.$": new}})
+    """
+    rest = {}
+    for key, value in v.items():
+        field = key[:-2] if key.endswith(".$") else None
+        array = existing_document.get(field) if field and "." not in field else None
+        if isinstance(array, list) and field in spec and not isinstance(spec[field], dict):
+            if spec[field] in array:
+                array[array.index(spec[field])] = value
+        else:
+            rest[key] = value
+    if not rest:
+        return subdocument
+    return _update_positional(self, existing_document, rest, spec, updater, subdocument)
+
+
+mongomock.collection.Collection._update_document_fields_positional = _update_positional_scalars
+
+_find_and_modify = mongomock.collection.Collection._find_and_modify
+
+
+def _find_and_modify_without_id(self, query, projection=None, *args, **kwargs):
+    """mongomock re-runs the filter for ReturnDocument.AFTER when the projection drops _id"""
+    drop_id = isinstance(projection, dict) and projection.get("_id") == 0
+    if drop_id:
+        projection = {key: value for key, value in projection.items() if key != "_id"} or None
+    result = _find_and_modify(self, query, projection, *args, **kwargs)
+    if drop_id and result:
+        result.pop("_id", None)
+    return result
+
+
+mongomock.collection.Collection._find_and_modify = _find_and_modify_without_id
@@ -0,0 +1,174 @@
+"""
+Paging of GET /api/sync (DeltaSync over mongomock-motor)
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from delta_sync import DeltaSync, InvalidSyncToken, SyncPosition, decode_token, encode_token
+
+LIMIT = 10
+
+
+def millisecond(ago: timedelta) -> datetime:
+    """A stored timestamp (BSON dates keep milliseconds)"""
+    value = datetime.now(timezone.utc) - ago
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+
+async def delta_sync():
+    db = AsyncMongoMockClient()["delta_sync_test"]
+    sync = DeltaSync(db)
+    await sync.start()
+    return db, sync
+
+
+async def insert(db, collection, prefix, count, updated_at):
+    await db[collection].insert_many([
+        {"id": f"{prefix}{n:03d}", "name": f"{prefix}{n}", "updated_at": updated_at, "version": 1}
+        for n in range(count)
+    ])
+
+
+async def sync_all(sync, token=None, between_pages=None):
+    """Follow has_more to the end; returns the pages and the last token"""
+    pages = []
+    while True:
+        page = await sync.changes(token, LIMIT)
+        pages.append(page)
+        token = page["token"]
+        if not page["has_more"]:
+            return pages, token
+        assert len(pages) < 50, "paging does not end"
+        if between_pages:
+            await between_pages(len(pages))
+
+
+def ids(pages, collection):
+    return {doc["id"] for page in pages for doc in page[collection]}
+
+
+def deleted(pages, collection):
+    return {entity_id for page in pages for entity_id in page["deleted"][collection]}
+
+
+def test_snapshot_pages_documents_sharing_a_millisecond():
+    async def scenario():
+        db, sync = await delta_sync()
+        moment = millisecond(timedelta(minutes=1))
+        await insert(db, "projects", "p", 25, moment)
+        await insert(db, "inventory", "i", 7, moment)
+
+        pages, token = await sync_all(sync)
+        assert [page["reset"] for page in pages] == [True, False, False]
+        assert ids(pages, "projects") == {f"p{n:03d}" for n in range(25)}
+        assert ids(pages, "inventory") == {f"i{n:03d}" for n in range(7)}
+        # Each page continues after the last project sent, not from the millisecond again
+        assert [len(page["projects"]) for page in pages] == [10, 10, 5]
+
+        # The snapshot hands over to ordinary changes from when it started
+        position = decode_token(token)
+        assert position.snapshot is None and position.after == {}
+
+    asyncio.run(scenario())
+
+
+def test_delta_pages_collections_with_different_page_ends():
+    async def scenario():
+        db, sync = await delta_sync()
+        _, token = await sync_all(sync)
+
+        early, late = millisecond(timedelta(seconds=2)), millisecond(timedelta(seconds=1))
+        await insert(db, "inventory", "i", 15, early)
+        await insert(db, "projects", "p", 12, late)
+        await insert(db, "equipment", "e", 12, late)
+
+        pages, token = await sync_all(sync, token)
+        assert not any(page["reset"] for page in pages)
+        assert ids(pages, "inventory") == {f"i{n:03d}" for n in range(15)}
+        assert ids(pages, "projects") == {f"p{n:03d}" for n in range(12)}
+        assert ids(pages, "equipment") == {f"e{n:03d}" for n in range(12)}
+
+        # The first page ends on the earlier inventory millisecond: only inventory has a cursor there
+        first = decode_token(pages[0]["token"])
+        assert first.watermark == early and set(first.after) == {"inventory"}
+        # ...and the later collections are re-read from it, as the overlap allows
+        assert ids(pages[:2], "projects") == ids(pages[:1], "projects")
+
+        # Syncing again within the overlap window re-reads the last millisecond, and still ends
+        again, _ = await sync_all(sync, token)
+        assert ids(again, "projects") == ids(pages, "projects") and not ids(again, "inventory")
+
+    asyncio.run(scenario())
+
+
+def test_tombstones_page_and_deletions_during_a_snapshot_follow_it():
+    async def scenario():
+        db, sync = await delta_sync()
+        await insert(db, "projects", "p", 25, millisecond(timedelta(minutes=1)))
+
+        async def delete_some(page_number):
+            if page_number == 1:
+                for n in range(12):
+                    await db.projects.delete_one({"id": f"p{n:03d}"})
+                    await sync.record_deletion("projects", f"p{n:03d}")
+
+        pages, token = await sync_all(sync, between_pages=delete_some)
+        assert pages[0]["reset"]
+        assert deleted(pages, "projects") == set()
+
+        # The deletions (more than a page of them, likely within one millisecond) follow as changes
+        pages, _ = await sync_all(sync, token)
+        assert deleted(pages, "projects") == {f"p{n:03d}" for n in range(12)}
+        assert len(pages) >= 2
+
+    asyncio.run(scenario())
+
+
+def test_expired_token_resets():
+    async def scenario():
+        _, sync = await delta_sync()
+        expired = encode_token(SyncPosition(datetime.now(timezone.utc) - sync.retention - timedelta(days=1)))
+        page = await sync.changes(expired, LIMIT)
+        assert page["reset"]
+
+    asyncio.run(scenario())
+
+
+def test_reset_invalidates_earlier_tokens():
+    async def scenario():
+        db, sync = await delta_sync()
+        await insert(db, "projects", "p", 3, millisecond(timedelta(minutes=1)))
+        _, before = await sync_all(sync)
+        await sync.record_deletion("projects", "p000")
+
+        await sync.reset()
+        assert await db.tombstones.count_documents({}) == 0
+        pages, after = await sync_all(sync, before)
+        assert pages[0]["reset"] and ids(pages, "projects") == {"p000", "p001", "p002"}
+        # A snapshot started after the reset hands over to ordinary changes
+        await asyncio.sleep(0.01)
+        _, after = await sync_all(sync, after)
+        assert not (await sync.changes(after, LIMIT))["reset"]
+
+    asyncio.run(scenario())
+
+
+def test_token_round_trip():
+    moment = millisecond(timedelta(0))
+    position = decode_token(encode_token(SyncPosition(moment, {"projects": "p1", "tombstones": "0" * 24}, moment)))
+    assert (position.watermark, position.after, position.snapshot) == (
+        moment, {"projects": "p1", "tombstones": "0" * 24}, moment
+    )
+    # Plain millisecond tokens handed out before the cursor was added stay valid
+    legacy = decode_token(str(int(moment.timestamp() * 1000)))
+    assert legacy.watermark == moment and legacy.after == {} and legacy.snapshot is None
+
+
+@pytest.mark.parametrize("token", ["abc", "-5", "123.!!", "123.eyJhZnRlciI6IDF9", "123.eyJhZnRlciI6IHsidG9tYnN0b25lcyI6ICJ4In19"])
+def test_invalid_tokens(token):
+    with pytest.raises(InvalidSyncToken):
+        decode_token(token)
@@ -0,0 +1,136 @@
+"""
+JSON Patch / Merge Patch application and their compilation to MongoDB updates
+"""
+
+import pytest
+
+from json_patch import PatchError, PatchTestFailed, apply_json_patch, apply_merge_patch, compile_update
+from json_patch import test_conditions as repeated_tests
+
+DOCUMENT = {
+    "title": "Wedding",
+    "status": "Создан",
+    "full_details": {"venue": "Hall", "guests": 80, "a/b": 1, "m~n": 2},
+    "items": ["chair", "table", "lamp"],
+}
+
+
+@pytest.mark.parametrize("operations, changes", [
+    ([{"op": "add", "path": "/full_details/date", "value": "2026-11-01"}],
+     {"full_details": {**DOCUMENT["full_details"], "date": "2026-11-01"}}),
+    ([{"op": "add", "path": "/items/-", "value": "tent"}], {"items": ["chair", "table", "lamp", "tent"]}),
+    ([{"op": "add", "path": "/items/1", "value": "tent"}], {"items": ["chair", "tent", "table", "lamp"]}),
+    ([{"op": "add", "path": "/items/3", "value": "tent"}], {"items": ["chair", "table", "lamp", "tent"]}),
+    ([{"op": "remove", "path": "/items/0"}], {"items": ["table", "lamp"]}),
+    ([{"op": "remove", "path": "/full_details/a~1b"}],
+     {"full_details": {"venue": "Hall", "guests": 80, "m~n": 2}}),
+    ([{"op": "replace", "path": "/full_details/m~0n", "value": 3}],
+     {"full_details": {**DOCUMENT["full_details"], "m~n": 3}}),
+    ([{"op": "replace", "path": "/title", "value": "Gala"}], {"title": "Gala"}),
+    ([{"op": "move", "from": "/items/0", "path": "/items/-"}], {"items": ["table", "lamp", "chair"]}),
+    ([{"op": "move", "from": "/full_details/venue", "path": "/title"}],
+     {"title": "Hall", "full_details": {"guests": 80, "a/b": 1, "m~n": 2}}),
+    ([{"op": "copy", "from": "/items/2", "path": "/items/0"}], {"items": ["lamp", "chair", "table", "lamp"]}),
+    ([{"op": "test", "path": "/full_details/guests", "value": 80},
+      {"op": "replace", "path": "/full_details/guests", "value": 90}],
+     {"full_details": {**DOCUMENT["full_details"], "guests": 90}}),
+    ([{"op": "replace", "path": "/title", "value": "X"}, {"op": "test", "path": "/title", "value": "X"}],
+     {"title": "X"}),
+])
+def test_apply_json_patch(operations, changes):
+    assert apply_json_patch(DOCUMENT, operations) == {**DOCUMENT, **changes}
+
+
+@pytest.mark.parametrize("operations, error", [
+    ({"op": "add", "path": "/title", "value": 1}, PatchError),
+    ([{"op": "add", "path": "/title"}], PatchError),
+    ([{"path": "/title", "value": 1}], PatchError),
+    ([{"op": "jump", "path": "/title"}], PatchError),
+    ([{"op": "add", "path": "title", "value": 1}], PatchError),
+    ([{"op": "add", "path": "/items/4", "value": "x"}], PatchError),
+    ([{"op": "add", "path": "/items/01", "value": "x"}], PatchError),
+    ([{"op": "replace", "path": "/items/3", "value": "x"}], PatchError),
+    ([{"op": "replace", "path": "/items/-", "value": "x"}], PatchError),
+    ([{"op": "remove", "path": "/items/-"}], PatchError),
+    ([{"op": "remove", "path": "/missing"}], PatchError),
+    ([{"op": "remove", "path": ""}], PatchError),
+    ([{"op": "add", "path": "/title/x", "value": 1}], PatchError),
+    ([{"op": "move", "path": "/title"}], PatchError),
+    ([{"op": "move", "from": "/full_details", "path": "/full_details/inner"}], PatchError),
+    ([{"op": "test", "path": "/title", "value": "Gala"}], PatchTestFailed),
+    # "80" is not 80
+    ([{"op": "test", "path": "/full_details/guests", "value": "80"}], PatchTestFailed),
+])
+def test_json_patch_errors(operations, error):
+    with pytest.raises(error):
+        apply_json_patch(DOCUMENT, operations)
+    # The document is never changed in place
+    assert DOCUMENT["items"] == ["chair", "table", "lamp"]
+
+
+@pytest.mark.parametrize("patch, expected", [
+    ({"title": "Gala"}, {**DOCUMENT, "title": "Gala"}),
+    ({"full_details": {"guests": None, "date": "2026-11-01"}},
+     {**DOCUMENT, "full_details": {"venue": "Hall", "a/b": 1, "m~n": 2, "date": "2026-11-01"}}),
+    ({"title": None, "missing": None}, {key: value for key, value in DOCUMENT.items() if key != "title"}),
+    ({"items": ["tent"]}, {**DOCUMENT, "items": ["tent"]}),
+    ({"title": {"ru": None, "en": "Gala"}}, {**DOCUMENT, "title": {"en": "Gala"}}),
+])
+def test_apply_merge_patch(patch, expected):
+    assert apply_merge_patch(DOCUMENT, patch) == expected
+
+
+@pytest.mark.parametrize("old, new, update, conditions", [
+    ({"title": "A"}, {"title": "B"}, {"$set": {"title": "B"}}, {}),
+    ({"title": "A"}, {}, {"$unset": {"title": ""}}, {}),
+    ({"d": {"a": 1, "b": 2}}, {"d": {"a": 1, "c": 3}}, {"$set": {"d.c": 3}, "$unset": {"d.b": ""}}, {}),
+    # Same value, different JSON type
+    ({"d": {"n": 1}}, {"d": {"n": 1.0}}, {"$set": {"d.n": 1.0}}, {}),
+    ({"d": {"n": 1}}, {"d": {"n": True}}, {"$set": {"d.n": True}}, {}),
+    # Keys that cannot be dotted paths: the whole object
+    ({"d": {"a.b": 1}}, {"d": {"a.b": 2}}, {"$set": {"d": {"a.b": 2}}}, {}),
+    # Grown at the end
+    ({"items": [1, 2]}, {"items": [1, 2, 3, 4]}, {"$push": {"items": {"$each": [3, 4]}}}, {}),
+    # Same length: changed elements by index, each conditional on the element read
+    ({"items": [1, 2, 3]}, {"items": [1, 5, 3]}, {"$set": {"items.1": 5}}, {"items.1": 2}),
+    ({"items": [{"q": 1, "n": "a"}]}, {"items": [{"q": 2, "n": "a"}]},
+     {"$set": {"items.0.q": 2}}, {"items.0": {"q": 1, "n": "a"}}),
+    # Anything else: the whole array, conditional on the array read
+    ({"items": [1, 2, 3]}, {"items": [2, 3]}, {"$set": {"items": [2, 3]}}, {"items": [1, 2, 3]}),
+    ({"items": [1, 2]}, {"items": [0, 1, 2]}, {"$set": {"items": [0, 1, 2]}}, {"items": [1, 2]}),
+    ({"items": [1, 2]}, {"items": None}, {"$set": {"items": None}}, {"items": [1, 2]}),
+    ({"title": "A"}, {"title": "A"}, {}, {}),
+])
+def test_compile_update(old, new, update, conditions):
+    assert compile_update(old, new) == (update, conditions)
+
+
+@pytest.mark.parametrize("operations, conditions", [
+    ([{"op": "test", "path": "/status", "value": "Создан"}], {"status": "Создан"}),
+    ([{"op": "test", "path": "/full_details/guests", "value": 80}], {"full_details.guests": 80}),
+    # Objects and arrays are compared in memory only
+    ([{"op": "test", "path": "/items", "value": ["chair"]}], {}),
+    # Not a dotted path
+    ([{"op": "test", "path": "/full_details/a.b", "value": 1}], {}),
+    # Same path written before the test
+    ([{"op": "replace", "path": "/title", "value": "X"}, {"op": "test", "path": "/title", "value": "X"}], {}),
+    # Parent written
+    ([{"op": "add", "path": "/full_details", "value": {"guests": 1}},
+      {"op": "test", "path": "/full_details/guests", "value": 1}], {}),
+    # Child written
+    ([{"op": "remove", "path": "/full_details/guests"}, {"op": "test", "path": "/full_details", "value": 1}], {}),
+    # Source of a move
+    ([{"op": "move", "from": "/title", "path": "/name"}, {"op": "test", "path": "/title", "value": "X"}], {}),
+    # Array insertion shifts the elements after it
+    ([{"op": "add", "path": "/items/0", "value": "tent"}, {"op": "test", "path": "/items/2", "value": "table"}], {}),
+    # Unrelated writes, and tests before the write
+    ([{"op": "test", "path": "/title", "value": "Wedding"},
+      {"op": "replace", "path": "/title", "value": "Gala"},
+      {"op": "replace", "path": "/full_details/venue", "value": "Park"},
+      {"op": "test", "path": "/full_details/guests", "value": 80},
+      {"op": "test", "path": "/status", "value": "Создан"}],
+     {"title": "Wedding", "full_details.guests": 80, "status": "Создан"}),
+])
+def test_test_conditions(operations, conditions):
+    apply_json_patch({**DOCUMENT, "name": None}, [op for op in operations if op["op"] != "test"])
+    assert repeated_tests(operations) == conditions
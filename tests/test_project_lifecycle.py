@@ -0,0 +1,80 @@
+"""
+Reservations of the project lifecycle in the stock ledger (mongomock-motor)
+"""
+
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from models import StockMovementKind
+from project_lifecycle import ProjectLifecycle
+from stock_ledger import StockLedger
+
+ITEM = "inv-1"
+
+
+async def approved_project(quantity, total=10):
+    """An item of total units and a project reserving quantity of them"""
+    db = AsyncMongoMockClient()["lifecycle_test"]
+    stock = StockLedger(db)
+    lifecycle = ProjectLifecycle(db, stock=stock)
+    await db.inventory.insert_one({"id": ITEM, "name": "Chair", "total_quantity": total})
+    await db.projects.insert_one({"id": "p1", "final_list": {"items": [
+        {"id": ITEM, "line_id": "l1", "source": "inventory", "name": "Chair", "quantity": quantity},
+    ]}})
+    await lifecycle.reserve_final_list("p1")
+    return stock, lifecycle
+
+
+def counters(levels):
+    return {name: levels[name] for name in ("on_hand", "reserved", "out", "available")}
+
+
+def test_breakdown_after_issue_and_return_releases_nothing():
+    async def scenario():
+        stock, lifecycle = await approved_project(5)
+        assert counters(await stock.get_levels("inventory", ITEM)) == {
+            "on_hand": 10, "reserved": 5, "out": 0, "available": 5
+        }
+        await stock.record("inventory", ITEM, StockMovementKind.ISSUE, 5, project_id="p1")
+        await stock.record("inventory", ITEM, StockMovementKind.RETURN, 5, project_id="p1")
+        assert await stock.reserved_for("inventory", ITEM, "p1") == 0
+
+        await lifecycle.release_reservations("p1")
+        assert counters(await stock.get_levels("inventory", ITEM)) == {
+            "on_hand": 10, "reserved": 0, "out": 0, "available": 10
+        }
+        kinds = [movement["kind"] for movement in await stock.history("inventory", ITEM)]
+        assert StockMovementKind.RELEASE.value not in kinds
+
+    asyncio.run(scenario())
+
+
+def test_breakdown_releases_what_was_not_issued():
+    async def scenario():
+        stock, lifecycle = await approved_project(5)
+        await stock.record("inventory", ITEM, StockMovementKind.ISSUE, 3, project_id="p1")
+
+        await lifecycle.release_reservations("p1")
+        assert counters(await stock.get_levels("inventory", ITEM)) == {
+            "on_hand": 10, "reserved": 0, "out": 3, "available": 7
+        }
+        assert await stock.reserved_for("inventory", ITEM, "p1") == 0
+
+    asyncio.run(scenario())
+
+
+def test_release_does_not_take_other_projects_reservations():
+    async def scenario():
+        stock, lifecycle = await approved_project(4)
+        await stock.record("inventory", ITEM, StockMovementKind.RESERVE, 2, project_id="p2")
+        # Issued without naming the project: the project's share stays reserved
+        await stock.record("inventory", ITEM, StockMovementKind.ISSUE, 4)
+
+        await lifecycle.release_reservations("p1")
+        levels = await stock.get_levels("inventory", ITEM)
+        # Only 2 units are still reserved (p2's): the release is guarded and skipped
+        assert levels["reserved"] == 2 and levels["available"] == 4
+        assert await stock.reserved_for("inventory", ITEM, "p2") == 2
+
+    asyncio.run(scenario())
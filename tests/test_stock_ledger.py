@@ -0,0 +1,254 @@
+"""
+Stock ledger counters, recovery and compaction (mongomock-motor)
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from models import StockMovementKind
+from stock_ledger import COUNTERS, InsufficientStock, StockLedger
+
+ITEM = "inv-1"
+# compact_after folding every movement recorded so far (stored times are rounded to milliseconds)
+EVERYTHING = timedelta(seconds=-1)
+
+
+async def ledger(total=10):
+    db = AsyncMongoMockClient()["stock_ledger_test"]
+    stock = StockLedger(db)
+    await stock.start()
+    await stock.stop()
+    await db.inventory.insert_one({"id": ITEM, "name": "Chair", "total_quantity": total})
+    return db, stock
+
+
+class Interleaved:
+    """
+    A collection whose calls first yield to the event loop
+
+    mongomock-motor never suspends, so concurrent coroutines would otherwise
+    run one after the other and never race.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.conflicts = 0
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(0)
+            result = await method(*args, **kwargs)
+            if name == "find_one_and_update" and result is None:
+                self.conflicts += 1
+            return result
+        return call
+
+
+async def counters(stock):
+    levels = await stock.get_levels("inventory", ITEM)
+    return {name: levels[name] for name in (*COUNTERS, "seq")}
+
+
+async def seqs(stock):
+    return sorted([movement["seq"] async for movement in stock.movements.find({"item_id": ITEM})])
+
+
+def test_opening_and_movements():
+    async def scenario():
+        _, stock = await ledger()
+        assert await counters(stock) == {
+            "on_hand": 10, "reserved": 0, "out": 0, "damaged": 0, "available": 10, "seq": 0
+        }
+        for kind, quantity in [("reserve", 4), ("issue", 4), ("damage", 1), ("repair", 1), ("return", 2)]:
+            await stock.record("inventory", ITEM, StockMovementKind(kind), quantity)
+        assert await counters(stock) == {
+            "on_hand": 10, "reserved": 0, "out": 1, "damaged": 0, "available": 9, "seq": 5
+        }
+        assert [movement["kind"] for movement in await stock.history("inventory", ITEM, limit=2)] == ["return", "repair"]
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("moves, rejected", [
+    ([], ("reserve", 11)),
+    ([("reserve", 3)], ("issue", 4)),
+    ([("reserve", 3), ("issue", 3)], ("return", 4)),
+    ([], ("release", 1)),
+    ([], ("repair", 1)),
+    ([("reserve", 2), ("issue", 2), ("damage", 2)], ("scrap", 3)),
+])
+def test_guards_reject_negative_counters(moves, rejected):
+    async def scenario():
+        _, stock = await ledger()
+        for kind, quantity in moves:
+            await stock.record("inventory", ITEM, StockMovementKind(kind), quantity)
+        before = await counters(stock)
+        with pytest.raises(InsufficientStock):
+            await stock.record("inventory", ITEM, StockMovementKind(rejected[0]), rejected[1])
+        assert await counters(stock) == before
+        assert await seqs(stock) == list(range(1, len(moves) + 1))
+
+    asyncio.run(scenario())
+
+
+def test_unenforced_movement_goes_negative():
+    async def scenario():
+        _, stock = await ledger(total=2)
+        await stock.record("inventory", ITEM, StockMovementKind.RESERVE, 3, enforce=False)
+        assert (await counters(stock))["available"] == -1
+
+    asyncio.run(scenario())
+
+
+def test_unknown_item():
+    async def scenario():
+        _, stock = await ledger()
+        assert await stock.get_levels("inventory", "nope") is None
+        with pytest.raises(LookupError):
+            await stock.record("inventory", "nope", StockMovementKind.RECEIVE, 1)
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_movements_retry_on_seq():
+    async def scenario():
+        _, stock = await ledger(total=10)
+        await stock.get_levels("inventory", ITEM)
+        stock.levels = Interleaved(stock.levels)
+        results = await asyncio.gather(*[
+            stock.record("inventory", ITEM, StockMovementKind.RESERVE, 1) for _ in range(15)
+        ], return_exceptions=True)
+
+        # Every reservation saw the counters left by the previous one: 10 fit, 5 are rejected
+        assert sum(isinstance(result, InsufficientStock) for result in results) == 5
+        assert stock.levels.conflicts > 0
+        assert await counters(stock) == {
+            "on_hand": 10, "reserved": 10, "out": 0, "damaged": 0, "available": 0, "seq": 10
+        }
+        assert await seqs(stock) == list(range(1, 11))
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_adjusts_keep_on_hand_equal_to_a_total():
+    async def scenario():
+        _, stock = await ledger(total=10)
+        await stock.get_levels("inventory", ITEM)
+        stock.levels = Interleaved(stock.levels)
+        await asyncio.gather(
+            stock.adjust("inventory", ITEM, 10, 14),
+            stock.adjust("inventory", ITEM, 10, 7),
+            stock.adjust("inventory", ITEM, 10, 12),
+        )
+        levels = await counters(stock)
+        # The movements add up to exactly one of the edits
+        movements = await stock.history("inventory", ITEM)
+        assert levels["on_hand"] == 10 + sum(movement["quantity"] for movement in movements)
+        assert levels["on_hand"] == levels["available"]
+        assert levels["on_hand"] in (14, 7, 12)
+
+        await stock.adjust("inventory", ITEM, levels["on_hand"], levels["on_hand"])
+        assert (await counters(stock))["seq"] == levels["seq"]
+
+    asyncio.run(scenario())
+
+
+def test_compaction_folds_old_movements():
+    async def scenario():
+        _, stock = await ledger()
+        for kind, quantity in [("reserve", 4), ("issue", 3), ("receive", 5), ("damage", 2)]:
+            await stock.record("inventory", ITEM, StockMovementKind(kind), quantity)
+        old = datetime.now(timezone.utc) - timedelta(days=30)
+        await stock.movements.update_many({"item_id": ITEM, "seq": {"$lte": 3}}, {"$set": {"at": old}})
+
+        assert await stock.compact() == 1
+        snapshot = await stock.snapshots.find_one({"item_id": ITEM, "seq": 3}, {"_id": 0})
+        assert snapshot["levels"] == {"on_hand": 15, "reserved": 1, "out": 3, "damaged": 0, "available": 11}
+        assert snapshot["movements"] == 3
+        # Nothing older is left to fold
+        assert await stock.compact() == 0
+
+        # Snapshot plus the newer movement gives the current counters
+        stock.compact_after = EVERYTHING
+        assert await stock.compact() == 1
+        latest = await stock.snapshots.find({"item_id": ITEM}).sort("seq", -1).to_list(1)
+        current = await counters(stock)
+        assert latest[0]["seq"] == 4
+        assert latest[0]["levels"] == {name: current[name] for name in COUNTERS}
+
+    asyncio.run(scenario())
+
+
+def test_retention_removes_folded_movements():
+    async def scenario():
+        _, stock = await ledger()
+        for _ in range(3):
+            await stock.record("inventory", ITEM, StockMovementKind.RECEIVE, 1)
+        stock.compact_after = EVERYTHING
+        stock.retention = timedelta(microseconds=1)
+        await asyncio.sleep(0.01)
+
+        assert await stock.compact() == 1
+        assert await seqs(stock) == []
+        assert (await counters(stock))["on_hand"] == 13
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("lost", [[1], [2], [3], [1, 3]])
+def test_compaction_restores_lost_movements(lost):
+    """A movement whose insert was lost after the counter update, the newest included"""
+    async def scenario():
+        _, stock = await ledger()
+        for _ in range(3):
+            await stock.record("inventory", ITEM, StockMovementKind.RESERVE, 2)
+        await stock.movements.delete_many({"item_id": ITEM, "seq": {"$in": lost}})
+        stock.compact_after = EVERYTHING
+
+        assert await stock.compact() == 1
+        assert await seqs(stock) == [1, 2, 3]
+        snapshot = await stock.snapshots.find({"item_id": ITEM}).sort("seq", -1).to_list(1)
+        assert snapshot[0]["seq"] == 3 and snapshot[0]["levels"]["reserved"] == 6
+
+    asyncio.run(scenario())
+
+
+def test_movement_beyond_recent_is_not_invented():
+    async def scenario():
+        _, stock = await ledger()
+        for _ in range(3):
+            await stock.record("inventory", ITEM, StockMovementKind.RECEIVE, 1)
+        await stock.movements.delete_one({"item_id": ITEM, "seq": 2})
+        await stock.levels.update_one({"item_id": ITEM}, {"$set": {"recent": []}})
+        stock.compact_after = EVERYTHING
+
+        # Folding stops at the gap
+        assert await stock.compact() == 1
+        assert await seqs(stock) == [1, 3]
+        latest = await stock.snapshots.find({"item_id": ITEM}).sort("seq", -1).to_list(1)
+        assert latest[0]["seq"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_forget_deleted_item():
+    async def scenario():
+        db, stock = await ledger()
+        await stock.record("inventory", ITEM, StockMovementKind.RESERVE, 2)
+        await db.inventory.delete_one({"id": ITEM})
+        await stock.forget("inventory", ITEM)
+
+        assert await stock.levels.count_documents({"item_id": ITEM}) == 0
+        assert await stock.snapshots.count_documents({"item_id": ITEM}) == 0
+        # Movements stay for audit
+        assert await seqs(stock) == [1]
+        with pytest.raises(LookupError):
+            await stock.record("inventory", ITEM, StockMovementKind.RESERVE, 1)
+        assert await stock.compact() == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,155 @@
+"""
+GridFS (mongomock-motor) and S3 (moto) storage backends
+"""
+
+import asyncio
+import builtins
+import os
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient, enabled_gridfs_integration
+
+import storage_backends
+from storage_backends import GridFSBackend, LocalBackend
+from storage_service import StorageService
+from upload_queue import UploadQueue
+
+BUCKET = "sls1-test-images"
+
+
+async def read_stream(backend, image_url):
+    stream = await backend.open_stream(image_url)
+    if stream is None:
+        return None
+    chunks, content_type, length = stream
+    return b"".join([chunk async for chunk in chunks]), content_type, length
+
+
+@pytest.fixture
+def s3_backend(monkeypatch):
+    moto = pytest.importorskip("moto")
+    pytest.importorskip("boto3")
+    from storage_backends import S3Backend
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("S3_BUCKET", BUCKET)
+    monkeypatch.setenv("S3_REGION", "us-east-1")
+    monkeypatch.delenv("S3_ENDPOINT_URL", raising=False)
+    with moto.mock_aws():
+        # The smallest part S3 accepts is 5 MB
+        backend = S3Backend({"s3_storage": {"multipart_threshold_mb": 5, "multipart_chunksize_mb": 5}})
+        backend.client.create_bucket(Bucket=BUCKET)
+        yield backend
+
+
+def test_s3_save_stream_delete(s3_backend):
+    async def scenario():
+        url = await s3_backend.save(b"jpeg bytes", "photo.JPG", "item1")
+        assert url.startswith("/api/files/s3/images/item1/") and url.endswith(".jpg")
+        assert s3_backend.owns(url)
+
+        assert await read_stream(s3_backend, url) == (b"jpeg bytes", "image/jpeg", 10)
+
+        assert await s3_backend.delete(url)
+        assert await read_stream(s3_backend, url) is None
+
+    asyncio.run(scenario())
+
+
+def test_s3_multipart_upload(s3_backend):
+    content = bytes(range(256)) * (11 * 1024 * 1024 // 256)
+
+    async def scenario():
+        url = await s3_backend.save(content, "large.png", "item1")
+        data, content_type, length = await read_stream(s3_backend, url)
+        assert (data == content, content_type, length) == (True, "image/png", len(content))
+
+    asyncio.run(scenario())
+    objects = s3_backend.client.list_objects_v2(Bucket=BUCKET)["Contents"]
+    etag = s3_backend.client.head_object(Bucket=BUCKET, Key=objects[0]["Key"])["ETag"]
+    # Multipart ETags end in -<number of parts>
+    assert etag.strip('"').endswith("-3")
+
+
+def test_s3_list_and_delete_many(s3_backend):
+    async def scenario():
+        urls = [await s3_backend.save(b"x", f"{n}.jpg", "item1") for n in range(3)]
+        other = await s3_backend.save(b"y", "other.jpg", "item2")
+
+        assert await s3_backend.list_item_images("item1") == sorted(urls)
+        assert await s3_backend.delete_many(urls + ["/api/uploads/item1/local.jpg"]) == 3
+        assert await s3_backend.list_item_images("item1") == []
+        assert await s3_backend.list_item_images("item2") == [other]
+
+    asyncio.run(scenario())
+
+
+def test_s3_keys_outside_prefix(s3_backend):
+    assert s3_backend._key("/api/files/s3/images/item1/a.jpg") == "images/item1/a.jpg"
+    assert s3_backend._key("/api/files/s3/other/a.jpg") is None
+    assert s3_backend._key("/api/files/s3/images/../secret.txt") is None
+    assert asyncio.run(s3_backend.open_stream("/api/files/s3/other/a.jpg")) is None
+
+
+def test_gridfs_save_stream_delete():
+    async def scenario():
+        backend = GridFSBackend({"gridfs_storage": {"chunk_size_bytes": 1024}})
+        db = AsyncMongoMockClient()["gridfs_test"]
+        backend.bind_database(db)
+
+        content = bytes(range(256)) * 20
+        url = await backend.save(content, "photo.jpg", "item1")
+        assert url.startswith("/api/files/gridfs/")
+        assert await db["images.chunks"].count_documents({}) == 5
+
+        assert await read_stream(backend, url) == (content, "image/jpeg", len(content))
+
+        assert await backend.delete(url)
+        assert not await backend.delete(url)
+        assert await read_stream(backend, url) is None
+        assert await read_stream(backend, "/api/files/gridfs/not-an-id") is None
+
+    with enabled_gridfs_integration():
+        asyncio.run(scenario())
+
+
+def test_local_save_recreates_a_swept_directory(tmp_path, monkeypatch):
+    """The storage GC may remove an old empty item directory between save's mkdir and open"""
+    backend = LocalBackend({"local_storage": {"upload_dir": str(tmp_path)}})
+    (tmp_path / "item1").mkdir()
+    swept = []
+
+    def open_after_sweep(path, *args, **kwargs):
+        if not swept:
+            swept.append(path)
+            os.rmdir(os.path.dirname(path))
+        return builtins.open(path, *args, **kwargs)
+
+    monkeypatch.setattr(storage_backends, "open", open_after_sweep, raising=False)
+    url = asyncio.run(backend.save(b"jpeg bytes", "photo.jpg", "item1"))
+
+    assert swept and (tmp_path / "item1" / url.rsplit("/", 1)[1]).read_bytes() == b"jpeg bytes"
+
+
+def test_shared_backends_skip_upload_queue(s3_backend, tmp_path):
+    """Files go straight to S3/GridFS: a staged file would only exist on one instance's disk"""
+    storage = StorageService()
+    storage.mode = "s3"
+    storage.backend = s3_backend
+    storage.config = {
+        **storage.config,
+        "upload_queue": {**storage.config.get("upload_queue", {}), "enabled": True},
+    }
+    assert not GridFSBackend.use_upload_queue
+
+    async def scenario():
+        queue = UploadQueue(AsyncMongoMockClient()["queue_test"], storage)
+        assert not queue.enabled
+
+        url = await queue.save_image(b"not an image", "photo.jpg", "item1")
+        assert url.startswith("/api/files/s3/")
+        assert await queue.enqueue(url, "item1", "inventory", "photo.jpg") is None
+        assert (await read_stream(s3_backend, url))[0] == b"not an image"
+
+    asyncio.run(scenario())
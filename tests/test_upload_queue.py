@@ -0,0 +1,201 @@
+"""
+Upload queue against a local fake Telegram Bot API (TELEGRAM_API_URL)
+
+The fake answers sendPhoto / sendMediaGroup like Telegram, counts requests
+and rejects a whole media group when one photo in it is bad, as Telegram does.
+A group with a "short" photo is sent but answered with one message missing.
+"""
+
+import asyncio
+import io
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from aiohttp import web
+from mongomock_motor import AsyncMongoMockClient
+from PIL import Image
+
+from storage_backends import LocalBackend, TelegramBackend
+from storage_service import StorageService
+from upload_queue import UploadQueue
+
+BOT_TOKEN = "123:test"
+# Simulated Bot API round trip
+LATENCY_SECONDS = 0.02
+
+
+class FakeBotAPI:
+    def __init__(self):
+        self.requests = {"sendPhoto": 0, "sendMediaGroup": 0, "deleteMessages": 0}
+        self.photos = 0
+        self.deleted = []
+        self.next_message_id = 1
+        self.app = web.Application()
+        self.app.router.add_post(f"/bot{BOT_TOKEN}/sendPhoto", self.send_photo)
+        self.app.router.add_post(f"/bot{BOT_TOKEN}/sendMediaGroup", self.send_media_group)
+        self.app.router.add_post(f"/bot{BOT_TOKEN}/deleteMessages", self.delete_messages)
+
+    def _message(self):
+        message_id = self.next_message_id
+        self.next_message_id += 1
+        return {"message_id": message_id, "photo": [{"file_id": f"file{message_id}", "file_size": 100}]}
+
+    @staticmethod
+    def _rejected():
+        return web.json_response(
+            {"ok": False, "error_code": 400, "description": "Bad Request: IMAGE_PROCESS_FAILED"}, status=400
+        )
+
+    async def send_photo(self, request):
+        self.requests["sendPhoto"] += 1
+        form = await request.post()
+        await asyncio.sleep(LATENCY_SECONDS)
+        if "bad" in form.get("caption", ""):
+            return self._rejected()
+        self.photos += 1
+        return web.json_response({"ok": True, "result": self._message()})
+
+    async def send_media_group(self, request):
+        self.requests["sendMediaGroup"] += 1
+        form = await request.post()
+        media = json.loads(form["media"])
+        await asyncio.sleep(LATENCY_SECONDS)
+        if any("bad" in entry.get("caption", "") for entry in media):
+            return self._rejected()
+        messages = [self._message() for _ in media]
+        if any("short" in entry.get("caption", "") for entry in media):
+            messages.pop()
+        self.photos += len(messages)
+        return web.json_response({"ok": True, "result": messages})
+
+    async def delete_messages(self, request):
+        self.requests["deleteMessages"] += 1
+        body = await request.json()
+        self.deleted.extend(body["message_ids"])
+        self.photos -= len(body["message_ids"])
+        return web.json_response({"ok": True, "result": True})
+
+
+def jpeg() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 30), (20, 120, 200)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+async def run_queue(tmp_path, monkeypatch, filenames, timeout=30):
+    """Stage one photo per filename on its own item, run the queue until every job is finished"""
+    api = FakeBotAPI()
+    runner = web.AppRunner(api.app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    monkeypatch.setenv("TELEGRAM_API_URL", f"http://{host}:{port}")
+    monkeypatch.setenv("TELEGRAM_BOT_TOKEN", BOT_TOKEN)
+    monkeypatch.setenv("TELEGRAM_CHAT_ID", "-100")
+
+    storage = StorageService()
+    storage.mode = "telegram"
+    storage.config = {
+        **storage.config,
+        "local_storage": {**storage.config["local_storage"], "upload_dir": str(tmp_path)},
+        "upload_queue": {
+            "enabled": True, "workers": 2, "batch_size": 10,
+            "base_delay_seconds": 0.01, "poll_interval_seconds": 0.05,
+        },
+    }
+    storage.upload_dir = tmp_path
+    storage.local = LocalBackend(storage.config)
+    storage.backend = TelegramBackend(storage.config)
+
+    db = AsyncMongoMockClient()["upload_queue_test"]
+    queue = UploadQueue(db, storage)
+    assert queue.enabled
+
+    content = jpeg()
+    for n, filename in enumerate(filenames):
+        item_id = f"item{n}"
+        url = await queue.save_image(content, filename, item_id)
+        await db.inventory.insert_one({"id": item_id, "images": [url], "version": 1})
+        await queue.enqueue(url, item_id, "inventory", filename)
+
+    started = time.perf_counter()
+    await queue.start()
+    try:
+        deadline = started + timeout
+        while await db.upload_jobs.count_documents({"status": {"$in": ["pending", "processing"]}}):
+            assert time.perf_counter() < deadline, "upload queue did not drain"
+            await asyncio.sleep(0.02)
+    finally:
+        await queue.stop()
+        await runner.cleanup()
+
+    jobs = {job["filename"]: job async for job in db.upload_jobs.find({}, {"_id": 0})}
+    items = {item["id"]: item async for item in db.inventory.find({}, {"_id": 0})}
+    return api, jobs, items
+
+
+def test_media_groups_batch_uploads(tmp_path, monkeypatch):
+    photos = 60
+    api, jobs, items = asyncio.run(
+        run_queue(tmp_path, monkeypatch, [f"photo{n}.jpg" for n in range(photos)])
+    )
+
+    assert {job["status"] for job in jobs.values()} == {"done"}
+    assert all(item["images"][0].startswith("telegram:") for item in items.values())
+    assert api.photos == photos
+    # Two workers claim concurrently, so some groups are short, but far from one request per photo
+    requests = api.requests["sendMediaGroup"] + api.requests["sendPhoto"]
+    assert requests <= photos // 4
+
+
+def test_rejected_photo_fails_alone(tmp_path, monkeypatch):
+    filenames = ["photo0.jpg", "photo1.jpg", "bad.jpg", "photo3.jpg", "photo4.jpg"]
+    api, jobs, items = asyncio.run(run_queue(tmp_path, monkeypatch, filenames))
+
+    assert jobs["bad.jpg"]["status"] == "failed"
+    assert "IMAGE_PROCESS_FAILED" in jobs["bad.jpg"]["last_error"]
+    assert all(jobs[name]["status"] == "done" for name in filenames if name != "bad.jpg")
+    assert api.photos == len(filenames) - 1
+    # The rejected photo keeps its local URL
+    assert items["item2"]["images"][0].startswith("/api/uploads/")
+
+
+def test_incomplete_media_group_is_not_sent_twice(tmp_path, monkeypatch):
+    filenames = ["photo0.jpg", "short.jpg", "photo2.jpg"]
+    api, jobs, items = asyncio.run(run_queue(tmp_path, monkeypatch, filenames))
+
+    assert {job["status"] for job in jobs.values()} == {"done"}
+    # The messages of the incomplete group were deleted before the photos went up one by one
+    assert api.requests["deleteMessages"] == 1 and len(api.deleted) == 2
+    assert api.photos == len(filenames)
+    assert all(item["images"][0].startswith("telegram:") for item in items.values())
+
+
+def test_expired_lease_cannot_finish_a_reclaimed_job():
+    async def scenario():
+        db = AsyncMongoMockClient()["upload_queue_test"]
+        queue = UploadQueue(db, StorageService())
+        now = datetime.now(timezone.utc)
+        await db.upload_jobs.insert_one({
+            "id": "job1", "item_id": "item1", "collection": "inventory", "image_url": "/api/uploads/item1/a.jpg",
+            "filename": "a.jpg", "status": "pending", "attempts": 0, "next_attempt_at": now, "lease_until": None,
+        })
+
+        stale = await queue._claim()
+        await db.upload_jobs.update_one({"id": "job1"}, {"$set": {"lease_until": now - timedelta(seconds=1)}})
+        current = await queue._claim()
+        assert current["lease_id"] != stale["lease_id"]
+
+        await queue._finish(stale, "failed", error="too late")
+        await queue._retry(stale, "too late")
+        job = await db.upload_jobs.find_one({"id": "job1"})
+        assert job["status"] == "processing" and job["lease_id"] == current["lease_id"]
+
+        await queue._finish(current, "done", remote_url="telegram:file1")
+        job = await db.upload_jobs.find_one({"id": "job1"})
+        assert (job["status"], job["remote_url"], job["lease_id"]) == ("done", "telegram:file1", None)
+
+    asyncio.run(scenario())